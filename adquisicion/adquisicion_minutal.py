@@ -1,32 +1,307 @@
 """
 Modulo para la adquisición de datos minutales de los caudalímetros desde la API de la red de distribución.
+
+`AdquisicionMinutal` descarga en streaming: un productor asyncio con un número
+acotado de workers (`fetch_api_data.workers`) reparte los lotes de UIDs del
+descargador (`download_minute_data.plan_download`, mismo índice de tags, caché
+minutal y ventanas) y entrega el frame de cada caudalímetro (pares `_TOT_H` /
+`_TOT_L` juntos) en cuanto termina su lote. Así el procesado puede empezar con
+los primeros medidores mientras el resto se sigue descargando.
+
+La cola de salida está acotada (`fetch_api_data.stream_queue_size`): si el
+consumidor va más lento, los workers esperan antes de descargar el siguiente
+lote, de modo que en memoria hay como mucho `workers` lotes en curso más los
+frames de la cola.
+
+    python adquisicion/adquisicion_minutal.py   # descarga y cadena minutal por medidor
 """
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from adquisicion.download_minute_data import (
+    _fetch_batch,
+    _get_fetch_task,
+    _make_batches,
+    _pair_key,
+    batch_windows,
+    open_minute_cache,
+    plan_download,
+)
+from adquisicion.http_pool import PooledClient
+
+CONFIG_PATH = os.path.join(ROOT, "consums_config.json")
+
+
+class _Done:
+    """End marker of a worker (or of the whole stream), carrying its error if any."""
 
-# Importar la conectividad del submódulo
-# from CAT_Conexions.api import obtener_totalizadores_minutales
+    def __init__(self, error=None):
+        self.error = error
 
 
 class AdquisicionMinutal:
-    def __init__(self, api_client):
+    def __init__(self, api_client=None, cfg=None, concurrency=None, queue_size=None, report=None):
+        """
+        Args:
+            api_client: cliente HTTP con `post()` (por defecto, un `PooledClient` propio).
+            cfg (dict): configuración; por defecto se lee `consums_config.json`.
+            concurrency (int): lotes descargándose a la vez (por defecto `fetch_api_data.workers`).
+            queue_size (int): frames de caudalímetro en espera como máximo.
+            report: `RunReport` opcional donde se anota tiempo y filas/s de descarga por tag.
+        """
+        if cfg is None:
+            with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+                cfg = json.load(f)
+        self.cfg = cfg
         self.api_client = api_client
+        self.report = report
+        fetch_task = _get_fetch_task(cfg)
+        self.concurrency = max(1, int(concurrency or fetch_task.get('workers') or 4))
+        self.queue_size = max(1, int(queue_size or fetch_task.get('stream_queue_size') or 2 * self.concurrency))
+        self.missing = []
+        # (tag, (start_ts, end_ts)) de las ventanas que fallaron: sus frames salen con ese hueco
+        self.failed = []
+
+    def _plan(self, caudalimetros):
+        plan = plan_download(self.cfg)
+        if plan is None:
+            return None
+        jobs = plan['jobs']
+        if caudalimetros is not None:
+            wanted = set(caudalimetros)
+            jobs = [job for job in jobs if job[0] in wanted or _pair_key(job[0]) in wanted]
+        fetch_task = plan['fetch_task']
+        plan['batches'] = _make_batches(jobs, max(1, int(fetch_task.get('batch_size') or 1)))
+        plan['cache'], plan['covered_until'] = (
+            open_minute_cache(self.cfg, jobs) if fetch_task.get('cache', False) else (None, None))
+        self.missing = list(plan['missing'])
+        self.failed = []
+        return plan
+
+    async def _download_batch(self, client, batch, plan):
+        """{tag: frame} of a batch over the whole period (cached parts plus downloaded windows).
+
+        A window that fails is recorded in `self.failed` for every tag of the
+        batch and is not marked as covered in the cache, so it is requested
+        again on the next run; the frames of the batch are partial.
+        """
+        cache = plan['cache']
+        start_ts, end_ts = plan['start_ts'], plan['end_ts']
+        parts = {}
+        windows = batch_windows(batch, start_ts, end_ts, plan['fetch_task'].get('window_days'), cache)
+        for w_start, w_end in windows:
+            t0 = time.perf_counter()
+            try:
+                frames = await asyncio.to_thread(_fetch_batch, client, plan['url'], plan['headers'], batch,
+                                                 w_start, w_end, plan['resolution'])
+            except Exception as e:
+                logging.exception("Error al descargar datos para %s: %s", [tag for tag, _, _ in batch], e)
+                frames = None
+            if self.report is not None:
+                share = (time.perf_counter() - t0) / len(batch)
+                for tag, _, _ in batch:
+                    df = (frames or {}).get(tag)
+                    self.report.record_tag_time('fetch', tag, share, 0 if df is None else len(df))
+            if frames is None:
+                self.failed.extend((tag, (w_start, w_end)) for tag, _, _ in batch)
+                continue
+            for tag, _, _ in batch:
+                if cache is not None:
+                    await asyncio.to_thread(cache.store, tag, frames.get(tag), w_start, w_end,
+                                            covered_until=plan['covered_until'])
+                elif tag in frames:
+                    parts.setdefault(tag, []).append(frames[tag])
+
+        result = {}
+        for tag, _, _ in batch:
+            if cache is not None:
+                df = await asyncio.to_thread(cache.load, tag, start_ts, end_ts)
+            elif tag in parts:
+                df = parts[tag][0] if len(parts[tag]) == 1 else pd.concat(parts[tag])
+            else:
+                df = None
+            if df is not None:
+                result[tag] = df
+        return result
+
+    @staticmethod
+    def _meter_frames(batch, frames):
+        """(meter, frame) per caudalímetro of the batch; H/L halves side by side."""
+        meters = {}
+        for tag, _, _ in batch:
+            meters.setdefault(_pair_key(tag), []).append(tag)
+        for meter, tags in meters.items():
+            cols = [frames[tag] for tag in tags if tag in frames]
+            if cols:
+                yield meter, cols[0] if len(cols) == 1 else pd.concat(cols, axis=1)
+
+    async def _worker(self, client, work, out, plan):
+        error = None
+        try:
+            while not work.empty():
+                batch = work.get_nowait()
+                frames = await self._download_batch(client, batch, plan)
+                for item in self._meter_frames(batch, frames):
+                    await out.put(item)
+        except Exception as e:
+            error = e
+        await out.put(_Done(error))
+
+    async def iter_caudalimetros(self, caudalimetros=None):
+        """Async generator of (caudalímetro, frame) as each meter finishes downloading.
+
+        Args:
+            caudalimetros (list): tags o caudalímetros (nombre sin `_TOT_H`/`_TOT_L`)
+                a descargar; por defecto, todas las señales de la configuración.
+        """
+        plan = self._plan(caudalimetros)
+        if plan is None or not plan['batches']:
+            return
+        client = self.api_client
+        own_client = client is None
+        if own_client:
+            client = PooledClient(pool_size=self.concurrency,
+                                  rate_limit=plan['fetch_task'].get('rate_limit_per_sec'))
+
+        work = asyncio.Queue()
+        for batch in plan['batches']:
+            work.put_nowait(batch)
+        out = asyncio.Queue(maxsize=self.queue_size)
+        workers = [asyncio.create_task(self._worker(client, work, out, plan))
+                   for _ in range(min(self.concurrency, len(plan['batches'])))]
+        logging.info("Descarga en streaming: %d workers, %d lotes", len(workers), len(plan['batches']))
+        try:
+            pending = len(workers)
+            while pending:
+                item = await out.get()
+                if isinstance(item, _Done):
+                    pending -= 1
+                    if item.error is not None:
+                        raise item.error
+                    continue
+                yield item
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if own_client:
+                client.close()
+
+    def iter_datos_minutales(self, caudalimetros=None):
+        """Synchronous generator over `iter_caudalimetros`, run on an event loop in a background thread."""
+        items = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+
+        async def put(item):
+            while not stop.is_set():
+                try:
+                    items.put_nowait(item)
+                    return True
+                except queue.Full:
+                    await asyncio.sleep(0.05)
+            return False
+
+        async def pump():
+            error = None
+            try:
+                async with contextlib.aclosing(self.iter_caudalimetros(caudalimetros)) as stream:
+                    async for item in stream:
+                        if not await put(item):
+                            break
+            except Exception as e:
+                error = e
+            await put(_Done(error))
+
+        thread = threading.Thread(target=lambda: asyncio.run(pump()), daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = items.get()
+                if isinstance(item, _Done):
+                    if item.error is not None:
+                        raise item.error
+                    return
+                yield item
+        finally:
+            stop.set()
+            thread.join()
 
     def obtener_datos_minutales(self, caudalimetros):
         """
         Consulta los totalizadores minutales para los caudalímetros indicados.
         Args:
-            caudalimetros (list): Lista de identificadores de caudalímetros.
+            caudalimetros (list): Lista de identificadores de caudalímetros (tags o nombres sin `_TOT_H`/`_TOT_L`).
         Returns:
-            dict: Diccionario con los datos minutales por caudalímetro.
+            dict: Diccionario con los datos minutales por caudalímetro (None si no hay datos).
         """
-        datos = {}
-        for id_caudalimetro in caudalimetros:
-            # datos[id_caudalimetro] = self.api_client.get_totalizador_minutal(id_caudalimetro)
-            datos[id_caudalimetro] = None  # Implementar llamada real a la API
+        datos = {id_caudalimetro: None for id_caudalimetro in caudalimetros}
+        for meter, frame in self.iter_datos_minutales(caudalimetros):
+            if meter in datos:
+                datos[meter] = frame
+            for tag in frame.columns:
+                if tag in datos:
+                    datos[tag] = frame[[tag]]
         return datos
 
 
-# Ejemplo de uso (ajustar según la API real)
-# api = obtener_totalizadores_minutales()
-# adquisicion = AdquisicionMinutal(api)
-# datos = adquisicion.obtener_datos_minutales(["caudal1", "caudal2"])
-# print(datos)
+def main():
+    """Download in streaming and run the minute chain on each meter as soon as it arrives."""
+    from procesado.compute_consumption import compute_minute_chain
+    from procesado.counter_registry import CounterRegistry
+    from procesado.instrumentation import configure_logging, report_from_config
+    from procesado.storage import save_frame, storage_settings
+
+    with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+        cfg = json.load(f)
+    report = report_from_config(cfg, 'adquisicion_minutal')
+    adquisicion = AdquisicionMinutal(cfg=cfg, report=report)
+    configure_logging(cfg.get('instrumentation', {}).get('verbose', False))
+    compute_cfg = cfg.get('postprocess', {}).get('compute', {})
+    registry_path = compute_cfg.get('counter_registry')
+    if registry_path and not os.path.isabs(registry_path):
+        registry_path = os.path.join(ROOT, registry_path)
+    registry = CounterRegistry.load(registry_path)
+
+    results = []
+    for meter, frame in adquisicion.iter_datos_minutales():
+        # Cada medidor se procesa sobre sus propias marcas de tiempo
+        with report.tag_timer('compute', meter, rows=len(frame)):
+            results.append(compute_minute_chain(frame, anomaly_rule=compute_cfg.get('anomaly_rule', 'pair_run'),
+                                                thresholds=compute_cfg.get('reset_thresholds'), registry=registry))
+        logging.info("Caudalímetro %s procesado (%d filas)", meter, len(frame))
+    registry.save()
+    if adquisicion.missing:
+        logging.warning("Se encontraron tags faltantes: %s", adquisicion.missing)
+    if adquisicion.failed:
+        logging.warning("%d ventanas (tag, ventana) fallaron; sus medidores tienen huecos: %s",
+                        len(adquisicion.failed), sorted({tag for tag, _ in adquisicion.failed}))
+    if not results:
+        logging.error("No se han descargado datos minutales")
+        return 1
+
+    fmt, compression, _ = storage_settings(cfg)
+    stem = os.path.join(ROOT, 'procesado', 'Data',
+                        f"consumption_minutes_with_anom_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    path = save_frame(pd.concat(results, axis=1), stem, fmt, compression)
+    print(f"Consumos minutales guardados en {path}")
+    if cfg.get('instrumentation', {}).get('report', True):
+        print(f"Informe de ejecución en {report.write(os.path.join(ROOT, 'procesado', 'Data'))}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""
+Manifiesto de checkpoints para descargas por ventanas temporales.
+
+Cada descarga larga se divide en ventanas; cuando una ventana de un tag termina
+se guarda su resultado en disco y se anota el par (tag, ventana) en un
+manifiesto JSON. Si la ejecución se interrumpe, la siguiente reanuda desde las
+ventanas pendientes en lugar de empezar de cero.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+import pandas as pd
+
+
+def window_key(window):
+    """Stable string key for a (start_ts, end_ts) window."""
+    return f"{int(window[0])}-{int(window[1])}"
+
+
+class CheckpointManifest:
+    """Record of completed (tag, window) pairs for one download run.
+
+    The run is identified by `run_params` (vista, period, resolution, window
+    size...), so a change in configuration never resumes a stale checkpoint.
+    Completed parts are stored as pickles to keep dtypes and index unchanged.
+    """
+
+    def __init__(self, base_dir, run_params):
+        digest = hashlib.sha1(json.dumps(run_params, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+        self.run_dir = os.path.join(base_dir, digest)
+        self.manifest_path = os.path.join(self.run_dir, "manifest.json")
+        self._lock = threading.Lock()
+        self._done = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            self._done = {tag: set(windows) for tag, windows in manifest.get("completed", {}).items()}
+        self._params = run_params
+
+    def _part_path(self, tag, window):
+        return os.path.join(self.run_dir, tag, f"{window_key(window)}.pkl")
+
+    def is_done(self, tags, window):
+        key = window_key(window)
+        with self._lock:
+            return all(key in self._done.get(tag, ()) for tag in tags)
+
+    def completed_count(self):
+        with self._lock:
+            return sum(len(windows) for windows in self._done.values())
+
+    def load(self, tags, window):
+        """Return {tag: frame} for a completed window (tags without data are omitted)."""
+        frames = {}
+        for tag in tags:
+            path = self._part_path(tag, window)
+            if os.path.exists(path):
+                frames[tag] = pd.read_pickle(path)
+        return frames
+
+    def save(self, tags, window, frames):
+        """Persist the frames of a finished window and mark its tags as done."""
+        for tag in tags:
+            df = frames.get(tag)
+            if df is not None:
+                path = self._part_path(tag, window)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                df.to_pickle(path)
+
+        key = window_key(window)
+        with self._lock:
+            for tag in tags:
+                self._done.setdefault(tag, set()).add(key)
+            self._write()
+
+    def _write(self):
+        os.makedirs(self.run_dir, exist_ok=True)
+        manifest = {
+            "params": self._params,
+            "completed": {tag: sorted(windows) for tag, windows in self._done.items()},
+        }
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def clear(self):
+        """Remove the checkpoint once the run has finished successfully."""
+        with self._lock:
+            self._done = {}
+            shutil.rmtree(self.run_dir, ignore_errors=True)
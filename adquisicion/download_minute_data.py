@@ -2,8 +2,11 @@ import os
 import sys
 import json
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+import numpy as np
 import pandas as pd
 
 # Ajustar path para importar submódulo
@@ -14,21 +17,273 @@ if os.path.join(ROOT, "CAT_Conexions", "src") not in sys.path:
     sys.path.insert(0, os.path.join(ROOT, "CAT_Conexions", "src"))
 
 from conexions import apiSagedCAT
+from adquisicion.checkpoint import CheckpointManifest
+from adquisicion.http_pool import PooledClient
+from adquisicion.minute_cache import MinuteCache, merge_intervals
+from adquisicion.tag_index import load_tag_index
+from procesado.tag_store import LongTagFrame
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
 
+TICKS_PER_SECOND = {'s': 1, 'ms': 10 ** 3, 'us': 10 ** 6, 'ns': 10 ** 9}
 
-def download_minute_data(cfg=None):
-    """Download minute data according to configuration and return combined DataFrame.
 
-    Returns (combined_df or None, missing list)
+def _get_fetch_task(cfg):
+    for task in cfg.get('tasks', []):
+        if task.get('name') == 'fetch_api_data':
+            return task
+    return {}
+
+
+def _epoch_seconds_index(seconds):
+    """DatetimeIndex over epoch seconds; integer seconds are viewed as datetime64[s], not parsed."""
+    values = np.asarray(seconds)
+    if values.dtype.kind in 'iu':
+        return pd.DatetimeIndex(values.astype(np.int64, copy=False).view('datetime64[s]'), name=seconds.name)
+    return pd.to_datetime(seconds, unit='s')
+
+
+def _frame_from_response(data, tag):
+    """Convert a normalized historic response into a one-column frame named `tag`.
+
+    Raises ValueError on an unrecognised shape: an unparsed response is a
+    failed request, not an empty one.
     """
-    # Load config if not provided
-    if cfg is None:
-        CONFIG_PATH = os.path.join(ROOT, "consums_config.json")
-        with open(CONFIG_PATH, "r", encoding="utf-8") as f:
-            cfg = json.load(f)
+    if 'timeStamp' in data.columns and 'value' in data.columns:
+        df = data.set_index('timeStamp')[['value']]
+        df.index = _epoch_seconds_index(df.index)
+        df.rename(columns={'value': tag}, inplace=True)
+        return df
+
+    # intentar detectar columna de valor
+    val_cols = [c for c in data.columns if c.lower() in ('value', 'valor')]
+    if val_cols:
+        df = data.set_index('timeStamp')[[val_cols[0]]]
+        df.index = _epoch_seconds_index(df.index)
+        df.rename(columns={val_cols[0]: tag}, inplace=True)
+        return df
+
+    raise ValueError(f"Respuesta inesperada para {tag}, columnas: {list(data.columns)}")
+
+
+def align_minute_frames(frames, epoch):
+    """Wide frame of the tag `frames` placed on the integer minute grid from `epoch`.
+
+    Timestamps become integer minute offsets, `(ts - epoch) // 60` on the raw
+    ticks of each index (epoch seconds for API frames), and every value is
+    scattered into one preallocated (minutes x tags) array, instead of the outer join of
+    `pd.concat(frames, axis=1)`. For on-grid data the result is identical to
+    the concat: the index is the sorted union of minutes with data, and an
+    integer column without gaps keeps its integer dtype.
+    Off-grid timestamps are floored to their minute and a (tag, minute) seen
+    twice keeps the last reading; both are counted.
+
+    Returns (frame, stats) with `stats` = {readings, minutes, off_grid, duplicates}.
+    """
+    epoch_s = pd.Timestamp(epoch).floor('min').value // TICKS_PER_SECOND['ns']
+    columns, offsets, values, dtypes = [], [], [], []
+    units = set()
+    stats = {'readings': 0, 'minutes': 0, 'off_grid': 0, 'duplicates': 0}
+    for frame in frames:
+        unit = frame.index.unit
+        per_minute = 60 * TICKS_PER_SECOND[unit]
+        ticks = frame.index.asi8 - epoch_s * TICKS_PER_SECOND[unit]
+        minute = ticks // per_minute
+        stats['off_grid'] += int(np.count_nonzero(ticks - minute * per_minute))
+        units.add(unit)
+        for col in frame.columns:
+            numeric = pd.to_numeric(frame[col], errors='coerce')
+            columns.append(col)
+            offsets.append(minute)
+            values.append(numeric.to_numpy(dtype=float))
+            dtypes.append(numeric.dtype)
+    stats['readings'] = int(sum(len(m) for m in offsets))
+
+    filled = [m for m in offsets if len(m)]
+    lo = min((int(m.min()) for m in filled), default=0)
+    hi = max((int(m.max()) for m in filled), default=-1)
+    occupied = np.zeros(hi - lo + 1, dtype=bool)
+    for minute in filled:
+        occupied[minute - lo] = True
+    row_of = np.cumsum(occupied) - 1
+    n_rows = int(occupied.sum())
+
+    data = np.full((n_rows, len(columns)), np.nan)
+    for j, (minute, vals) in enumerate(zip(offsets, values)):
+        if not len(minute):
+            continue
+        rows = row_of[minute - lo]
+        if len(rows) > 1 and not np.all(np.diff(rows) > 0):
+            # Minutos repetidos: se conserva explícitamente la última lectura de cada uno
+            _, last = np.unique(rows[::-1], return_index=True)
+            keep = len(rows) - 1 - last
+            stats['duplicates'] += int(len(rows) - len(keep))
+            rows, vals = rows[keep], vals[keep]
+        data[rows, j] = vals
+    stats['minutes'] = n_rows
+
+    names = {f.index.name for f in frames}
+    stamps = (epoch_s + (lo + np.flatnonzero(occupied)) * 60).view('datetime64[s]')
+    # Minutos contiguos: misma frecuencia que infiere el concat
+    index = pd.DatetimeIndex(stamps, name=names.pop() if len(names) == 1 else None,
+                             freq='min' if 1 < n_rows == len(occupied) else None)
+    index = index.as_unit(units.pop() if len(units) == 1 else 'ns')
+    if stats['off_grid'] or stats['duplicates']:
+        logging.warning("Alineación minutal: %d lecturas fuera de minuto exacto y %d repetidas (se conserva la última)",
+                        stats['off_grid'], stats['duplicates'])
+    combined = pd.DataFrame(data, index=index, columns=columns)
+    # Como el concat: las columnas enteras que no han recibido huecos siguen siendo enteras
+    integer = {col: dtype for col, dtype in zip(columns, dtypes)
+               if pd.api.types.is_integer_dtype(dtype) and not combined[col].isna().any()}
+    if integer:
+        combined = combined.astype(integer)
+    return combined, stats
+
+
+def _pair_key(tag):
+    """Base name shared by a `_TOT_H`/`_TOT_L` pair (the tag itself otherwise)."""
+    for suffix in ('_TOT_H', '_TOT_L'):
+        if tag.endswith(suffix):
+            return tag[:-len(suffix)]
+    return tag
+
+
+def _make_batches(jobs, batch_size):
+    """Group download jobs into batches of up to `batch_size` UIDs.
+
+    Both halves of a `_TOT_H`/`_TOT_L` pair always land in the same batch, so a
+    batch may hold one UID more than `batch_size` when a pair would be split.
+    """
+    groups = {}
+    for job in jobs:
+        groups.setdefault(_pair_key(job[0]), []).append(job)
+
+    batches = []
+    current = []
+    for group in groups.values():
+        if current and len(current) + len(group) > batch_size:
+            batches.append(current)
+            current = []
+        current.extend(group)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _split_batch_response(payload, batch):
+    """Split a (possibly multi-UID) historic response into per-tag frames.
+
+    Raises ValueError if a multi-UID response has no recognised UID column, so
+    the caller never takes an unknown shape for "no data".
+    """
+    uid_tags = {}
+    for tag, _, uid in batch:
+        uid_tags.setdefault(uid, []).append(tag)
+
+    data = pd.json_normalize(payload)
+    if data.empty:
+        return {}
+
+    uid_col = next((c for c in ('uid', 'tagUid', 'tagId', 'id') if c in data.columns), None)
+    nested = next((c for c in ('values', 'data', 'historic') if c in data.columns), None)
+    if len(uid_tags) == 1 and (uid_col is None or nested is None):
+        # Un único UID: filas planas (con o sin columna de UID)
+        parts = {next(iter(uid_tags)): data.drop(columns=[uid_col]) if uid_col else data}
+    else:
+        if uid_col is None:
+            raise ValueError(f"Respuesta multi-UID sin columna de UID, columnas: {list(data.columns)}")
+        if nested is not None:
+            # Respuesta anidada: una entrada por UID con su lista de valores
+            data = pd.json_normalize(payload, record_path=nested, meta=[uid_col])
+        parts = {uid: group.drop(columns=[uid_col]) for uid, group in data.groupby(uid_col, sort=False)}
+
+    frames = {}
+    for uid, part in parts.items():
+        for tag in uid_tags.get(uid, []):
+            frames[tag] = _frame_from_response(part, tag)
+    return frames
 
+
+def _split_windows(start_ts, end_ts, window_days=None):
+    """Split [start_ts, end_ts] into consecutive, non-overlapping (start, end) windows.
+
+    Window ends are inclusive, so each window stops one second before the next
+    one starts. Without `window_days` the whole period is a single window.
+    """
+    if not window_days:
+        return [(start_ts, end_ts)]
+    step = float(window_days) * 86400
+    windows = []
+    w_start = start_ts
+    while w_start <= end_ts:
+        w_end = min(w_start + step - 1, end_ts)
+        windows.append((w_start, w_end))
+        w_start += step
+    return windows
+
+
+def _fetch_batch(client, url, headers, batch, start_ts, end_ts, resolution):
+    """POST one historic request for all UIDs in `batch`; return {tag: frame}.
+
+    If a multi-UID response has an unrecognised shape the batch is requested
+    again one UID at a time.
+    """
+    uids = list(dict.fromkeys(uid for _, _, uid in batch))
+    params = {
+        "dataSource": "RAW",
+        "resolution": resolution,
+        "uids": uids,
+        "startTs": start_ts,
+        "endTs": end_ts,
+    }
+    response = client.post(url, json=params, headers=headers)
+    response.raise_for_status()
+    try:
+        frames = _split_batch_response(response.json(), batch)
+    except ValueError as e:
+        if len(uids) == 1:
+            raise
+        logging.warning("%s; se repite el lote UID a UID", e)
+        frames = {}
+        for uid in uids:
+            frames.update(_fetch_batch(client, url, headers, [job for job in batch if job[2] == uid],
+                                       start_ts, end_ts, resolution))
+    for tag, _, _ in batch:
+        if tag not in frames:
+            logging.debug("No hay datos para %s", tag)
+    return frames
+
+
+def open_minute_cache(cfg, jobs):
+    """(MinuteCache, covered_until) of the fetch task, with the forced requery hours invalidated."""
+    fetch_task = _get_fetch_task(cfg)
+    cache = MinuteCache(fetch_task.get('cache_dir'))
+    requery_hours = cfg.get('postprocess', {}).get('compute', {}).get('force_minute_requery_hours', [])
+    if requery_hours:
+        logging.info("Invalidando en caché las horas forzadas: %s", requery_hours)
+        cache.invalidate(requery_hours, tags=[tag for tag, _, _ in jobs])
+    # No marcar como cubiertos los minutos recientes que la API aún puede completar
+    covered_until = datetime.now().timestamp() - 60 * float(fetch_task.get('cache_settle_minutes', 60))
+    return cache, covered_until
+
+
+def batch_windows(batch, start_ts, end_ts, window_days=None, cache=None):
+    """Request windows of `batch`: the whole period, or only the gaps missing from `cache`."""
+    if cache is not None:
+        gaps = merge_intervals(
+            [list(gap) for tag, _, _ in batch for gap in cache.missing_ranges(tag, start_ts, end_ts)])
+    else:
+        gaps = [(start_ts, end_ts)]
+    return [window for g_start, g_end in gaps for window in _split_windows(g_start, g_end, window_days)]
+
+
+def plan_download(cfg):
+    """Resolve the tags of the config to (tag, request_name, uid) jobs plus request settings.
+
+    Returns a dict with the API client, endpoint URL and headers, the period
+    (text and epoch seconds), the fetch task, `jobs` in signal-file order and
+    `missing` tags; None when there is nothing to download.
+    """
     api_cfg = cfg.get("api", {})
     base_url = api_cfg.get("base_url")
     if not base_url:
@@ -50,11 +305,8 @@ def download_minute_data(cfg=None):
     signals_file = os.path.join(os.path.dirname(__file__), "senales_para_descarga.txt")
 
     # Determinar comportamiento según filtro en la config
-    filter_prefix = None
-    for task in cfg.get('tasks', []):
-        if task.get('name') == 'fetch_api_data':
-            filter_prefix = task.get('filter')
-            break
+    fetch_task = _get_fetch_task(cfg)
+    filter_prefix = fetch_task.get('filter')
 
     use_all = False
     if filter_prefix is None or str(filter_prefix).strip() == "":
@@ -70,7 +322,7 @@ def download_minute_data(cfg=None):
 
         if not tags:
             logging.info("No hay tags en %s", signals_file)
-            return None, []
+            return None
 
         # Aplicar filtro de configuración sobre la lista de señales (subcadena)
         if filter_prefix:
@@ -79,111 +331,202 @@ def download_minute_data(cfg=None):
             logging.info("Filtro '%s' aplicado a señales: %d -> %d", filter_prefix, orig_count, len(tags))
             if not tags:
                 logging.warning("No hay señales que contengan '%s' en %s", filter_prefix, signals_file)
-                return None, []
+                return None
     else:
         tags = None
 
-    # Obtener tags disponibles en la vista
-    logging.info("Solicitando listado de tags desde la vista %s", vista)
-    try:
-        uids_df = api.get_Tags_from_vista(vista)
-    except Exception as e:
-        logging.exception("Error obteniendo tags desde la vista: %s", e)
-        raise
-
-    # Construir mapa tag -> uid
-    tag_uid_map = {}
-    for index, row in uids_df.iterrows():
-        for element in row.get('columns', []):
-            name = element.get('name')
-            uid = element.get('uid')
-            if name and uid:
-                tag_uid_map[name] = uid
-
-    # Directorio de salida
-    out_dir = os.path.join(os.path.dirname(__file__), "minute_data")
-    os.makedirs(out_dir, exist_ok=True)
+    # Índice tag -> UID de la vista (persistente; sólo se pide a la API al caducar)
+    tag_index = load_tag_index(api, vista, base_dir=fetch_task.get('tag_index_dir'),
+                               ttl_hours=fetch_task.get('tag_index_ttl_hours', 24))
 
-    combined = []
     missing = []
 
     if use_all:
         logging.info("Filter vacío en config: se descargarán todos los tags de la vista")
-        tags = sorted(tag_uid_map.keys())
+        tags = tag_index.names()
 
+    # Resolver UIDs antes de lanzar descargas (mantiene el orden de `tags`)
+    jobs = []
     for tag in tags:
-        # The API stores tag names with prefix 'CL_CAT_'. Try direct match first,
-        # then try with the prefix. Keep the original `tag` as label/filename.
-        request_name = tag
-        uid = tag_uid_map.get(request_name)
-        if not uid:
-            prefixed = f"CL_CAT_{tag}"
-            uid = tag_uid_map.get(prefixed)
-            if uid:
-                request_name = prefixed
-
-        if not uid:
-            # Also handle case where tags file already contains prefixed names
-            if tag.startswith("CL_CAT_") and tag in tag_uid_map:
-                uid = tag_uid_map.get(tag)
-                request_name = tag
-
+        request_name, uid = tag_index.resolve(tag)
         if not uid:
             logging.warning("Tag no encontrado en vista: %s", tag)
             missing.append(tag)
             continue
+        jobs.append((tag, request_name, uid))
+
+    start_ts = datetime.timestamp(datetime.strptime(start, '%Y-%m-%d %H:%M:%S'))
+    end_ts = datetime.timestamp(datetime.strptime(end, '%Y-%m-%d %H:%M:%S'))
+
+    # Use the 'tagviews' historic endpoint: the path expects the view UID
+    url = f"{base_url}/Documents/tagviews/{vista}/historic"
+    req_headers = getattr(api, 'HEADERS', None) or headers
+
+    return {
+        'api': api, 'vista': vista, 'url': url, 'headers': req_headers, 'fetch_task': fetch_task,
+        'start': start, 'end': end, 'start_ts': start_ts, 'end_ts': end_ts, 'resolution': resolution,
+        'jobs': jobs, 'missing': missing,
+    }
+
 
-        logging.info("Descargando datos minutales para %s (request_name=%s uid=%s)", tag, request_name, uid)
+def download_minute_data(cfg=None, report=None):
+    """Download minute data according to configuration and return combined DataFrame.
+
+    With a `report` (`procesado.instrumentation.RunReport`) the HTTP statistics,
+    rows per tag and per-tag request time and rows/s are recorded in it. A
+    multi-UID request's time is split evenly among the tags of its batch.
 
-        params = {
-            "dataSource": "RAW",
-            "resolution": resolution,
-            "uids": [uid],
-            "startTs": datetime.timestamp(datetime.strptime(start, '%Y-%m-%d %H:%M:%S')),
-            "endTs": datetime.timestamp(datetime.strptime(end, '%Y-%m-%d %H:%M:%S')),
-        }
+    Returns (combined_df or None, missing list). With `layout: "long"` in the
+    fetch task the combined data is a `LongTagFrame` instead of the wide frame.
+    """
+    # Load config if not provided
+    if cfg is None:
+        CONFIG_PATH = os.path.join(ROOT, "consums_config.json")
+        with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+            cfg = json.load(f)
 
-        # Use the 'tagviews' historic endpoint: the path expects the view UID
-        url = f"{base_url}/Documents/tagviews/{vista}/historic"
+    plan = plan_download(cfg)
+    if plan is None:
+        return None, []
+    fetch_task, jobs, missing = plan['fetch_task'], plan['jobs'], plan['missing']
+    vista, url, req_headers, resolution = plan['vista'], plan['url'], plan['headers'], plan['resolution']
+    start, end, start_ts, end_ts = plan['start'], plan['end'], plan['start_ts'], plan['end_ts']
+
+    # Directorio de salida
+    out_dir = os.path.join(os.path.dirname(__file__), "minute_data")
+    os.makedirs(out_dir, exist_ok=True)
+    # CSV por tag y all_minutes.csv; el motor de pipeline los desactiva por defecto
+    write_csv = fetch_task.get('write_csv', True)
+
+    workers = max(1, int(fetch_task.get('workers') or 1))
+    batch_size = max(1, int(fetch_task.get('batch_size') or 1))
+    window_days = fetch_task.get('window_days')
+    batches = _make_batches(jobs, batch_size)
+
+    # Caché y checkpoint son excluyentes. Con `cache` sólo se piden los huecos y la
+    # cobertura del caché hace de checkpoint; sin él (por defecto) las ventanas
+    # completadas se anotan en el manifiesto y una ejecución interrumpida se reanuda
+    cache = None
+    checkpoint = None
+    if fetch_task.get('cache', False):
+        cache, covered_until = open_minute_cache(cfg, jobs)
+    else:
+        checkpoint = CheckpointManifest(
+            fetch_task.get('checkpoint_dir') or os.path.join(os.path.dirname(__file__), "cache", "checkpoints"),
+            {"vista": vista, "start": start, "end": end, "resolution": resolution, "window_days": window_days},
+        )
+        if checkpoint.completed_count():
+            logging.info("Reanudando descarga: %d pares (tag, ventana) ya completados", checkpoint.completed_count())
+
+    units = []
+    for batch in batches:
+        units.extend((batch, window) for window in batch_windows(batch, start_ts, end_ts, window_days, cache))
+    if cache is not None:
+        logging.info("Caché minutal: %d peticiones pendientes para %d tags", len(units), len(jobs))
+
+    client = PooledClient(pool_size=workers, rate_limit=fetch_task.get('rate_limit_per_sec'))
+
+    def fetch(unit):
+        batch, (w_start, w_end) = unit
+        batch_tags = [tag for tag, _, _ in batch]
+        if checkpoint is not None and checkpoint.is_done(batch_tags, (w_start, w_end)):
+            return checkpoint.load(batch_tags, (w_start, w_end))
+
+        logging.debug("Descargando datos minutales %s -> %s para %s",
+                     datetime.fromtimestamp(w_start), datetime.fromtimestamp(w_end), ", ".join(
+                         f"{tag} (request_name={request_name} uid={uid})" for tag, request_name, uid in batch))
+        t0 = time.perf_counter()
         try:
-            resp = api.HEADERS and api.HEADERS or headers
-            import requests
-            response = requests.post(url, json=params, headers=resp)
-            response.raise_for_status()
-            data = pd.json_normalize(response.json())
-            if data.empty:
-                logging.info("No hay datos para %s", tag)
-                continue
-
-            if 'timeStamp' in data.columns and 'value' in data.columns:
-                df = data.set_index('timeStamp')[['value']]
-                df.index = pd.to_datetime(df.index, unit='s')
-                df.rename(columns={'value': tag}, inplace=True)
-            else:
-                # intentar detectar columna de valor
-                val_cols = [c for c in data.columns if c.lower() in ('value', 'valor')]
-                if val_cols:
-                    df = data.set_index('timeStamp')[[val_cols[0]]]
-                    df.index = pd.to_datetime(df.index, unit='s')
-                    df.rename(columns={val_cols[0]: tag}, inplace=True)
-                else:
-                    logging.warning("Respuesta inesperada para %s, columnas: %s", tag, data.columns)
-                    continue
-
-            # Guardar CSV por tag
-            out_file = os.path.join(out_dir, f"{tag}.csv")
-            df.to_csv(out_file, index=True)
-            combined.append(df)
+            frames = _fetch_batch(client, url, req_headers, batch, w_start, w_end, resolution)
         except Exception as e:
-            logging.exception("Error al descargar datos para %s: %s", tag, e)
+            # Fallida o no reconocida: no se marca como cubierta y se vuelve a pedir
+            logging.exception("Error al descargar datos para %s: %s", batch_tags, e)
+            frames = None
+        if report is not None:
+            share = (time.perf_counter() - t0) / len(batch_tags)
+            for tag in batch_tags:
+                df = (frames or {}).get(tag)
+                report.record_tag_time('fetch', tag, share, 0 if df is None else len(df))
+        if frames is None:
+            return None
+        if cache is not None:
+            for tag in batch_tags:
+                # Respuesta válida sin filas para el tag: ventana cubierta y vacía
+                cache.store(tag, frames.get(tag), w_start, w_end, covered_until=covered_until)
+        else:
+            checkpoint.save(batch_tags, (w_start, w_end), frames)
+        return frames
+
+    with client:
+        if workers == 1:
+            results = [fetch(unit) for unit in units]
+        else:
+            logging.info("Descarga concurrente: %d workers, %d peticiones para %d tags",
+                         workers, len(units), len(jobs))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(fetch, units))
+
+    # Unir ventanas por tag en orden temporal
+    failed = any(frames is None for frames in results)
+    empty = sum(len(batch) - len(frames) for (batch, _), frames in zip(units, results) if frames is not None)
+    if empty:
+        logging.info("%d pares (tag, ventana) sin datos en la API", empty)
+    parts = {}
+    if cache is None:
+        for (batch, window), frames in zip(units, results):
+            for tag, df in (frames or {}).items():
+                parts.setdefault(tag, []).append((window, df))
+
+    # Reordenar por la lista de tags: el combinado es idéntico al secuencial
+    combined = []
+    rows_by_tag = {}
+    for tag, _, _ in jobs:
+        if cache is not None:
+            df = cache.load(tag, start_ts, end_ts)
+        elif tag in parts:
+            tag_parts = [df for _, df in sorted(parts[tag], key=lambda p: p[0])]
+            df = tag_parts[0] if len(tag_parts) == 1 else pd.concat(tag_parts)
+        else:
+            df = None
+        if df is None:
+            continue
+        # Guardar CSV por tag
+        if write_csv:
+            df.to_csv(os.path.join(out_dir, f"{tag}.csv"), index=True)
+        combined.append(df)
+        rows_by_tag[tag] = len(df)
+
+    if report is not None:
+        report.record_http(client.stats.summary())
+        report.record_tags('fetch', rows_by_tag)
+
+    if failed:
+        if checkpoint is not None:
+            logging.warning("Algunas ventanas fallaron; el checkpoint se conserva en %s para reanudar", checkpoint.run_dir)
+        else:
+            logging.warning("Algunas ventanas fallaron; quedarán como huecos del caché para la próxima ejecución")
+    elif checkpoint is not None:
+        checkpoint.clear()
 
     # Combinar y guardar
     combined_df = None
     if combined:
-        combined_df = pd.concat(combined, axis=1)
         combined_out = os.path.join(out_dir, "all_minutes.csv")
-        combined_df.to_csv(combined_out, index=True)
-        logging.info("Datos combinados guardados en %s", combined_out)
+        if fetch_task.get('layout', 'wide') == 'long':
+            # Formato largo compacto: el ancho sólo se construye para exportar
+            combined_df = LongTagFrame.from_frames(combined)
+            logging.info("Formato largo: %d lecturas, %.1f MB", len(combined_df),
+                         combined_df.memory_usage() / 1e6)
+            if write_csv:
+                combined_df.to_wide().to_csv(combined_out, index=True)
+        else:
+            combined_df, alignment = align_minute_frames(combined, start)
+            if report is not None:
+                report.record_alignment(alignment)
+            if write_csv:
+                combined_df.to_csv(combined_out, index=True)
+        if write_csv:
+            logging.info("Datos combinados guardados en %s", combined_out)
 
     if missing:
         logging.warning("Se encontraron tags faltantes: %s", missing)
@@ -1,94 +1,224 @@
+"""
+Resolución del catálogo de señales FTR a descargar.
+
+Una sola consulta al catálogo (`ga_landing.ite_sql4_cfg_tags`) que sólo pide la
+columna `tag` y resuelve en el servidor la regla de selección:
+
+- todas las señales `*TOT_L` / `*TOT_H` del prefijo,
+- las señales `*TOT` cuyo prefijo de 5 caracteres no tenga ya una `TOT_L/H`,
+- excluyendo `ET*`, `*_LS_*` y `*_P_*`.
+
+La lista resuelta se guarda en `adquisicion/cache/catalog.json`. Mientras no
+caduque (`catalog.ttl_hours`) se usa sin tocar la base de datos; al caducar se
+lanza una consulta de versión del catálogo (una fila con el número de tags
+candidatos, el primero, el último y la suma de un hash de 32 bits de cada tag,
+calculados en el servidor en un único recorrido sin ordenar ni concatenar) y
+sólo se vuelve a resolver si la versión ha cambiado.
+
+La consulta es SQL estándar (CTE, `substr`, `LIKE ... ESCAPE`), así que también
+funciona contra una copia local en SQLite: `resolve_signals` acepta un objeto con
+`get_data(query)` (`pgDataLake`) o cualquier conexión DB-API. En SQLite el hash
+de la consulta de versión es la función `tag_hash`, que se registra en la conexión.
+
+    python adquisicion/extraer_senales_ftr.py [--force]
+"""
+import argparse
+import hashlib
 import json
 import logging
-import sys
 import os
+import sys
+import time
+
 import pandas as pd
 
 # Añadir la raíz del proyecto y CAT_Conexions al path
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 sys.path.insert(0, project_root)
 sys.path.insert(0, os.path.join(project_root, "CAT_Conexions", "src"))
-from conexions import pgDataLake
 
-logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+CATALOG_TABLE = "ga_landing.ite_sql4_cfg_tags"
+DEFAULT_CATALOG_CACHE = os.path.join(os.path.dirname(__file__), "cache", "catalog.json")
+DEFAULT_TTL_HOURS = 24
+OUTPUT_PATH = os.path.join(os.path.dirname(__file__), 'senales_para_descarga.txt')
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "..", "consums_config.json")
+
 
-# Leer configuración
 def get_filter_from_config(cfg):
     for task in cfg.get("tasks", []):
         if task.get("name") == "fetch_api_data":
             return task.get("filter")
     return None
 
-CONFIG_PATH = os.path.join(os.path.dirname(__file__), "..", "consums_config.json")
-with open(CONFIG_PATH, "r") as f:
-    cfg = json.load(f)
-
-filter_prefix = get_filter_from_config(cfg)
-pg = pgDataLake()
-descarga_tags = []
-if filter_prefix:
-    prefix = f'{filter_prefix}_FTR'
-else:
-    prefix = 'FTR'
-if filter_prefix:
-    # Buscar directamente TOT_L y TOT_H dentro del prefijo
-    query_tot_lh = f"""
-    SELECT * FROM ga_landing.ite_sql4_cfg_tags
-    WHERE tag LIKE '{prefix}%' AND (tag LIKE '%TOT\\_L' ESCAPE '\\' OR tag LIKE '%TOT\\_H' ESCAPE '\\') AND tag NOT LIKE 'ET%' AND tag NOT LIKE '%\\_LS\\_%' ESCAPE '\\' AND tag NOT LIKE '%\\_P\\_%' ESCAPE '\\'
-    """
-    # Buscar el resto de TOT (para posibles señales TOT sin sufijos _L/_H)
-    query_tot = f"""
-    SELECT * FROM ga_landing.ite_sql4_cfg_tags
-    WHERE tag LIKE '{prefix}%' AND tag LIKE '%TOT' AND tag NOT LIKE 'ET%' AND tag NOT LIKE '%\\_LS\\_%' ESCAPE '\\' AND tag NOT LIKE '%\\_P\\_%' ESCAPE '\\'
+
+def _candidates_where(filter_prefix):
+    """WHERE clause shared by the resolve and the version queries."""
+    if filter_prefix:
+        prefix = str(filter_prefix).replace("'", "''")
+        scope = f"tag LIKE '{prefix}\\_FTR%' ESCAPE '\\'"
+    else:
+        scope = "tag LIKE '%FTR%'"
+    return (f"{scope} AND tag NOT LIKE 'ET%' "
+            "AND tag NOT LIKE '%\\_LS\\_%' ESCAPE '\\' AND tag NOT LIKE '%\\_P\\_%' ESCAPE '\\' "
+            "AND (tag LIKE '%TOT' OR tag LIKE '%TOT\\_L' ESCAPE '\\' OR tag LIKE '%TOT\\_H' ESCAPE '\\')")
+
+
+def build_catalog_query(filter_prefix=None, table=CATALOG_TABLE):
+    """Single query returning the tags to download, TOT_L/H first, each group sorted."""
+    return f"""
+    WITH candidatos AS (
+        SELECT DISTINCT tag FROM {table}
+        WHERE {_candidates_where(filter_prefix)}
+    ),
+    tot_lh AS (
+        SELECT tag FROM candidatos
+        WHERE tag LIKE '%TOT\\_L' ESCAPE '\\' OR tag LIKE '%TOT\\_H' ESCAPE '\\'
+    )
+    SELECT tag, 0 AS grupo FROM tot_lh
+    UNION ALL
+    SELECT tag, 1 AS grupo FROM candidatos
+    WHERE tag LIKE '%TOT' AND substr(tag, 1, 5) NOT IN (SELECT substr(tag, 1, 5) FROM tot_lh)
+    ORDER BY grupo, tag
     """
-else:
-    query_tot_lh = f"""
-    SELECT * FROM ga_landing.ite_sql4_cfg_tags
-    WHERE tag LIKE '%FTR%' AND (tag LIKE '%TOT\\_L' ESCAPE '\\' OR tag LIKE '%TOT\\_H' ESCAPE '\\') AND tag NOT LIKE 'ET%' AND tag NOT LIKE '%\\_LS\\_%' ESCAPE '\\' AND tag NOT LIKE '%\\_P\\_%' ESCAPE '\\'
+
+
+def build_version_query(filter_prefix=None, table=CATALOG_TABLE, dialect='postgres'):
+    """One-row summary of the candidate rows: count, first and last tag, and a checksum.
+
+    Plain aggregates over a single scan (no DISTINCT, sort or string
+    aggregation), so the probe is much cheaper than resolving. The checksum
+    sums a 32-bit hash of every tag, so a rename, addition or removal changes
+    the result. `dialect` is 'postgres' (hash from `md5`) or 'sqlite' (the
+    `tag_hash` function registered by `catalog_version`).
     """
-    query_tot = f"""
-    SELECT * FROM ga_landing.ite_sql4_cfg_tags
-    WHERE tag LIKE '%FTR%' AND tag LIKE '%TOT' AND tag NOT LIKE 'ET%' AND tag NOT LIKE '%\\_LS\\_%' ESCAPE '\\' AND tag NOT LIKE '%\\_P\\_%' ESCAPE '\\'
+    if dialect == 'sqlite':
+        tag_hash = "tag_hash(tag)"
+    else:
+        tag_hash = "('x' || substr(md5(tag), 1, 8))::bit(32)::int"
+    return (f"SELECT count(*) AS n, min(tag) AS first_tag, max(tag) AS last_tag, sum({tag_hash}) AS checksum "
+            f"FROM {table} WHERE {_candidates_where(filter_prefix)}")
+
+
+def _tag_hash(tag):
+    """Signed 32-bit hash of `tag` from the first 8 hex digits of its md5, like the Postgres probe."""
+    return int.from_bytes(hashlib.md5(str(tag).encode()).digest()[:4], 'big', signed=True)
+
+
+def _dialect(conn):
+    """'sqlite' for a `sqlite3` connection, 'postgres' otherwise."""
+    return 'sqlite' if type(conn).__module__.startswith('sqlite3') else 'postgres'
+
+
+def _query(conn, query):
+    """DataFrame result of `query` on a `pgDataLake`-like object or a DB-API connection."""
+    if hasattr(conn, 'get_data'):
+        return conn.get_data(query)
+    return pd.read_sql_query(query, conn)
+
+
+def catalog_version(conn, filter_prefix=None, table=CATALOG_TABLE, version_query=None):
+    """String identifying the current state of the catalog rows in scope."""
+    dialect = _dialect(conn)
+    if dialect == 'sqlite' and not version_query:
+        conn.create_function('tag_hash', 1, _tag_hash, deterministic=True)
+    df = _query(conn, version_query or build_version_query(filter_prefix, table, dialect))
+    if df is None or df.empty:
+        return ''
+    return hashlib.blake2b(json.dumps(df.astype(str).values.tolist()).encode(), digest_size=16).hexdigest()
+
+
+def resolve_from_catalog(conn, filter_prefix=None, table=CATALOG_TABLE):
+    """Run the catalog query and return the tag list in download order."""
+    query = build_catalog_query(filter_prefix, table)
+    logging.debug("Ejecutando consulta de catálogo: %s", query)
+    df = _query(conn, query)
+    if df is None or df.empty:
+        return []
+    return list(dict.fromkeys(df['tag'].astype(str)))
+
+
+def _read_cache(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_cache(path, entry):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(entry, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _default_connection():
+    from conexions import pgDataLake
+    return pgDataLake()
+
+
+def resolve_signals(cfg, conn=None, cache_path=None, force=False, now=None):
+    """Tags to download for the `fetch_api_data` filter of `cfg`, served from the cache when valid.
+
+    `conn` defaults to `pgDataLake()` and is only opened when the cache is
+    missing, expired or `force` is set. Settings come from the `catalog`
+    section: `ttl_hours`, `cache`, `table` and an optional `version_query`.
     """
+    catalog_cfg = cfg.get('catalog', {})
+    filter_prefix = get_filter_from_config(cfg)
+    table = catalog_cfg.get('table', CATALOG_TABLE)
+    ttl = float(catalog_cfg.get('ttl_hours', DEFAULT_TTL_HOURS)) * 3600
+    use_cache = catalog_cfg.get('cache', True)
+    cache_path = cache_path or DEFAULT_CATALOG_CACHE
+    now = time.time() if now is None else now
+    scope = {'filter': filter_prefix, 'table': table}
+
+    cached = _read_cache(cache_path) if use_cache and not force else None
+    if cached is not None and cached.get('scope') != scope:
+        cached = None
+    if cached is not None and now - cached.get('checked_at', 0) < ttl:
+        logging.info("Catálogo en caché (%d señales)", len(cached['tags']))
+        return cached['tags']
+
+    conn = conn if conn is not None else _default_connection()
+    version = catalog_version(conn, filter_prefix, table, catalog_cfg.get('version_query'))
+    if cached is not None and cached.get('version') == version:
+        logging.info("Catálogo sin cambios (%d señales)", len(cached['tags']))
+        tags = cached['tags']
+    else:
+        tags = resolve_from_catalog(conn, filter_prefix, table)
+        logging.info("Catálogo resuelto: %d señales", len(tags))
+    if use_cache:
+        _write_cache(cache_path, {'scope': scope, 'version': version, 'checked_at': now, 'tags': tags})
+    return tags
+
+
+def write_signals(tags, output_path=OUTPUT_PATH):
+    with open(output_path, 'w', encoding='utf-8') as out_f:
+        for t in tags:
+            out_f.write(f"{t}\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extrae la lista de señales FTR a descargar")
+    parser.add_argument('--force', action='store_true', help="Ignorar la caché y consultar el catálogo")
+    parser.add_argument('--output', default=OUTPUT_PATH)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+    with open(CONFIG_PATH, "r") as f:
+        cfg = json.load(f)
+
+    tags = resolve_signals(cfg, force=args.force)
+    n_lh = sum(t.endswith(('TOT_L', 'TOT_H')) for t in tags)
+    print(f"Señales TOT_L/TOT_H: {n_lh}; señales TOT sin par L/H: {len(tags) - n_lh}")
+    write_signals(tags, args.output)
+    print(f"\nSe han escrito {len(tags)} señales en: {args.output}")
+    return 0
+
 
-logging.info(f'Ejecutando consulta TOT_L/H: {query_tot_lh}')
-df_tot_lh = pg.get_data(query_tot_lh)
-
-logging.info(f'Ejecutando consulta TOT general: {query_tot}')
-df_tot = pg.get_data(query_tot)
-
-# Prefijos de las señales que ya tienen TOT_L o TOT_H (primeros 5 caracteres)
-tot_lh_prefixes = set(tag[:5] for tag in df_tot_lh['tag']) if not df_tot_lh.empty else set()
-
-# Añadir directamente las señales TOT_L y TOT_H encontradas
-if not df_tot_lh.empty:
-    print('Señales FTR que terminan en TOT_L o TOT_H:')
-    print(df_tot_lh['tag'])
-    for tag in df_tot_lh['tag']:
-        descarga_tags.append(tag)
-else:
-    print('No se encontraron señales que terminen en TOT_L o TOT_H.')
-
-# De df_tot (todas las señales %TOT) conservar sólo aquellas cuyos
-# primeros 5 caracteres NO estén en tot_lh_prefixes
-if not df_tot.empty:
-    print('\nSeñales FTR que terminan en TOT (filtradas por prefijo TOT_L/H):')
-    filtered_tot = []
-    for tag in df_tot['tag']:
-        if tag[:5] not in tot_lh_prefixes:
-            filtered_tot.append(tag)
-    print(filtered_tot)
-    for tag in filtered_tot:
-        descarga_tags.append(tag)
-else:
-    print('No se encontraron señales FTR especiales que terminan en TOT.')
-
-# Eliminar duplicados manteniendo el orden
-descarga_tags = list(dict.fromkeys(descarga_tags))
-
-output_path = os.path.join(os.path.dirname(__file__), 'senales_para_descarga.txt')
-with open(output_path, 'w', encoding='utf-8') as out_f:
-    for t in descarga_tags:
-        out_f.write(f"{t}\n")
-
-print(f"\nSe han escrito {len(descarga_tags)} señales en: {output_path}")
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""
+Cliente HTTP compartido para las descargas contra la API de SagedCAT.
+
+Mantiene una única `requests.Session` con pool de conexiones keep-alive y un
+limitador de peticiones por host, de modo que varios hilos puedan descargar
+tags en paralelo sin abrir una conexión nueva por petición ni saturar la API.
+"""
+import threading
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class RateLimiter:
+    """Token bucket per host: at most `rate` requests per second to each host.
+
+    A `rate` of None or <= 0 disables the limit.
+    """
+
+    def __init__(self, rate=None, burst=None):
+        self.rate = float(rate) if rate else 0.0
+        self.burst = float(burst) if burst else max(self.rate, 1.0)
+        self._lock = threading.Lock()
+        self._buckets = {}  # host -> (tokens, last_refill)
+
+    def acquire(self, host):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                tokens, last = self._buckets.get(host, (self.burst, now))
+                tokens = min(self.burst, tokens + (now - last) * self.rate)
+                if tokens >= 1.0:
+                    self._buckets[host] = (tokens - 1.0, now)
+                    return
+                self._buckets[host] = (tokens, now)
+                wait = (1.0 - tokens) / self.rate
+            time.sleep(wait)
+
+
+class HttpStats:
+    """Thread-safe request counters: count, errors, bytes, status codes and latencies."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.status = {}
+        self.latencies = []
+
+    def record(self, seconds, status=None, nbytes=0):
+        with self._lock:
+            self.requests += 1
+            self.latencies.append(seconds)
+            self.bytes += nbytes
+            key = str(status) if status is not None else 'error'
+            self.status[key] = self.status.get(key, 0) + 1
+            if status is None or status >= 400:
+                self.errors += 1
+
+    def summary(self):
+        with self._lock:
+            lat = np.array(self.latencies) * 1000
+            percentiles = {}
+            if len(lat):
+                p50, p90, p99 = np.percentile(lat, [50, 90, 99])
+                percentiles = {'p50': round(p50, 1), 'p90': round(p90, 1), 'p99': round(p99, 1),
+                               'max': round(float(lat.max()), 1)}
+            return {'requests': self.requests, 'errors': self.errors, 'bytes': self.bytes,
+                    'status': dict(self.status), 'latency_ms': percentiles}
+
+
+class PooledClient:
+    """Thread-safe wrapper around a keep-alive `requests.Session`."""
+
+    def __init__(self, pool_size=10, rate_limit=None, timeout=None):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.limiter = RateLimiter(rate_limit)
+        self.timeout = timeout
+        self.stats = HttpStats()
+
+    def post(self, url, json=None, headers=None):
+        self.limiter.acquire(urlsplit(url).netloc)
+        t0 = time.perf_counter()
+        try:
+            response = self.session.post(url, json=json, headers=headers, timeout=self.timeout)
+        except requests.RequestException:
+            self.stats.record(time.perf_counter() - t0)
+            raise
+        self.stats.record(time.perf_counter() - t0, response.status_code, len(response.content))
+        return response
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,197 @@
+"""
+Caché local incremental de datos minutales descargados.
+
+Los datos se guardan particionados por tag y mes (`<tag>/<YYYY-MM>.pkl`) y cada
+tag lleva un `coverage.json` con los intervalos de tiempo ya solicitados a la
+API. El descargador sólo pide los huecos y sirve el resto desde disco.
+
+Uso desde línea de comandos para forzar la recarga de horas corregidas:
+
+    python adquisicion/minute_cache.py invalidate "2025-06-02 11:00:00" [--tag TAG]
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(__file__), "cache", "minutes")
+
+
+def parse_local_ts(value):
+    """'YYYY-mm-dd HH:MM:SS' (local time, as in the config) -> epoch seconds."""
+    return int(datetime.timestamp(datetime.strptime(value, '%Y-%m-%d %H:%M:%S')))
+
+
+def merge_intervals(intervals):
+    """Merge inclusive [start, end] second intervals, joining adjacent ones."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def subtract_intervals(start, end, covered):
+    """Return the parts of [start, end] not included in the merged `covered` list."""
+    gaps = []
+    cursor = start
+    for c_start, c_end in covered:
+        if c_end < cursor:
+            continue
+        if c_start > end:
+            break
+        if c_start > cursor:
+            gaps.append((cursor, c_start - 1))
+        cursor = max(cursor, c_end + 1)
+        if cursor > end:
+            break
+    if cursor <= end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+class MinuteCache:
+    """Per-tag, per-month store of downloaded minute frames plus their coverage."""
+
+    def __init__(self, base_dir=None):
+        self.base_dir = base_dir or DEFAULT_CACHE_DIR
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock(self, tag):
+        with self._locks_guard:
+            return self._locks.setdefault(tag, threading.Lock())
+
+    def _tag_dir(self, tag):
+        return os.path.join(self.base_dir, tag)
+
+    def _coverage_path(self, tag):
+        return os.path.join(self._tag_dir(tag), "coverage.json")
+
+    def _partition_path(self, tag, month):
+        return os.path.join(self._tag_dir(tag), f"{month}.pkl")
+
+    def tags(self):
+        if not os.path.isdir(self.base_dir):
+            return []
+        return sorted(d for d in os.listdir(self.base_dir) if os.path.isdir(os.path.join(self.base_dir, d)))
+
+    def coverage(self, tag):
+        path = self._coverage_path(tag)
+        if not os.path.exists(path):
+            return []
+        with open(path, "r", encoding="utf-8") as f:
+            return merge_intervals(json.load(f))
+
+    def _write_coverage(self, tag, intervals):
+        os.makedirs(self._tag_dir(tag), exist_ok=True)
+        path = self._coverage_path(tag)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(merge_intervals(intervals), f)
+        os.replace(tmp_path, path)
+
+    def missing_ranges(self, tag, start_ts, end_ts):
+        """Inclusive (start, end) second ranges of [start_ts, end_ts] not yet cached."""
+        return subtract_intervals(int(start_ts), int(end_ts), self.coverage(tag))
+
+    @staticmethod
+    def _months(start_ts, end_ts):
+        first = pd.Timestamp(int(start_ts), unit='s').to_period('M')
+        last = pd.Timestamp(int(end_ts), unit='s').to_period('M')
+        return [str(p) for p in pd.period_range(first, last, freq='M')]
+
+    def _read_partition(self, tag, month):
+        path = self._partition_path(tag, month)
+        return pd.read_pickle(path) if os.path.exists(path) else None
+
+    def _write_partition(self, tag, month, df):
+        path = self._partition_path(tag, month)
+        if df is None or df.empty:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        os.makedirs(self._tag_dir(tag), exist_ok=True)
+        df.to_pickle(path)
+
+    def _drop_range(self, tag, start_ts, end_ts):
+        t0 = pd.Timestamp(int(start_ts), unit='s')
+        t1 = pd.Timestamp(int(end_ts), unit='s')
+        for month in self._months(start_ts, end_ts):
+            part = self._read_partition(tag, month)
+            if part is not None:
+                self._write_partition(tag, month, part[(part.index < t0) | (part.index > t1)])
+
+    def store(self, tag, df, start_ts, end_ts, covered_until=None):
+        """Replace the cached rows of `tag` in [start_ts, end_ts] with `df`.
+
+        The range is recorded as covered up to `covered_until` (defaults to
+        `end_ts`), so minutes that may still arrive are requested again later.
+        """
+        with self._lock(tag):
+            self._drop_range(tag, start_ts, end_ts)
+            if df is not None and not df.empty:
+                for month, rows in df.groupby(df.index.to_period('M'), sort=True):
+                    part = self._read_partition(tag, str(month))
+                    merged = rows if part is None else pd.concat([part, rows]).sort_index()
+                    self._write_partition(tag, str(month), merged)
+
+            cov_end = int(end_ts) if covered_until is None else min(int(end_ts), int(covered_until))
+            if cov_end >= int(start_ts):
+                self._write_coverage(tag, self.coverage(tag) + [[int(start_ts), cov_end]])
+
+    def load(self, tag, start_ts, end_ts):
+        """Return the cached frame of `tag` within [start_ts, end_ts] (None if empty)."""
+        t0 = pd.Timestamp(int(start_ts), unit='s')
+        t1 = pd.Timestamp(int(end_ts), unit='s')
+        parts = []
+        for month in self._months(start_ts, end_ts):
+            part = self._read_partition(tag, month)
+            if part is not None:
+                parts.append(part[(part.index >= t0) & (part.index <= t1)])
+        parts = [p for p in parts if not p.empty]
+        if not parts:
+            return None
+        return parts[0] if len(parts) == 1 else pd.concat(parts)
+
+    def invalidate(self, hours, tags=None):
+        """Forget the given hours ('YYYY-mm-dd HH:00:00', local time) so they are refetched."""
+        tags = self.tags() if tags is None else tags
+        for hour in hours:
+            h_start = parse_local_ts(hour)
+            h_end = h_start + 3600 - 1
+            for tag in tags:
+                with self._lock(tag):
+                    covered = self.coverage(tag)
+                    if not covered:
+                        continue
+                    remaining = []
+                    for c_start, c_end in covered:
+                        remaining.extend([list(g) for g in subtract_intervals(c_start, c_end, [[h_start, h_end]])])
+                    self._write_coverage(tag, remaining)
+                    self._drop_range(tag, h_start, h_end)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gestión de la caché de datos minutales")
+    sub = parser.add_subparsers(dest="command", required=True)
+    inv = sub.add_parser("invalidate", help="Invalidar horas para forzar su descarga")
+    inv.add_argument("hours", nargs="+", help="Horas en formato 'YYYY-mm-dd HH:00:00'")
+    inv.add_argument("--tag", action="append", help="Limitar a estos tags (por defecto, todos)")
+    inv.add_argument("--cache-dir", default=None)
+    args = parser.parse_args(argv)
+
+    cache = MinuteCache(args.cache_dir)
+    cache.invalidate(args.hours, tags=args.tag)
+    print(f"Invalidadas {len(args.hours)} horas en {cache.base_dir}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
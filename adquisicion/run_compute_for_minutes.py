@@ -14,16 +14,27 @@ if ROOT not in sys.path:
 # Importar la API del submódulo
 from CAT_Conexions.src.conexions import apiSagedCAT
 from download_minute_data import download_minute_data
-from procesado.compute_consumption import append_minute_consumption, distribute_negative_compensations
-
-# Configuración de logging
-logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+from procesado.compute_consumption import (
+    append_minute_consumption,
+    apply_rect_0,
+    combine_tot_high_low,
+    distribute_negative_compensations,
+)
+from procesado.instrumentation import configure_logging, report_from_config
+from procesado.memo import MemoCache, memoize
+from procesado.storage import export_csv, save_frame, storage_settings
 
 # Leer configuración (ajusta el nombre si usas otro archivo)
 CONFIG_PATH = os.path.join(ROOT, "consums_config.json")
 with open(CONFIG_PATH, "r") as f:
     cfg = json.load(f)
 
+# Configuración de logging: una línea por evento sólo con instrumentation.verbose
+configure_logging(cfg.get("instrumentation", {}).get("verbose", False))
+report = report_from_config(cfg, "run_compute_for_minutes")
+# Con memo.enabled cada paso reutiliza su resultado si la entrada y la configuración no cambian
+memo = MemoCache.from_config(cfg, ROOT)
+
 api_cfg = cfg.get("api", {})
 vista = api_cfg.get("vista")
 token = api_cfg.get("nexustoken")
@@ -44,11 +55,14 @@ resolution = "RES_1_MIN"
 logging.info(
     f"Fetching minute totalizer data {start} -> {end} (filter: {filter_prefix})"
 )
-combined_df, missing = download_minute_data()
+with report.stage("fetch") as record:
+    combined_df, missing = download_minute_data(cfg, report=report)
+    record["rows"] = len(combined_df) if combined_df is not None else 0
 if combined_df is None or combined_df.empty:
     logging.error("No minute data downloaded or combined dataframe is empty")
     sys.exit(1)
-df = combined_df.copy()
+# Con layout "long" llega un LongTagFrame: se pivota a ancho para el cálculo
+df = combined_df.to_wide() if hasattr(combined_df, 'to_wide') else combined_df.copy()
 
 # Asegurar índice datetime
 if not isinstance(df.index, pd.DatetimeIndex):
@@ -60,158 +74,54 @@ if not isinstance(df.index, pd.DatetimeIndex):
 print("\nMinute totalizer data:")
 print(df.head())
 
-# Aquí puedes continuar con el procesamiento, por ejemplo, combinar 16/32 bits o calcular consumos
 # Combinar pares TOT_H / TOT_L en una sola columna TOT
-def combine_tot_high_low(df):
-    cols = list(df.columns)
-    combined = df.copy()
-    processed = set()
-    for col in cols:
-        if col in processed:
-            continue
-        if col.endswith('_TOT_H'):
-            base = col[:-6]  # remove _TOT_H
-            low_col = base + '_TOT_L'
-            tot_col = base + '_TOT'
-            if low_col in combined.columns:
-                # Combine high and low 16-bit parts into 32-bit unsigned int
-                import numpy as np
-                high_s = pd.to_numeric(combined[col], errors='coerce').fillna(0)
-                low_s = pd.to_numeric(combined[low_col], errors='coerce').fillna(0)
-                # Convert to numpy int64 arrays for bit ops
-                high_arr = high_s.to_numpy(dtype='int64')
-                low_arr = low_s.to_numpy(dtype='int64')
-                # Mask low to 16 bits and shift high
-                result_arr = (high_arr << 16) | (low_arr & 0xFFFF)
-                combined[tot_col] = pd.Series(result_arr, index=combined.index)
-                processed.add(col)
-                processed.add(low_col)
-                # Optionally drop the original H/L columns
-                try:
-                    combined.drop(columns=[col, low_col], inplace=True)
-                except Exception:
-                    pass
-    return combined
-
-
-df = combine_tot_high_low(df)
+with report.stage("combine") as record:
+    df = memoize(combine_tot_high_low, memo, cfg)(df)
+    record["rows"] = len(df)
 
 # Regla de calidad: rect_0 -> si el TOT calculado es 0, reemplazar por último valor válido (>0)
-def apply_rect_0(df):
-    # Remove any previous rect columns to avoid duplicates
-    existing_rect_cols = [c for c in df.columns if c.endswith('_rect_0') or c == 'rect_0']
-    rected = df.copy()
-    if existing_rect_cols:
-        rected = rected.drop(columns=existing_rect_cols)
-
-    tot_cols = [c for c in rected.columns if c.endswith('_TOT')]
-
-    for col in tot_cols:
-        rect_col = f"{col}_rect_0"
-        s = pd.to_numeric(rected[col], errors='coerce')
-
-        # previous and next values
-        prev = s.shift(1)
-        nxt = s.shift(-1)
-
-        # invalid if exactly zero OR the new rule:
-        # if current < previous AND (next < current OR next == 0), then current is invalid
-        is_zero = s == 0
-        rule = (s < prev) & ((nxt < s) | (nxt == 0))
-        invalid = is_zero | rule
-
-        # Mask invalid points to NaN then forward-fill using last valid
-        s_masked = s.where(~invalid)
-        s_filled = s_masked.ffill()
-        s_filled = s_filled.fillna(0).astype('int64')
-        rected[rect_col] = s_filled
-
-    return rected
-
-
-df = apply_rect_0(df)
+with report.stage("rect", rows=len(df)):
+    df = memoize(apply_rect_0, memo, cfg)(df)
 
 # Calculate minute consumptions and append them
 try:
-    df = append_minute_consumption(df)
+    with report.stage("cons", rows=len(df)):
+        df = memoize(append_minute_consumption, memo, cfg)(df)
     logging.info('Appended per-minute consumption columns')
 except Exception as e:
     logging.warning('Could not compute/append consumption columns: %s', e)
 
 # Apply anomaly distribution rule and attach anomaly columns
 try:
-    # compute anomalies per total column explicitly here to ensure values are filled
-    tot_candidates = [c for c in df.columns if c.endswith('_rect_0')]
-    if not tot_candidates:
-        tot_candidates = [c for c in df.columns if c.endswith('_TOT')]
-
-    import numpy as _np
-    for total_col in tot_candidates:
-        cons_col = f"{total_col}_cons"
-        anom_col = f"{total_col}_anom"
-        if cons_col not in df.columns:
-            df[anom_col] = _np.nan
-            continue
-
-        # prefer raw TOT to detect zero runs
-        raw_col = total_col.replace('_rect_0', '_TOT') if total_col.endswith('_rect_0') else total_col
-        if raw_col in df.columns:
-            totals_raw = pd.to_numeric(df[raw_col], errors='coerce').fillna(_np.nan).to_numpy()
-        else:
-            totals_raw = pd.to_numeric(df[total_col], errors='coerce').fillna(_np.nan).to_numpy()
-
-        cons = pd.to_numeric(df[cons_col], errors='coerce').fillna(0).to_numpy()
-        n = len(df)
-        anom = _np.zeros(n, dtype=float)
-        i = 0
-        matches = 0
-        applied = 0
-        while i < n - 1:
-            cur = cons[i]
-            nxt = cons[i + 1]
-            if cur < 0 and nxt > 0:
-                matches += 1
-                net = cur + nxt
-                if net > 0:
-                    j = i
-                    while j >= 0 and (totals_raw[j] == 0 or _np.isnan(totals_raw[j])):
-                        j -= 1
-                    start = j + 1
-                    end = i
-                    count = end - start + 1
-                    logging.info('  i=%d cur=%s nxt=%s net=%s j=%d start=%d end=%d count=%d', i, cur, nxt, net, j, start, end, count)
-                    if count > 0:
-                        per = net / count
-                        anom[start:end + 1] += per
-                        applied += 1
-                i += 2
-            else:
-                i += 1
-        logging.info('%s: found %d neg+pos patterns, applied %d distributions', total_col, matches, applied)
-
-        # replace zeros with NaN
-        anom_series = pd.Series(anom, index=df.index, dtype='float64').replace(0.0, _np.nan)
-        df[anom_col] = anom_series
-    logging.info('Applied anomaly distribution to totalized columns (inline)')
+    # compute anomalies for every total column in one vectorized pass
+    with report.stage("anomalies", rows=len(df)):
+        anom_df = memoize(distribute_negative_compensations, memo, cfg)(df)
+        for c in anom_df.columns:
+            df[c] = anom_df[c]
+    logging.info('Applied anomaly distribution to totalized columns')
 except Exception as e:
     logging.warning('Could not apply anomaly distribution: %s', e)
 else:
-    # log counts of anomaly values for debugging
-    try:
-        for c in anom_df.columns:
-            cnt = df[c].notna().sum()
-            logging.info('Anomaly column %s non-null count: %d', c, cnt)
-    except Exception:
-        pass
-
-# Guardar CSV con separador ';' y decimales ',' si está habilitado en config
-save_task = next((t for t in cfg.get('tasks', []) if t.get('name') == 'save_to_csv'), None)
-if save_task and save_task.get('enabled'):
-    out_dir = save_task.get('output_dir') or os.path.join(ROOT, 'adquisicion', 'minute_data')
-    os.makedirs(out_dir, exist_ok=True)
-    filename = save_task.get('filename') or f"all_minutes_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    out_path = os.path.join(out_dir, filename)
-    # Pandas accepts decimal=',' and sep=';'
-    df.to_csv(out_path, sep=';', decimal=',', index=True)
+    # counts of anomaly values: one summary line, per column only with verbose logging
+    counts = df[list(anom_df.columns)].notna().sum()
+    logging.info('Anomaly values: %d in %d of %d columns', int(counts.sum()), int((counts > 0).sum()), len(counts))
+    for c, cnt in counts[counts > 0].items():
+        logging.debug('Anomaly column %s non-null count: %d', c, cnt)
+
+# Guardar el dataset intermedio en el formato de almacenamiento configurado (Parquet por defecto)
+# y exportar CSV con separador ';' y decimales ',' si está habilitado en config
+fmt, compression, _ = storage_settings(cfg)
+save_task = next((t for t in cfg.get('tasks', []) if t.get('name') == 'save_to_csv'), None) or {}
+out_dir = save_task.get('output_dir') or os.path.join(ROOT, 'adquisicion', 'minute_data')
+os.makedirs(out_dir, exist_ok=True)
+filename = save_task.get('filename') or f"all_minutes_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+out_stem = os.path.join(out_dir, os.path.splitext(filename)[0])
+with report.stage("save", rows=len(df)):
+    out_path = save_frame(df, out_stem, fmt, compression)
     logging.info('Saved combined dataset to %s', out_path)
-    
+    if save_task.get('enabled'):
+        export_csv(df, out_stem + '.csv')
+        logging.info('Exported combined dataset to %s', out_stem + '.csv')
+
+if cfg.get("instrumentation", {}).get("report", True):
+    logging.info('Run report: %s', report.write(out_dir, f"run_report_{os.path.basename(out_stem)}"))
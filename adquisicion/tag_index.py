@@ -0,0 +1,129 @@
+"""
+Índice persistente tag -> UID de la vista.
+
+`get_Tags_from_vista` devuelve una fila por grupo con una lista `columns` de
+elementos `{name, uid, ...}`. El índice se construye una vez aplanando esa
+lista de forma vectorizada y guarda, por vista, un JSON con:
+
+- los nombres tal como los expone la API (para descargar toda la vista),
+- la resolución de cada nombre a `(nombre_en_api, uid)`, tanto con el prefijo
+  `CL_CAT_` como sin él (el nombre exacto tiene prioridad).
+
+Se reconstruye al caducar (`fetch_api_data.tag_index_ttl_hours`) o cuando se
+cambia de vista (cada vista tiene su fichero). Si la API no responde y hay un
+índice anterior, se usa aunque haya caducado, de modo que una ejecución sin
+conexión puede resolver UIDs y servir los datos del caché minutal.
+"""
+import json
+import logging
+import os
+import time
+
+import pandas as pd
+
+DEFAULT_INDEX_DIR = os.path.join(os.path.dirname(__file__), "cache", "tag_index")
+DEFAULT_TTL_HOURS = 24
+API_PREFIX = "CL_CAT_"
+
+
+def flatten_vista(uids_df):
+    """(name, uid) frame of every element in the `columns` lists of a vista listing."""
+    if uids_df is None or uids_df.empty or 'columns' not in uids_df.columns:
+        return pd.DataFrame({'name': pd.Series(dtype=object), 'uid': pd.Series(dtype=object)})
+    elements = uids_df['columns'].explode().dropna()
+    elements = elements[elements.map(lambda e: isinstance(e, dict))]
+    flat = pd.DataFrame(elements.tolist()) if len(elements) else pd.DataFrame()
+    for col in ('name', 'uid'):
+        if col not in flat.columns:
+            flat[col] = None
+    flat = flat[['name', 'uid']]
+    flat = flat[flat['name'].notna() & flat['uid'].notna() & (flat['name'] != '') & (flat['uid'] != '')]
+    # Como el mapa original: si un nombre se repite, gana la última aparición
+    return flat.drop_duplicates('name', keep='last').reset_index(drop=True)
+
+
+class TagIndex:
+    """Name -> (request name, uid) resolution for one vista."""
+
+    def __init__(self, vista, names, lookup, built_at=None):
+        self.vista = vista
+        self._names = list(names)
+        self.lookup = lookup
+        self.built_at = time.time() if built_at is None else built_at
+
+    @classmethod
+    def build(cls, uids_df, vista):
+        flat = flatten_vista(uids_df)
+        names = flat['name'].astype(str)
+        uids = flat['uid']
+        lookup = {name: (name, uid) for name, uid in zip(names, uids)}
+        # Nombres sin prefijo: sólo cuando no existen ya tal cual en la vista
+        prefixed = names.str.startswith(API_PREFIX)
+        base = names[prefixed].str.slice(len(API_PREFIX))
+        keep = ~base.isin(lookup)
+        for b, name, uid in zip(base[keep], names[prefixed][keep], uids[prefixed][keep]):
+            lookup[b] = (name, uid)
+        return cls(vista, names.tolist(), lookup)
+
+    def names(self):
+        """Sorted names exactly as exposed by the vista."""
+        return sorted(self._names)
+
+    def resolve(self, tag):
+        """(request_name, uid) for `tag`, or (tag, None) if not in the vista."""
+        return self.lookup.get(tag, (tag, None))
+
+    def __len__(self):
+        return len(self._names)
+
+    def age_hours(self, now=None):
+        return ((time.time() if now is None else now) - self.built_at) / 3600
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'vista': self.vista, 'built_at': self.built_at, 'names': self._names,
+                       'lookup': {k: list(v) for k, v in self.lookup.items()}}, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data['vista'], data['names'], {k: tuple(v) for k, v in data['lookup'].items()},
+                   data.get('built_at'))
+
+
+def index_path(vista, base_dir=None):
+    return os.path.join(base_dir or DEFAULT_INDEX_DIR, f"{vista}.json")
+
+
+def load_tag_index(api, vista, base_dir=None, ttl_hours=DEFAULT_TTL_HOURS, force=False):
+    """Tag index of `vista`, rebuilt from `api.get_Tags_from_vista` only when missing or expired."""
+    path = index_path(vista, base_dir)
+    cached = None
+    if os.path.exists(path):
+        try:
+            cached = TagIndex.load(path)
+        except (OSError, ValueError, KeyError):
+            logging.warning("Índice de tags ilegible, se reconstruye: %s", path)
+    if cached is not None and cached.vista == vista and not force and cached.age_hours() < float(ttl_hours):
+        logging.info("Índice de tags en caché: %d tags de la vista %s", len(cached), vista)
+        return cached
+
+    logging.info("Solicitando listado de tags desde la vista %s", vista)
+    try:
+        uids_df = api.get_Tags_from_vista(vista)
+    except Exception as e:
+        if cached is None:
+            logging.exception("Error obteniendo tags desde la vista: %s", e)
+            raise
+        logging.warning("No se pudo actualizar el índice de tags (%s); se usa el de hace %.1f h",
+                        e, cached.age_hours())
+        return cached
+
+    index = TagIndex.build(uids_df, vista)
+    index.save(path)
+    logging.info("Índice de tags actualizado: %d tags", len(index))
+    return index
@@ -0,0 +1,157 @@
+"""
+Benchmarks de las etapas de procesado sobre datos sintéticos.
+
+Cada etapa (combinación H/L, rect_0, consumo, anomalías con ambas reglas,
+reinicios de contador, agregación horaria y la cadena completa) se mide sobre
+una rejilla tags × meses generada con `procesado/synthetic.py` (semilla fija):
+tiempo de pared (mejor de `--repeat`) y pico de memoria asignada (tracemalloc).
+
+Los resultados se guardan en JSON en `benchmarks/results/<commit>_<fecha>.json`
+junto con las versiones de Python/NumPy/pandas, y se pueden comparar:
+
+    python benchmarks/run_benchmarks.py [--tags 10 50] [--months 1 3] [--repeat 3]
+    python benchmarks/run_benchmarks.py --compare results/a.json results/b.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'procesado'))
+
+from compute_consumption import (
+    append_minute_consumption,
+    apply_rect_0,
+    attach_anomalies,
+    combine_tot_high_low,
+    compute_minute_chain,
+    detect_counter_resets,
+)
+from compute_hourly_consumption import aggregate_to_hourly
+from synthetic import synthetic_totals
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def _stages(raw):
+    """(name, function, input) for every stage; each input is the previous stage's output."""
+    combined = combine_tot_high_low(raw)
+    rected = apply_rect_0(combined)
+    with_cons = append_minute_consumption(rected)
+    with_anom = attach_anomalies(with_cons.copy(), rule='pair_run')
+    with_resets = detect_counter_resets(with_anom)
+    return [
+        ('combine', combine_tot_high_low, raw),
+        ('rect_0', apply_rect_0, combined),
+        ('cons', append_minute_consumption, rected),
+        ('anomalies_pair_run', lambda df: attach_anomalies(df.copy(), rule='pair_run'), with_cons),
+        ('anomalies_negative_run', lambda df: attach_anomalies(df.copy(), rule='negative_run'), with_cons),
+        ('resets', detect_counter_resets, with_anom),
+        ('hourly', aggregate_to_hourly, with_resets),
+        ('chain', compute_minute_chain, raw),
+    ]
+
+
+def _measure(func, arg, repeat):
+    """(best wall seconds, peak traced bytes) of `func(arg)`; prints of the stage are silenced."""
+    best = float('inf')
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            func(arg)
+            best = min(best, time.perf_counter() - t0)
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(tags_grid, months_grid, repeat=3, seed=0):
+    results = []
+    for months in months_grid:
+        for tags in tags_grid:
+            raw, _ = synthetic_totals(tags=tags, days=30 * months, seed=seed)
+            with contextlib.redirect_stdout(io.StringIO()):
+                stages = _stages(raw)
+            for name, func, arg in stages:
+                seconds, peak = _measure(func, arg, repeat)
+                results.append({'stage': name, 'tags': tags, 'months': months, 'rows': len(arg),
+                                'seconds': round(seconds, 6), 'rows_per_sec': round(len(arg) / seconds, 1),
+                                'peak_mb': round(peak / 1e6, 2)})
+                print(f"{name:24s} tags={tags:4d} months={months:3d} {seconds:9.4f}s {peak / 1e6:9.1f} MB")
+    return {
+        'commit': _git_commit(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'seed': seed,
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare(old_path, new_path):
+    """Print new/old time and memory ratios per (stage, tags, months)."""
+    with open(old_path, 'r', encoding='utf-8') as f:
+        old = {(r['stage'], r['tags'], r['months']): r for r in json.load(f)['results']}
+    with open(new_path, 'r', encoding='utf-8') as f:
+        new = json.load(f)['results']
+    print(f"{'stage':24s} {'tags':>5s} {'months':>6s} {'time x':>8s} {'mem x':>8s}")
+    for r in new:
+        ref = old.get((r['stage'], r['tags'], r['months']))
+        if ref is None:
+            continue
+        t_ratio = r['seconds'] / ref['seconds'] if ref['seconds'] else float('nan')
+        m_ratio = r['peak_mb'] / ref['peak_mb'] if ref['peak_mb'] else float('nan')
+        print(f"{r['stage']:24s} {r['tags']:5d} {r['months']:6d} {t_ratio:8.2f} {m_ratio:8.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de las etapas de procesado")
+    parser.add_argument('--tags', type=int, nargs='+', default=[10, 50])
+    parser.add_argument('--months', type=int, nargs='+', default=[1, 3])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Fichero JSON de resultados (por defecto en benchmarks/results)")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    report = run(args.tags, args.months, args.repeat, args.seed)
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{report['commit']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Resultados: {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
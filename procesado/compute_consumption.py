@@ -1,10 +1,40 @@
+import logging
+
 import pandas as pd
 import numpy as np
 
+RESET_THRESHOLD = -1000000
+
+
+def _reset_threshold(col, thresholds):
+    """Threshold for `col` from a scalar or a {column or tag: threshold} mapping.
 
-def detect_counter_resets(df: pd.DataFrame, total_columns=None) -> pd.DataFrame:
+    A mapping may carry a 'default' entry for columns without their own value.
+    """
+    if thresholds is None:
+        return RESET_THRESHOLD
+    if not isinstance(thresholds, dict):
+        return thresholds
+    base = col[:-len('_rect_0')] if col.endswith('_rect_0') else col
+    for key in (col, base, base[:-len('_TOT')] if base.endswith('_TOT') else base):
+        if key in thresholds:
+            return thresholds[key]
+    return thresholds.get('default', RESET_THRESHOLD)
+
+
+def detect_counter_resets(df: pd.DataFrame, total_columns=None, thresholds=None, registry=None) -> pd.DataFrame:
     """Detect counter resets in totalizer columns and mark corrections in anomaly columns.
     
+    A reset is a minute whose consumption (next total - current total) is below
+    the threshold (-1,000,000 by default; `thresholds` may be a scalar or a
+    mapping by column/tag). All columns are checked in one vectorized pass.
+    
+    The counter maximum is the smallest maximum confirmed in `registry` (a
+    `CounterRegistry`) above the value before the reset; otherwise it is
+    estimated with `determine_counter_max` and recorded in the registry as a
+    candidate, confirmed once several distinct resets agree. The registry is
+    only updated in memory; the caller saves it.
+    
     Returns:
     --------
     pd.DataFrame
@@ -19,45 +49,55 @@ def detect_counter_resets(df: pd.DataFrame, total_columns=None) -> pd.DataFrame:
             total_columns = [c for c in df.columns if c.endswith('_TOT')]
     
     result = df.copy()
-    
-    for col in total_columns:
-        print(f"Checking for counter resets in column: {col}")
-        totals = df[col].astype(float)
-        
-        # Calculate consumption differences to find potential resets
-        consumption = totals.shift(-1) - totals
-        
-        # Look for very negative values that could indicate counter resets
-        # Threshold: differences less than -1,000,000 (1 million) are likely resets
-        reset_mask = consumption < -1000000
-        reset_indices = reset_mask[reset_mask].index
-        
-        if len(reset_indices) > 0:
-            print(f"  Found {len(reset_indices)} potential counter resets")
-            
-            anom_col = f"{col}_anom"
-            if anom_col in result.columns:
-                for reset_idx in reset_indices:
-                    # Get position in array
-                    reset_pos = totals.index.get_loc(reset_idx)
-                    if reset_pos < len(totals) - 1:
-                        prev_value = totals.iloc[reset_pos]
-                        curr_value = totals.iloc[reset_pos + 1]
-                        
-                        print(f"  Reset detected at index {reset_idx} (pos {reset_pos}): {prev_value} → {curr_value}")
-                        
-                        # Estimate counter maximum (usually power of 10: 10^7, 10^8, 10^9)
-                        counter_max = determine_counter_max(prev_value)
-                        
-                        # Calculate actual consumption during reset
-                        actual_consumption = (counter_max - prev_value) + curr_value
-                        print(f"    Estimated counter maximum: {counter_max}")
-                        print(f"    Actual consumption during reset: {actual_consumption}")
-                        
-                        # Mark the correction in the anomaly column at the reset minute
-                        result.loc[reset_idx, anom_col] = actual_consumption
-                        print(f"    Marked correction in {anom_col} at {reset_idx}")
-    
+    if len(df) < 2:
+        return result
+
+    # Only columns with an anomaly column can receive corrections
+    cols = [c for c in total_columns if f"{c}_anom" in result.columns]
+    if not cols:
+        return result
+
+    totals = df[cols].to_numpy(dtype=float)
+    limits = np.array([_reset_threshold(c, thresholds) for c in cols], dtype=float)
+    rows, idx = np.nonzero((totals[1:] - totals[:-1]) < limits)
+    if len(rows) == 0:
+        return result
+
+    prev_values = totals[rows, idx]
+    curr_values = totals[rows + 1, idx]
+
+    # Counter maximum: registered per meter or estimated (usually power of 10: 10^7, 10^8, 10^9)
+    counter_max = np.empty(len(rows), dtype=float)
+    estimated = {}
+    for k, (c, prev_value) in enumerate(zip(idx, prev_values)):
+        registered = registry.get(cols[c], above=prev_value) if registry is not None else None
+        if registered is not None:
+            counter_max[k] = registered
+        else:
+            counter_max[k] = determine_counter_max(prev_value)
+            estimated.setdefault(c, []).append(k)
+
+    # Actual consumption during reset, marked at the reset minute
+    actual_consumption = (counter_max - prev_values) + curr_values
+
+    for c, col in enumerate(cols):
+        hits = idx == c
+        if not hits.any():
+            continue
+        anom_col = f"{col}_anom"
+        anom = result[anom_col].to_numpy(dtype=float, copy=True)
+        anom[rows[hits]] = actual_consumption[hits]
+        result[anom_col] = anom
+        logging.debug("%s: %d counter resets corrected in %s", col, int(hits.sum()), anom_col)
+
+        if registry is not None and c in estimated:
+            # Each estimate is a candidate for the reset it explains; agreeing resets confirm it
+            for value in np.unique(counter_max[estimated[c]]):
+                events = [df.index[rows[k] + 1] for k in estimated[c] if counter_max[k] == value]
+                registry.confirm(col, value, events=events)
+
+    logging.info("Counter resets corrected: %d in %d columns", len(rows), len(np.unique(idx)))
+
     return result
 
 
@@ -78,6 +118,109 @@ def determine_counter_max(value):
     return int(counter_max)
 
 
+def combine_hl_arrays(high, low) -> np.ndarray:
+    """32-bit totals from aligned 2-D arrays of 16-bit high and low words (minutes x tags).
+
+    Missing words count as 0; the low word is masked to 16 bits.
+    """
+    high = np.nan_to_num(np.asarray(high, dtype=float), nan=0.0).astype(np.int64)
+    low = np.nan_to_num(np.asarray(low, dtype=float), nan=0.0).astype(np.int64)
+    return (high << 16) | (low & 0xFFFF)
+
+
+def rect_0_invalid(totals) -> np.ndarray:
+    """rect_0 invalid mask of a 2-D (minutes x tags) or 1-D totals array.
+
+    A reading is invalid if it is exactly zero, or if it is lower than the
+    previous reading AND the next reading is lower still or zero. Comparisons
+    with missing neighbours (first/last minute, NaN) are False.
+    """
+    s = np.asarray(totals, dtype=float)
+    prev = np.full_like(s, np.nan)
+    nxt = np.full_like(s, np.nan)
+    prev[1:] = s[:-1]
+    nxt[:-1] = s[1:]
+    with np.errstate(invalid='ignore'):
+        return (s == 0) | ((s < prev) & ((nxt < s) | (nxt == 0)))
+
+
+def rect_0_fill(totals, invalid=None) -> np.ndarray:
+    """Replace invalid (and missing) readings by the last valid one down each column; 0 before any."""
+    s = np.asarray(totals, dtype=float)
+    if invalid is None:
+        invalid = rect_0_invalid(s)
+    keep = ~invalid & ~np.isnan(s)
+    rows = np.arange(len(s)).reshape((-1,) + (1,) * (s.ndim - 1))
+    last = np.maximum.accumulate(np.where(keep, rows, -1), axis=0)
+    filled = np.take_along_axis(s, np.maximum(last, 0), axis=0)
+    filled[last < 0] = 0
+    return filled.astype(np.int64)
+
+
+def next_minute_diff(totals) -> np.ndarray:
+    """totals[i + 1] - totals[i] down each column as float; the last minute is NaN."""
+    t = np.asarray(totals, dtype=float)
+    out = np.full_like(t, np.nan)
+    out[:-1] = t[1:] - t[:-1]
+    return out
+
+
+def minute_kernel(high, low):
+    """Combine H/L words, apply rect_0 and compute minute consumption for all tags at once.
+
+    Returns (totals, invalid, rect, cons) arrays shaped like `high`.
+    """
+    totals = combine_hl_arrays(high, low)
+    invalid = rect_0_invalid(totals)
+    rect = rect_0_fill(totals, invalid)
+    return totals, invalid, rect, next_minute_diff(rect)
+
+
+def _numeric_block(df: pd.DataFrame, columns) -> np.ndarray:
+    """`columns` of df as one float 2-D array (non-numeric values become NaN)."""
+    block = df[list(columns)]
+    if not all(pd.api.types.is_numeric_dtype(t) for t in block.dtypes):
+        block = block.apply(pd.to_numeric, errors='coerce')
+    return block.to_numpy(dtype=float)
+
+
+def combine_tot_high_low(df: pd.DataFrame) -> pd.DataFrame:
+    """Combine `<base>_TOT_H` / `<base>_TOT_L` 16-bit pairs into a 32-bit `<base>_TOT` column.
+
+    The original H/L columns are dropped; columns without a pair are kept as is.
+    """
+    high_cols = [c for c in df.columns if c.endswith('_TOT_H') and c[:-6] + '_TOT_L' in df.columns]
+    if not high_cols:
+        return df.copy()
+    low_cols = [c[:-6] + '_TOT_L' for c in high_cols]
+    totals = combine_hl_arrays(_numeric_block(df, high_cols), _numeric_block(df, low_cols))
+
+    paired = set(high_cols) | set(low_cols)
+    kept = df[[c for c in df.columns if c not in paired]]
+    tot = pd.DataFrame(totals, index=df.index, columns=[c[:-6] + '_TOT' for c in high_cols])
+    return pd.concat([kept, tot], axis=1)
+
+
+def rect_0_invalid_mask(s: pd.Series) -> pd.Series:
+    """Readings discarded by the rect_0 rule (see `rect_0_invalid`)."""
+    values = pd.to_numeric(s, errors='coerce').to_numpy(dtype=float)
+    return pd.Series(rect_0_invalid(values), index=s.index, name=s.name)
+
+
+def apply_rect_0(df: pd.DataFrame) -> pd.DataFrame:
+    """Add `<col>_rect_0` for each `*_TOT` column: invalid readings replaced by the last valid one."""
+    # Remove any previous rect columns to avoid duplicates
+    existing_rect_cols = [c for c in df.columns if c.endswith('_rect_0') or c == 'rect_0']
+    rected = df.drop(columns=existing_rect_cols) if existing_rect_cols else df.copy()
+
+    tot_cols = [c for c in rected.columns if c.endswith('_TOT')]
+    if not tot_cols:
+        return rected
+    rect = rect_0_fill(_numeric_block(rected, tot_cols))
+    rect_df = pd.DataFrame(rect, index=rected.index, columns=[f"{c}_rect_0" for c in tot_cols])
+    return pd.concat([rected, rect_df], axis=1)
+
+
 def compute_minute_consumption(df: pd.DataFrame, total_columns=None) -> pd.DataFrame:
     """Compute minute consumption for totalized columns.
 
@@ -96,13 +239,8 @@ def compute_minute_consumption(df: pd.DataFrame, total_columns=None) -> pd.DataF
         else:
             total_columns = [c for c in df.columns if c.endswith('_TOT')]
 
-    out = pd.DataFrame(index=df.index)
-
-    for col in total_columns:
-        # compute difference with next row: shift(-1)
-        out[f"{col}_cons"] = df[col].shift(-1) - df[col]
-
-    return out
+    cons = next_minute_diff(df[list(total_columns)].to_numpy(dtype=float))
+    return pd.DataFrame(cons, index=df.index, columns=[f"{col}_cons" for col in total_columns])
 
 
 def append_minute_consumption(df: pd.DataFrame, total_columns=None) -> pd.DataFrame:
@@ -111,26 +249,96 @@ def append_minute_consumption(df: pd.DataFrame, total_columns=None) -> pd.DataFr
     Keeps original columns and appends `<col>_cons` for each total column.
     Returns the dataframe ready for reset detection (without applying it yet).
     """
-    # Compute normal consumption
     cons = compute_minute_consumption(df, total_columns=total_columns)
-    
-    # Join with original dataframe
-    result = df.copy()
-    for c in cons.columns:
-        result[c] = cons[c]
-    
-    return result
+    # Existing `_cons` columns are overwritten in place, new ones appended
+    result = df.drop(columns=[c for c in cons.columns if c in df.columns])
+    result = pd.concat([result, cons], axis=1)
+    return result[list(df.columns) + [c for c in cons.columns if c not in df.columns]]
+
+
+ANOMALY_RULES = ('negative_run', 'pair_run')
+
+
+def distribute_anomalies(cons, totals_raw, rule='pair_run') -> np.ndarray:
+    """Distribute negative+positive consumption pairs for all tag columns at once.
+
+    `cons` and `totals_raw` are aligned 2-D arrays (minutes x tags; 1-D is
+    accepted for a single tag). A pair is a minute i with cons[i] < 0 followed
+    by cons[i + 1] > 0; when net = cons[i] + cons[i + 1] > 0 the net is spread
+    over a range of minutes depending on `rule`:
+
+    - 'negative_run': minutes from the start of the run of zero/missing raw
+      totals ending at i, up to i (nothing if totals_raw[i] is valid).
+    - 'pair_run': minutes from the start of the run of zero raw totals ending
+      at i - 1, up to i + 1 (just i and i + 1 when there is no such run).
+
+    Pairs never overlap, zero-run starts come from a cumulative maximum of the
+    last non-zero position, and the additions are applied in minute order, so
+    the result is identical to scanning each column minute by minute.
+
+    Returns the anomaly matrix with 0.0 where nothing was distributed.
+    """
+    if rule not in ANOMALY_RULES:
+        raise ValueError(f"Unknown anomaly rule {rule!r}, expected one of {ANOMALY_RULES}")
+
+    cons = np.asarray(cons, dtype=float)
+    totals_raw = np.asarray(totals_raw, dtype=float)
+    squeeze = cons.ndim == 1
+    if squeeze:
+        cons = cons[:, None]
+        totals_raw = totals_raw[:, None]
+
+    n = cons.shape[0]
+    anom = np.zeros(cons.shape, dtype=float)
+    if n < 2:
+        return anom[:, 0] if squeeze else anom
+
+    rows, cols = np.nonzero((cons[:-1] < 0) & (cons[1:] > 0))
+    net = cons[rows, cols] + cons[rows + 1, cols]
+    keep = net > 0
+    rows, cols, net = rows[keep], cols[keep], net[keep]
+
+    if rule == 'negative_run':
+        zero = (totals_raw == 0) | np.isnan(totals_raw)
+    else:
+        zero = totals_raw == 0
+    positions = np.arange(n)[:, None]
+    last_valid = np.maximum.accumulate(np.where(zero, -1, positions), axis=0)
+
+    if rule == 'negative_run':
+        starts = last_valid[rows, cols] + 1
+        ends = rows
+    else:
+        prev_valid = np.where(rows > 0, last_valid[np.maximum(rows - 1, 0), cols], -1)
+        starts = prev_valid + 1
+        ends = rows + 1
+
+    lengths = ends - starts + 1
+    keep = lengths > 0
+    starts, cols, net, lengths = starts[keep], cols[keep], net[keep], lengths[keep]
+    per = net / lengths
+
+    # Expand every [start, end] range into explicit (row, col) targets in pair order
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    np.add.at(anom, (np.repeat(starts, lengths) + offsets, np.repeat(cols, lengths)), np.repeat(per, lengths))
+
+    return anom[:, 0] if squeeze else anom
+
+
+def _anomaly_frame(anom, index, anom_columns) -> pd.DataFrame:
+    anom_df = pd.DataFrame(anom, index=index, columns=anom_columns, dtype='float64')
+    # set NaN where anom is zero to keep CSV cleaner
+    return anom_df.replace(0.0, np.nan)
 
 
 def distribute_negative_compensations(df: pd.DataFrame, total_columns=None) -> pd.DataFrame:
     """Detect negative consumption followed by compensating positive and distribute
     the net positive across previous minutes where the total column was zero.
 
+    Uses the 'negative_run' rule of `distribute_anomalies`.
     Returns a DataFrame with new anomaly columns named `<total_column>_anom`.
     The function does NOT modify the input df.
     """
-    import numpy as np
-
     if total_columns is None:
         rect_cols = [c for c in df.columns if c.endswith('_rect_0')]
         if rect_cols:
@@ -139,55 +347,27 @@ def distribute_negative_compensations(df: pd.DataFrame, total_columns=None) -> p
             total_columns = [c for c in df.columns if c.endswith('_TOT')]
 
     anom_df = pd.DataFrame(index=df.index)
+    cols = [c for c in total_columns if f"{c}_cons" in df.columns]
+
+    if cols:
+        cons = np.column_stack([df[f"{c}_cons"].astype(float).to_numpy() for c in cols])
+        raws = []
+        for total_col in cols:
+            # prefer to inspect the raw *_TOT column to find zero runs
+            if total_col.endswith('_rect_0'):
+                raw_col = total_col.replace('_rect_0', '_TOT')
+            else:
+                raw_col = total_col
+            src = raw_col if raw_col in df.columns else total_col
+            raws.append(df[src].astype(float).to_numpy())
+        anom = distribute_anomalies(cons, np.column_stack(raws), rule='negative_run')
+        computed = _anomaly_frame(anom, df.index, [f"{c}_anom" for c in cols])
+    else:
+        computed = pd.DataFrame(index=df.index)
 
     for total_col in total_columns:
-        cons_col = f"{total_col}_cons"
         anom_col = f"{total_col}_anom"
-
-        if cons_col not in df.columns:
-            anom_df[anom_col] = np.nan
-            continue
-
-        cons = df[cons_col].astype(float).reset_index(drop=True)
-        # prefer to inspect the raw *_TOT column to find zero runs
-        if total_col.endswith('_rect_0'):
-            raw_col = total_col.replace('_rect_0', '_TOT')
-        else:
-            raw_col = total_col
-
-        if raw_col in df.columns:
-            totals_raw = df[raw_col].astype(float).reset_index(drop=True)
-        else:
-            totals_raw = df[total_col].astype(float).reset_index(drop=True)
-        n = len(df)
-        anom = np.zeros(n, dtype=float)
-
-        i = 0
-        while i < n - 1:
-            cur = cons.iat[i]
-            nxt = cons.iat[i + 1]
-            # negative followed by positive
-            if cur < 0 and nxt > 0:
-                net = cur + nxt  # cur is negative
-                if net > 0:
-                    # walk backwards from i while totals == 0
-                    j = i
-                    while j >= 0 and (totals_raw.iat[j] == 0 or np.isnan(totals_raw.iat[j])):
-                        j -= 1
-                    start = j + 1
-                    end = i
-                    count = end - start + 1
-                    if count > 0:
-                        per = net / count
-                        anom[start:end + 1] += per
-                i += 2
-            else:
-                i += 1
-
-        anom_series = pd.Series(anom, index=df.index, dtype='float64')
-        # set NaN where anom is zero to keep CSV cleaner
-        anom_series = anom_series.replace(0.0, np.nan)
-        anom_df[anom_col] = anom_series
+        anom_df[anom_col] = computed[anom_col] if anom_col in computed.columns else np.nan
 
     return anom_df
 
@@ -197,9 +377,9 @@ def attach_anomalies_to_df(df: pd.DataFrame, total_columns=None) -> pd.DataFrame
 
     This function expects `df` to already contain `<col>_cons` columns for totals.
     It preserves the original negative values in _cons and creates separate _anom
-    columns with the distributed corrections.
+    columns with the distributed corrections (the 'pair_run' rule of
+    `distribute_anomalies`).
     """
-    import numpy as np
     if total_columns is None:
         rect_cols = [c for c in df.columns if c.endswith('_rect_0')]
         if rect_cols:
@@ -207,54 +387,49 @@ def attach_anomalies_to_df(df: pd.DataFrame, total_columns=None) -> pd.DataFrame
         else:
             total_columns = [c for c in df.columns if c.endswith('_TOT')]
 
+    cols = [c for c in total_columns if f"{c}_cons" in df.columns]
+    computed = None
+    if cols:
+        cons = np.column_stack([
+            pd.to_numeric(df[f"{c}_cons"], errors='coerce').fillna(0).to_numpy() for c in cols])
+        raws = []
+        for total_col in cols:
+            # prefer raw TOT to detect zero runs
+            raw_col = total_col.replace('_rect_0', '') if total_col.endswith('_rect_0') else total_col
+            src = raw_col if raw_col in df.columns else total_col
+            raws.append(pd.to_numeric(df[src], errors='coerce').to_numpy(dtype=float))
+        anom = distribute_anomalies(cons, np.column_stack(raws), rule='pair_run')
+        computed = _anomaly_frame(anom, df.index, [f"{c}_anom" for c in cols])
+
     for total_col in total_columns:
-        cons_col = f"{total_col}_cons"
         anom_col = f"{total_col}_anom"
-
-        if cons_col not in df.columns:
+        if computed is not None and anom_col in computed.columns:
+            df[anom_col] = computed[anom_col]
+        else:
             df[anom_col] = np.nan
-            continue
 
-        # prefer raw TOT to detect zero runs
-        raw_col = total_col.replace('_rect_0', '') if total_col.endswith('_rect_0') else total_col
-        if raw_col in df.columns:
-            totals_raw = pd.to_numeric(df[raw_col], errors='coerce').fillna(np.nan).to_numpy()
-        else:
-            totals_raw = pd.to_numeric(df[total_col], errors='coerce').fillna(np.nan).to_numpy()
-
-        cons = pd.to_numeric(df[cons_col], errors='coerce').fillna(0).to_numpy()
-        n = len(df)
-        anom = np.zeros(n, dtype=float)
-        i = 0
-        while i < n - 1:
-            cur = cons[i]
-            nxt = cons[i + 1]
-            if cur < 0 and nxt > 0:
-                net = cur + nxt
-                if net > 0:
-                    # Buscar hacia atrás los minutos consecutivos donde totals_raw == 0
-                    j = i - 1  # Empezar desde el minuto anterior al negativo
-                    while j >= 0 and totals_raw[j] == 0:
-                        j -= 1
-                    start = j + 1
-                    end = i + 1  # Incluir hasta el minuto DESPUÉS del consumo negativo
-                    count = end - start + 1
-                    
-                    if count > 2:  # Hay minutos con total=0 además de los dos problemáticos
-                        # Distribuir entre TODOS los minutos del rango (incluye minutos con total=0 + los dos problemáticos)
-                        per = net / count
-                        for k in range(start, end + 1):
-                            anom[k] += per
-                    else:
-                        # No hay minutos con total=0, distribuir solo entre los dos consumos problemáticos
-                        per = net / 2
-                        anom[i] += per      # Minuto del consumo negativo
-                        anom[i + 1] += per  # Minuto del consumo positivo
-                i += 2
-            else:
-                i += 1
+    return df
 
-        anom_series = pd.Series(anom, index=df.index, dtype='float64').replace(0.0, np.nan)
-        df[anom_col] = anom_series
 
-    return df
+def attach_anomalies(df: pd.DataFrame, rule='pair_run') -> pd.DataFrame:
+    """Attach `_anom` columns computed with the given `ANOMALY_RULES` rule."""
+    if rule not in ANOMALY_RULES:
+        raise ValueError(f"Unknown anomaly rule {rule!r}, expected one of {ANOMALY_RULES}")
+    if rule == 'negative_run':
+        anom_df = distribute_negative_compensations(df)
+        for c in anom_df.columns:
+            df[c] = anom_df[c]
+        return df
+    return attach_anomalies_to_df(df)
+
+
+def compute_minute_chain(df: pd.DataFrame, anomaly_rule='pair_run', thresholds=None, registry=None) -> pd.DataFrame:
+    """Run the minute processing chain on raw totals (H/L pairs or `*_TOT` columns).
+
+    combine H/L -> rect_0 -> minute consumption -> anomalies (`anomaly_rule`)
+    -> counter resets. Returns the minute frame with `_rect_0`, `_cons` and
+    `_anom` columns, as the step-by-step scripts produce it.
+    """
+    result = append_minute_consumption(apply_rect_0(combine_tot_high_low(df)))
+    result = attach_anomalies(result, rule=anomaly_rule)
+    return detect_counter_resets(result, thresholds=thresholds, registry=registry)
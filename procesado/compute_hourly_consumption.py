@@ -5,11 +5,52 @@ Este módulo procesa datos de consumo minutos corregidos y genera:
 1. Suma horaria directa de consumos (_cons)
 2. Suma horaria aplicando correcciones de anomalías (_anom)
 """
+import json
+import logging
 import os
+import sys
 import pandas as pd
 import numpy as np
 from datetime import datetime
 
+sys.path.insert(0, os.path.dirname(__file__))
+from storage import export_csv, find_latest, load_frame, save_frame, storage_settings
+
+
+def _corrected_hourly_sums(cons, anom, present, has_corrections, hourly_cons):
+    """
+    Consumo horario corregido: anomalía donde existe y consumo original en el resto.
+    
+    Las horas sin anomalías reutilizan la suma directa. Para las horas con
+    anomalías los minutos se acumulan en orden (suma secuencial, un NaN en el
+    consumo sin anomalía propaga NaN), igual que el recorrido minuto a minuto.
+    """
+    corrected = hourly_cons.copy()
+    flagged = has_corrections.to_numpy()
+    hours_with_anom = has_corrections.index[flagged.any(axis=1)]
+    if len(hours_with_anom) == 0:
+        return corrected
+    
+    # Sólo los minutos de horas con alguna anomalía
+    minute_hours = cons.index.floor('h')
+    rows = minute_hours.isin(hours_with_anom)
+    values = np.where(present.to_numpy()[rows], anom.to_numpy(dtype=float)[rows],
+                      cons.to_numpy(dtype=float)[rows])
+    codes = hours_with_anom.get_indexer(minute_hours[rows])
+    
+    # Colocar cada minuto en (hora, posición dentro de la hora) y acumular por hora
+    counts = np.bincount(codes, minlength=len(hours_with_anom))
+    first = np.cumsum(counts) - counts
+    slots = np.arange(len(codes)) - first[codes]
+    grid = np.zeros((len(hours_with_anom), counts.max(), values.shape[1]))
+    grid[codes, slots] = values
+    sums = np.cumsum(grid, axis=1)[:, -1, :]
+    
+    target = corrected.index.get_indexer(hours_with_anom)
+    current = corrected.to_numpy(dtype=float, copy=True)
+    current[target] = np.where(flagged[target], sums, current[target])
+    return pd.DataFrame(current, index=corrected.index, columns=corrected.columns)
+
 
 def aggregate_to_hourly(df_minutes):
     """
@@ -43,145 +84,109 @@ def aggregate_to_hourly(df_minutes):
     if not cons_cols:
         raise ValueError("No se encontraron columnas de consumo (_cons)")
     
-    print(f"Procesando agregación horaria para columnas: {cons_cols}")
+    logging.debug("Agregación horaria de las columnas: %s", cons_cols)
+    
+    # Suma horaria directa de todas las columnas de consumo en una sola pasada
+    hourly_cons = df[cons_cols].resample('h', label='left', closed='left').sum()
+    
+    # Columnas de anomalías correspondientes (pueden no existir para algún tag)
+    anom_for = {c: c.replace('_cons', '') + '_anom' for c in cons_cols}
+    with_anom = [c for c in cons_cols if anom_for[c] in df.columns]
+    
+    corrected = hourly_cons.copy()
+    has_corrections = pd.DataFrame(False, index=hourly_cons.index, columns=cons_cols)
+    if with_anom:
+        anom_values = df[[anom_for[c] for c in with_anom]]
+        anom_values.columns = with_anom
+        present = anom_values.notna()
+        has_corrections[with_anom] = present.resample('h', label='left', closed='left').sum() > 0
+        corrected[with_anom] = _corrected_hourly_sums(
+            df[with_anom], anom_values, present, has_corrections[with_anom], hourly_cons[with_anom])
     
     # Crear DataFrame resultado
     result_data = {}
-    
     for cons_col in cons_cols:
-        # Identificar la columna de anomalías correspondiente
-        tag_base = cons_col.replace('_cons', '')
-        anom_col = tag_base + '_anom'
-        
-        print(f"Procesando {cons_col} con anomalías en {anom_col}")
-        
         # Generar nombres para las columnas de salida
-        tag_name = tag_base.replace('_rect_0', '')  # Remover _rect_0 para nombre limpio
-        hourly_cons_col = f"{tag_name}_hourly_cons"
-        hourly_cons_corrected_col = f"{tag_name}_hourly_cons_corrected"  # Consumo total corregido
-        hourly_has_corrections_col = f"{tag_name}_hourly_has_corrections"  # Indicador de correcciones
-        
-        # Agrupar por hora y sumar consumos
-        df_hourly = df.resample('h', label='left', closed='left').agg({
-            cons_col: 'sum'
-        }).rename(columns={cons_col: hourly_cons_col})
-        
-        # Calcular consumo corregido si existe columna de anomalías
-        if anom_col in df.columns:
-            print(f"  Aplicando correcciones de anomalías desde {anom_col}")
-            
-            # Para cada hora, calcular el consumo corregido e indicador
-            corrected_hourly = []
-            has_corrections = []
-            
-            for hour_start in df_hourly.index:
-                hour_end = hour_start + pd.Timedelta(hours=1)
-                hour_data = df.loc[hour_start:hour_end - pd.Timedelta(minutes=1)]
-                
-                if hour_data.empty:
-                    corrected_hourly.append(0.0)
-                    has_corrections.append(False)
-                    continue
-                
-                # Verificar si la hora tiene alguna anomalía (corrección aplicada)
-                has_anomalies = hour_data[anom_col].notna().any()
-                has_corrections.append(has_anomalies)
-                
-                if has_anomalies:
-                    # Si hay anomalías, calcular consumo minuto a minuto con correcciones
-                    real_consumption = 0.0
-                    for idx, row in hour_data.iterrows():
-                        if pd.notna(row[anom_col]):
-                            # Usar valor de corrección
-                            real_consumption += row[anom_col]
-                        else:
-                            # Usar consumo original
-                            real_consumption += row[cons_col]
-                    corrected_hourly.append(real_consumption)
-                else:
-                    # Sin anomalías, usar suma directa
-                    corrected_hourly.append(hour_data[cons_col].sum())
-            
-            df_hourly[hourly_cons_corrected_col] = corrected_hourly
-            df_hourly[hourly_has_corrections_col] = has_corrections
-        else:
-            print(f"  No se encontró columna de anomalías {anom_col}, usando consumo directo")
-            df_hourly[hourly_cons_corrected_col] = df_hourly[hourly_cons_col]
-            df_hourly[hourly_has_corrections_col] = False
-        
-        # Agregar al resultado
-        for col in df_hourly.columns:
-            result_data[col] = df_hourly[col]
+        tag_name = cons_col.replace('_cons', '').replace('_rect_0', '')  # Remover _rect_0 para nombre limpio
+        result_data[f"{tag_name}_hourly_cons"] = hourly_cons[cons_col]
+        result_data[f"{tag_name}_hourly_cons_corrected"] = corrected[cons_col]  # Consumo total corregido
+        result_data[f"{tag_name}_hourly_has_corrections"] = has_corrections[cons_col].astype(bool)  # Indicador de correcciones
     
     # Crear DataFrame final
     result_df = pd.DataFrame(result_data)
     result_df.index.name = 'timeStamp'
     
-    print(f"Agregación completada. Shape: {result_df.shape}")
-    print(f"Columnas generadas: {list(result_df.columns)}")
+    logging.info("Agregación horaria: %d columnas de consumo, %d horas", len(cons_cols), len(result_df))
     
     return result_df
 
 
-def process_latest_minute_data(root_path=None):
+def process_latest_minute_data(root_path=None, cfg=None):
     """
-    Procesa el archivo más reciente de datos minutales y genera agregación horaria.
+    Procesa el fichero más reciente de datos minutales y genera agregación horaria.
     
     Parameters:
     -----------
     root_path : str, optional
         Ruta raíz del proyecto. Si no se especifica, se detecta automáticamente.
+    cfg : dict, optional
+        Configuración del proyecto. Si no se especifica, se lee `consums_config.json`.
         
     Returns:
     --------
     str
-        Ruta del archivo generado
+        Ruta del fichero generado
     """
     if root_path is None:
         root_path = os.path.dirname(os.path.dirname(__file__))
-    
-    # Buscar el archivo más reciente en procesado/Data
+    if cfg is None:
+        config_path = os.path.join(root_path, 'consums_config.json')
+        cfg = {}
+        if os.path.exists(config_path):
+            with open(config_path, 'r', encoding='utf-8') as f:
+                cfg = json.load(f)
+    
+    # Buscar el fichero más reciente en procesado/Data (formatos tipados primero, CSV antiguos si no hay)
     data_dir = os.path.join(root_path, 'procesado', 'Data')
-    pattern = os.path.join(data_dir, 'consumption_minutes_with_anom_*.csv')
-    
-    import glob
-    files = glob.glob(pattern)
-    if not files:
-        raise FileNotFoundError(f"No se encontraron archivos de consumo minutos en {data_dir}")
+    latest_file = find_latest(data_dir, 'consumption_minutes_with_anom_')
+    if latest_file is None:
+        raise FileNotFoundError(f"No se encontraron ficheros de consumo minutos en {data_dir}")
+    print(f"Procesando fichero: {latest_file}")
     
-    # Obtener el más reciente
-    latest_file = max(files, key=os.path.getmtime)
-    print(f"Procesando archivo: {latest_file}")
-    
-    # Cargar datos minutales con detección de formato
-    try:
-        # Intentar formato estándar primero
-        df_minutes = pd.read_csv(latest_file)
-        print('Cargado CSV con formato estándar')
-    except Exception as e1:
-        try:
-            # Intentar formato europeo
-            df_minutes = pd.read_csv(latest_file, sep=';', decimal=',')
-            print('Cargado CSV con formato europeo (sep=";", decimal=",")')
-        except Exception as e2:
-            # Usar detección automática como último recurso
-            print(f'Formatos estándar y europeo fallaron, usando detección automática...')
-            df_minutes = pd.read_csv(latest_file, sep=None, engine='python')
-            print('Cargado CSV con formato autodetectado')
+    # Cargar datos minutales con sus dtypes (o con detección de formato si es CSV)
+    df_minutes = load_frame(latest_file)
     
     print(f"Datos minutales cargados. Shape: {df_minutes.shape}")
-    print(f"Columnas: {list(df_minutes.columns)}")
+    logging.debug("Columnas: %s", list(df_minutes.columns))
+    
+    fmt, compression, to_csv = storage_settings(cfg)
+    
+    # Modo incremental: sólo las horas tocadas se recalculan y se actualizan en el almacén
+    from hourly_store import store_from_config, update_hourly_store
+    store = store_from_config(cfg, root_path)
+    if store is not None:
+        requery = cfg.get('postprocess', {}).get('compute', {}).get('force_minute_requery_hours', [])
+        update_hourly_store(df_minutes, store, requery_hours=requery)
+        output_file = store.save()
+        print(f"Almacén horario actualizado: {output_file} ({len(store.frame)} horas)")
+        if to_csv:
+            export_csv(store.frame, store.path_stem + '.csv')
+            print(f"Almacén horario exportado: {store.path_stem}.csv")
+        return output_file
     
     # Procesar agregación horaria
     df_hourly = aggregate_to_hourly(df_minutes)
     
-    # Generar archivo de salida
+    # Generar fichero de salida en el formato de almacenamiento configurado
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    output_file = os.path.join(data_dir, f'consumption_hourly_{timestamp}.csv')
-    
-    # Guardar con formato europeo
-    df_hourly.to_csv(output_file, sep=';', decimal=',', index=True)
-    print(f"Archivo horario guardado: {output_file}")
+    output_stem = os.path.join(data_dir, f'consumption_hourly_{timestamp}')
+    output_file = save_frame(df_hourly, output_stem, fmt, compression)
+    print(f"Fichero horario guardado: {output_file}")
+    
+    if to_csv:
+        # Exportar con formato europeo
+        export_csv(df_hourly, output_stem + '.csv')
+        print(f"Fichero horario exportado: {output_stem}.csv")
     
     return output_file
 
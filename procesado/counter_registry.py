@@ -0,0 +1,107 @@
+"""
+Registro persistente de máximos de vuelta de contador por medidor.
+
+Cuando `detect_counter_resets` detecta un reinicio estima el máximo del
+contador (potencia de 10). El registro guarda cada estimación como candidata
+junto con el instante del reinicio, y sólo la confirma cuando al menos
+`MIN_AGREEING_EVENTS` reinicios distintos coinciden: un pico aislado (una
+lectura errónea muy alta antes de un "reinicio") no fija un máximo enorme para
+las ejecuciones siguientes. Reprocesar el mismo periodo no cuenta dos veces el
+mismo reinicio.
+
+Al corregir un reinicio se usa el menor máximo confirmado mayor que la lectura
+anterior. El fichero JSON puede editarse a mano para fijar el máximo real de
+un medidor: un `max` sin candidatas ni `last_confirmed` se toma como
+confirmado. Las entradas antiguas (un único `max` estimado, con
+`last_confirmed`) pasan a ser una candidata pendiente de confirmar.
+"""
+import json
+import os
+from datetime import datetime
+
+DEFAULT_REGISTRY_PATH = os.path.join(os.path.dirname(__file__), 'cache', 'counter_registry.json')
+MIN_AGREEING_EVENTS = 2
+MAX_EVENTS_KEPT = 20
+
+
+def _candidates(entry):
+    """{max: [reset timestamps]} of an entry, migrating hand-set and older single-max entries."""
+    if 'candidates' in entry:
+        return entry['candidates']
+    if entry.get('max') is None:
+        return {}
+    # Sin `last_confirmed` el máximo se ha fijado a mano; si no, es una estimación aislada antigua
+    events = ['legacy'] if 'last_confirmed' in entry else ['manual'] * MIN_AGREEING_EVENTS
+    return {str(int(entry['max'])): events}
+
+
+def meter_name(column):
+    """Registry key for a total column: `X_TOT_rect_0` and `X_TOT` share `X_TOT`."""
+    return column[:-len('_rect_0')] if column.endswith('_rect_0') else column
+
+
+class CounterRegistry:
+    """Per-meter rollover maxima confirmed by previous reset detections."""
+
+    def __init__(self, path=None, entries=None):
+        self.path = path
+        self.entries = entries or {}
+        self._dirty = False
+
+    @classmethod
+    def load(cls, path=None):
+        path = path or DEFAULT_REGISTRY_PATH
+        entries = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        return cls(path, entries)
+
+    def confirmed(self, column):
+        """Sorted confirmed maxima of `column`: candidates seen in enough distinct resets, or a hand-set `max`."""
+        entry = self.entries.get(meter_name(column))
+        if not entry:
+            return []
+        return sorted(int(m) for m, events in _candidates(entry).items() if len(events) >= MIN_AGREEING_EVENTS)
+
+    def get(self, column, above=None):
+        """Smallest confirmed counter maximum for `column` (greater than `above` if given), or None."""
+        maxima = [m for m in self.confirmed(column) if above is None or m > above]
+        return maxima[0] if maxima else None
+
+    def confirm(self, column, counter_max, events=()):
+        """Record that `counter_max` explained the resets at the `events` timestamps of this meter.
+
+        The maximum becomes confirmed once `MIN_AGREEING_EVENTS` distinct resets agree on it.
+        """
+        name = meter_name(column)
+        entry = self.entries.setdefault(name, {'max': None, 'confirmations': 0})
+        entry['candidates'] = _candidates(entry)
+        seen = entry['candidates'].setdefault(str(int(counter_max)), [])
+        new = [str(e) for e in dict.fromkeys(events) if str(e) not in seen]
+        if not new:
+            return
+        seen.extend(new)
+        del seen[:-MAX_EVENTS_KEPT]
+        confirmed = self.confirmed(column)
+        entry['max'] = confirmed[0] if confirmed else None
+        entry['confirmations'] = sum(len(v) for v in entry['candidates'].values())
+        entry['last_confirmed'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self._dirty = True
+
+    def merge(self, entries):
+        """Take over entries confirmed elsewhere (e.g. by a worker process on a copy)."""
+        for name, entry in entries.items():
+            if self.entries.get(name) != entry:
+                self.entries[name] = entry
+                self._dirty = True
+
+    def save(self):
+        if not self._dirty or not self.path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
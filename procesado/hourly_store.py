@@ -0,0 +1,230 @@
+"""
+Almacén horario persistente con actualización incremental (upsert por tag y hora).
+
+En lugar de recalcular todas las horas del periodo y escribir una copia
+`consumption_hourly_<timestamp>` completa en cada ejecución, el almacén guarda
+una única tabla horaria (índice hora, columnas `[Tag]_hourly_*` de
+`aggregate_to_hourly`) y en cada ejecución sólo se recalculan las horas tocadas:
+
+- desde la hora de dos minutos antes de la marca de agua (último minuto
+  agregado): al llegar el minuto siguiente cambia la decisión rect_0 del
+  último minuto y con ella el consumo del anterior,
+- las de `force_minute_requery_hours` (minutos corregidos),
+- ampliadas un minuto a cada lado (el consumo de un minuto depende del total
+  del siguiente) y a toda racha de anomalías que las cruce, porque la
+  distribución de anomalías puede repartir un consumo sobre horas anteriores,
+- todas, si hay tags sin columnas en el almacén (p. ej. tras cambiar el filtro
+  de señales). Las horas antiguas de un tag nuevo fuera de los minutos de la
+  ejecución quedan sin consumo (NaN), no a cero,
+- las que faltan en el almacén (huecos rellenados después o una ejecución con
+  un `period.start` anterior) y aquellas cuyos minutos han cambiado: el almacén
+  guarda junto a la tabla una huella por hora de los minutos `_cons`/`_anom`
+  agregados (`<almacén>_digests`) y se compara con la de los minutos actuales.
+
+Cada hora horaria depende sólo de sus propios minutos, así que el resultado es
+igual al de agregar el periodo completo.
+"""
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from compute_hourly_consumption import aggregate_to_hourly
+from storage import DEFAULT_COMPRESSION, FORMAT_EXTENSIONS, load_frame, resolve_format, save_frame, storage_settings
+
+DEFAULT_STORE_PATH = os.path.join('procesado', 'Data', 'consumption_hourly_store')
+
+
+def _anomaly_runs(anom: np.ndarray) -> np.ndarray:
+    """Run id of each minute for runs of consecutive non-NaN anomalies (per tag); -1 outside runs."""
+    present = ~np.isnan(anom)
+    starts = present & ~np.vstack([np.zeros((1, anom.shape[1]), dtype=bool), present[:-1]])
+    ids = np.cumsum(starts.ravel(order='F')).reshape(anom.shape, order='F') - 1
+    return np.where(present, ids, -1)
+
+
+def touched_hours(df_minutes: pd.DataFrame, high_water_mark=None, requery_hours=()) -> pd.DatetimeIndex:
+    """Hours whose hourly values must be recomputed from `df_minutes`.
+
+    Without a high-water mark (empty store) every hour is touched.
+    """
+    index = pd.DatetimeIndex(df_minutes.index)
+    hours = index.floor('h')
+    if high_water_mark is None:
+        return pd.DatetimeIndex(hours.unique(), name='timeStamp')
+
+    # El minuto siguiente a la marca de agua cambia rect_0 en la marca y el consumo del minuto anterior
+    reopen = (pd.Timestamp(high_water_mark) - pd.Timedelta(minutes=2)).floor('h')
+    touched = np.asarray(index >= reopen)
+    for hour in requery_hours:
+        touched |= np.asarray(hours == pd.Timestamp(hour).floor('h'))
+
+    # ±1 minuto: el consumo del minuto anterior depende del total corregido/nuevo
+    touched = touched | np.r_[touched[1:], False] | np.r_[False, touched[:-1]]
+
+    anom_cols = [c for c in df_minutes.columns if c.endswith('_anom')]
+    if anom_cols and touched.any():
+        runs = _anomaly_runs(df_minutes[anom_cols].to_numpy(dtype=float))
+        hit = np.unique(runs[touched][runs[touched] >= 0])
+        if len(hit):
+            touched |= np.isin(runs, hit).any(axis=1)
+
+    return pd.DatetimeIndex(hours[touched].unique(), name='timeStamp')
+
+
+def hour_digests(df_minutes: pd.DataFrame) -> pd.Series:
+    """Fingerprint per hour of the `_cons`/`_anom` minutes that `aggregate_to_hourly` reads."""
+    cols = [c for c in df_minutes.columns if c.endswith(('_cons', '_anom'))]
+    index = pd.DatetimeIndex(df_minutes.index)
+    rows = pd.util.hash_pandas_object(df_minutes[cols], index=True).to_numpy(dtype=np.uint64)
+    hours, codes = np.unique(index.floor('h'), return_inverse=True)
+    digests = np.zeros(len(hours), dtype=np.uint64)
+    np.add.at(digests, codes, rows)
+    return pd.Series(digests.view(np.int64), index=pd.DatetimeIndex(hours, name='timeStamp'), name='digest')
+
+
+def changed_hours(digests: pd.Series, stored_digests=None, stored_hours=None) -> pd.DatetimeIndex:
+    """Hours of `digests` missing from the store or whose minutes differ from the stored fingerprint."""
+    changed = np.ones(len(digests), dtype=bool) if stored_hours is None else ~digests.index.isin(stored_hours)
+    if stored_digests is not None:
+        previous = stored_digests.reindex(digests.index)
+        changed |= previous.isna().to_numpy() | (previous.to_numpy() != digests.to_numpy())
+    return pd.DatetimeIndex(digests.index[changed], name='timeStamp')
+
+
+def _fill_missing(frame: pd.DataFrame, columns=None) -> pd.DataFrame:
+    """Hours of a tag without data: 0 consumption and no corrections, as `aggregate_to_hourly` gives.
+
+    Only the consumption `columns` are zero-filled (all by default); the rest
+    stay NaN. `_has_corrections` columns are always filled with False.
+    """
+    columns = set(frame.columns if columns is None else columns)
+    for col in frame.columns:
+        if col.endswith('_has_corrections'):
+            frame[col] = frame[col].astype(object).fillna(False).astype(bool)
+        elif col in columns:
+            frame[col] = frame[col].astype(float).fillna(0.0)
+        else:
+            frame[col] = frame[col].astype(float)
+    return frame
+
+
+def new_tags(df_minutes: pd.DataFrame, frame) -> list:
+    """`*_TOT` tags of `df_minutes` without hourly columns in the stored `frame`."""
+    tags = [c for c in df_minutes.columns if c.endswith('_TOT')]
+    if frame is None:
+        return tags
+    return [t for t in tags if f"{t}_hourly_cons" not in frame.columns]
+
+
+class HourlyStore:
+    """Single persistent hourly table with a high-water mark of aggregated minutes."""
+
+    def __init__(self, path_stem=None, fmt=None, compression=DEFAULT_COMPRESSION):
+        self.path_stem = path_stem or os.path.join(os.path.dirname(os.path.dirname(__file__)), DEFAULT_STORE_PATH)
+        self.fmt = resolve_format(fmt)
+        self.compression = compression
+        self.meta_path = self.path_stem + '.meta.json'
+        self.digests_stem = self.path_stem + '_digests'
+        self.frame = None
+        self.digests = None
+        self.high_water_mark = None
+        self._load()
+
+    @property
+    def path(self):
+        return self.path_stem + FORMAT_EXTENSIONS[self.fmt]
+
+    def _load(self):
+        if os.path.exists(self.path):
+            self.frame = load_frame(self.path)
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                hwm = json.load(f).get('high_water_mark')
+            self.high_water_mark = pd.Timestamp(hwm) if hwm else None
+        digests_path = self.digests_stem + FORMAT_EXTENSIONS[self.fmt]
+        if os.path.exists(digests_path):
+            self.digests = load_frame(digests_path)['digest']
+        if self.frame is None:
+            self.high_water_mark = None
+            self.digests = None
+
+    def upsert(self, hourly: pd.DataFrame, high_water_mark=None, digests=None):
+        """Replace the (tag, hour) cells present in `hourly` and add new hours/tags.
+
+        `digests` (see `hour_digests`) replace the stored fingerprints of their hours.
+        """
+        if self.frame is None or self.frame.empty:
+            merged = hourly.copy()
+        else:
+            index = self.frame.index.union(hourly.index)
+            old_columns = list(self.frame.columns)
+            shared = [c for c in hourly.columns if c in self.frame.columns]
+            added = [c for c in hourly.columns if c not in self.frame.columns]
+            merged = self.frame.reindex(index=index)
+            merged.loc[hourly.index, shared] = hourly[shared]
+            if added:
+                merged = pd.concat([merged, hourly[added].reindex(index)], axis=1)
+            # Tags nuevos: sin datos (NaN) en las horas antiguas que no se han agregado ahora
+            merged = _fill_missing(merged, columns=old_columns)
+        merged.index.name = 'timeStamp'
+        self.frame = merged
+        if digests is not None:
+            if self.digests is not None:
+                digests = pd.concat([self.digests[~self.digests.index.isin(digests.index)], digests]).sort_index()
+            self.digests = digests
+        if high_water_mark is not None:
+            hwm = pd.Timestamp(high_water_mark)
+            self.high_water_mark = hwm if self.high_water_mark is None else max(hwm, self.high_water_mark)
+
+    def save(self):
+        path = save_frame(self.frame, self.path_stem, self.fmt, self.compression)
+        if self.digests is not None:
+            save_frame(self.digests.to_frame(), self.digests_stem, self.fmt, self.compression)
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'high_water_mark': str(self.high_water_mark) if self.high_water_mark is not None else None,
+                       'hours': len(self.frame)}, f, indent=2)
+        os.replace(tmp_path, self.meta_path)
+        return path
+
+
+def store_from_config(cfg, root_path):
+    """`HourlyStore` configured in `postprocess.hourly_store`, or None if incremental mode is off."""
+    store_cfg = (cfg or {}).get('postprocess', {}).get('hourly_store', {})
+    if not store_cfg.get('incremental'):
+        return None
+    stem = store_cfg.get('path') or DEFAULT_STORE_PATH
+    if not os.path.isabs(stem):
+        stem = os.path.join(root_path, stem)
+    fmt, compression, _ = storage_settings(cfg)
+    return HourlyStore(stem, fmt, compression)
+
+
+def update_hourly_store(df_minutes: pd.DataFrame, store: HourlyStore, requery_hours=()):
+    """Aggregate only the touched hours of `df_minutes` and upsert them into `store`.
+
+    Returns the touched hours.
+    """
+    added = new_tags(df_minutes, store.frame) if store.frame is not None else []
+    if added:
+        logging.info("Almacén horario: %d tags nuevos, se recalculan todas las horas (%s)",
+                     len(added), ", ".join(added))
+    hwm = None if added else store.high_water_mark
+    hours = touched_hours(df_minutes, hwm, requery_hours)
+    digests = hour_digests(df_minutes)
+    if hwm is not None:
+        # Horas anteriores a la marca de agua que faltan en el almacén o cuyos minutos han cambiado
+        hours = hours.union(changed_hours(digests, store.digests, store.frame.index))
+    if len(hours) == 0:
+        logging.info("Almacén horario: sin horas nuevas ni corregidas")
+        return hours
+    rows = pd.DatetimeIndex(df_minutes.index).floor('h').isin(hours)
+    hourly = aggregate_to_hourly(df_minutes[rows])
+    # La agregación rellena las horas intermedias no tocadas: sólo se guardan las tocadas
+    hourly = hourly[hourly.index.isin(hours)]
+    store.upsert(hourly, high_water_mark=df_minutes.index.max(), digests=digests)
+    logging.info("Almacén horario: %d horas recalculadas", len(hours))
+    return hours
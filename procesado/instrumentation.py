@@ -0,0 +1,177 @@
+"""
+Instrumentación de las ejecuciones y informe estructurado en JSON.
+
+`RunReport` mide cada etapa (tiempo de pared, filas, filas/s y pico de memoria
+residente durante la etapa), guarda filas por tag cuando la etapa las conoce,
+tiempo y filas/s por tag donde el trabajo se hace tag a tag (peticiones de la
+descarga, cadena minutal por medidor de `AdquisicionMinutal`) y
+las estadísticas HTTP de la descarga (peticiones, errores, bytes y percentiles
+de latencia de `PooledClient.stats`). Al final se escribe un
+`run_report_<timestamp>.json` junto a las salidas.
+
+El registro por evento (una línea por petición o por columna) va a nivel DEBUG
+y sólo se muestra con `instrumentation.verbose`.
+
+Las etapas vectorizadas del pipeline procesan todos los tags en una sola
+pasada, así que para ellas sólo hay medidas por etapa, no por tag.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+RSS_SAMPLE_SECONDS = 0.05
+
+
+def current_rss():
+    """Resident memory of this process in bytes, or None if it cannot be read."""
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class _RssSampler(threading.Thread):
+    """Background thread keeping the peak RSS seen while a stage runs."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.start_rss = current_rss()
+        self.peak = self.start_rss
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(RSS_SAMPLE_SECONDS):
+            rss = current_rss()
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        rss = current_rss()
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+        return self.peak
+
+
+def configure_logging(verbose=False):
+    """INFO logging, or DEBUG (per-event lines) when `verbose`."""
+    logging.basicConfig(level=logging.DEBUG if verbose else logging.INFO, format="%(levelname)s - %(message)s")
+    logging.getLogger().setLevel(logging.DEBUG if verbose else logging.INFO)
+
+
+def _mb(value):
+    return round(value / 1e6, 1) if value is not None else None
+
+
+class RunReport:
+    """Per-stage and per-tag measurements of one run."""
+
+    def __init__(self, name='pipeline', verbose=False):
+        self.name = name
+        self.verbose = verbose
+        self.started = datetime.now()
+        self.stages = []
+        self.http = {}
+        self.tags = {}
+        self.tag_timings = {}
+        self.alignment = {}
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        """Measure the enclosed block; the caller may set `rows` on the yielded record."""
+        record = {'stage': name, 'rows': rows}
+        sampler = _RssSampler()
+        sampler.start()
+        t0 = time.perf_counter()
+        try:
+            yield record
+        finally:
+            seconds = time.perf_counter() - t0
+            peak = sampler.stop()
+            record['seconds'] = round(seconds, 4)
+            rows = record['rows']
+            record['rows_per_sec'] = round(rows / seconds, 1) if rows and seconds > 0 else None
+            record['rss_start_mb'] = _mb(sampler.start_rss)
+            record['peak_rss_mb'] = _mb(peak)
+            self.stages.append(record)
+            logging.info("%s: %.2fs%s", name, seconds,
+                         f", {rows} filas ({record['rows_per_sec']:.0f} filas/s)" if record['rows_per_sec'] else '')
+
+    def record_tags(self, stage, rows_by_tag):
+        """Rows per tag handled by `stage`."""
+        self.tags.setdefault(stage, {}).update({str(k): int(v) for k, v in rows_by_tag.items()})
+
+    def record_tag_time(self, stage, tag, seconds, rows=None):
+        """Add `seconds` (and `rows`) of work done for one tag in `stage`; safe from worker threads."""
+        with self._lock:
+            entry = self.tag_timings.setdefault(stage, {}).setdefault(str(tag), {'seconds': 0.0, 'rows': 0})
+            entry['seconds'] += float(seconds)
+            entry['rows'] += int(rows or 0)
+
+    @contextmanager
+    def tag_timer(self, stage, tag, rows=None):
+        """Time the enclosed block as work for `tag` in `stage`; the caller may set `rows` on the yielded record."""
+        record = {'rows': rows}
+        t0 = time.perf_counter()
+        try:
+            yield record
+        finally:
+            self.record_tag_time(stage, tag, time.perf_counter() - t0, record['rows'])
+
+    def _tag_timings(self):
+        return {stage: {tag: {'seconds': round(e['seconds'], 4), 'rows': e['rows'],
+                              'rows_per_sec': round(e['rows'] / e['seconds'], 1) if e['rows'] and e['seconds'] > 0
+                              else None}
+                        for tag, e in tags.items()}
+                for stage, tags in self.tag_timings.items()}
+
+    def record_http(self, summary, label='fetch'):
+        """Add the `HttpStats.summary()` of a downloader run."""
+        self.http[label] = summary
+
+    def record_alignment(self, stats, label='fetch'):
+        """Add the minute-grid alignment counts (readings, minutes, off_grid, duplicates) of a download."""
+        self.alignment[label] = {k: int(v) for k, v in stats.items()}
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'started': self.started.isoformat(timespec='seconds'),
+            'seconds': round(time.perf_counter() - self._t0, 3),
+            'peak_rss_mb': max((s['peak_rss_mb'] for s in self.stages if s.get('peak_rss_mb') is not None),
+                               default=None),
+            'stages': self.stages,
+            'tags': self.tags,
+            'tag_timings': self._tag_timings(),
+            'http': self.http,
+            'alignment': self.alignment,
+        }
+
+    def write(self, directory, stem=None):
+        """Write `run_report_<timestamp>.json` (or `<stem>.json`) in `directory`; return the path."""
+        os.makedirs(directory, exist_ok=True)
+        stem = stem or f"run_report_{self.started.strftime('%Y%m%d_%H%M%S')}"
+        path = os.path.join(directory, f"{stem}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        return path
+
+
+def report_from_config(cfg, name='pipeline'):
+    """`RunReport` with the `instrumentation` settings of the config."""
+    inst_cfg = (cfg or {}).get('instrumentation', {})
+    return RunReport(name, verbose=bool(inst_cfg.get('verbose', False)))
@@ -0,0 +1,271 @@
+"""
+Memoización por contenido de las etapas de procesado.
+
+Cada resultado se guarda en disco con una clave que es el hash de:
+
+- los datos de entrada (valores, índice, columnas y dtypes),
+- los ajustes que cambian el resultado (`postprocess.combine_totals`,
+  `postprocess.compute.anomaly_rule` y `reset_thresholds`); instrumentación,
+  agregados, `workers` o el periodo no entran (el periodo ya está en los datos),
+- en la etapa de reinicios, los máximos confirmados del registro de contadores,
+- el código de `compute_consumption.py` y `compute_hourly_consumption.py`
+  (un cambio en el cálculo invalida los resultados anteriores).
+
+El pipeline y los scripts por pasos (`memoize`) usan la misma función de clave
+(`stage_key`). En el pipeline las claves se encadenan: la clave de salida de una
+etapa es la clave de entrada de la siguiente, así que sólo se calcula el hash de
+los datos iniciales. La caché tiene un tamaño máximo y expulsa las entradas usadas hace
+más tiempo (LRU). Está desactivada por defecto (`memo.enabled`).
+
+Uso desde línea de comandos:
+
+    python procesado/memo.py stats
+    python procesado/memo.py purge [--older-than-days N]
+"""
+import argparse
+import functools
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_MEMO_DIR = os.path.join(os.path.dirname(__file__), 'cache', 'memo')
+DEFAULT_MAX_MB = 2048
+CODE_FILES = ('compute_consumption.py', 'compute_hourly_consumption.py')
+
+
+def _hasher():
+    return hashlib.blake2b(digest_size=16)
+
+
+def frame_digest(obj) -> str:
+    """Content hash of a DataFrame, Series, ndarray or `LongTagFrame`."""
+    if hasattr(obj, 'to_wide'):
+        obj = obj.to_wide()
+    h = _hasher()
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        columns = list(obj.columns) if isinstance(obj, pd.DataFrame) else [obj.name]
+        dtypes = [str(t) for t in (obj.dtypes if isinstance(obj, pd.DataFrame) else [obj.dtype])]
+        h.update(json.dumps([columns, dtypes, obj.shape], default=str).encode())
+        h.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+    else:
+        arr = np.ascontiguousarray(obj)
+        h.update(json.dumps([str(arr.dtype), arr.shape]).encode())
+        h.update(arr.tobytes())
+    return h.hexdigest()
+
+
+def config_slice(cfg) -> dict:
+    """Settings that can change a processing result."""
+    postprocess = (cfg or {}).get('postprocess', {})
+    compute = postprocess.get('compute', {})
+    return {'combine_totals': postprocess.get('combine_totals', True),
+            'anomaly_rule': compute.get('anomaly_rule', 'pair_run'),
+            'reset_thresholds': compute.get('reset_thresholds')}
+
+
+def registry_state(registry) -> dict:
+    """Confirmed maxima of a `CounterRegistry`, the part of it that changes reset corrections."""
+    return {name: registry.confirmed(name) for name in sorted(registry.entries)}
+
+
+@functools.lru_cache(maxsize=1)
+def code_digest() -> str:
+    """Hash of the processing modules, so code changes invalidate memoized results."""
+    h = _hasher()
+    for name in CODE_FILES:
+        with open(os.path.join(os.path.dirname(__file__), name), 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def make_key(*parts) -> str:
+    """Key from JSON-serializable parts (digests, names, config slices)."""
+    h = _hasher()
+    h.update(code_digest().encode())
+    h.update(json.dumps(parts, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+def stage_key(stage, inputs, cfg, registry=None) -> str:
+    """Key of a stage result: stage name, input digest(s), config slice and registry state."""
+    return make_key(stage, inputs, config_slice(cfg), registry_state(registry) if registry is not None else None)
+
+
+class MemoCache:
+    """On-disk pickle cache with a size cap and least-recently-used eviction.
+
+    `index.json` records size, label and last access of every entry.
+    """
+
+    def __init__(self, base_dir=None, max_mb=DEFAULT_MAX_MB):
+        self.base_dir = base_dir or DEFAULT_MEMO_DIR
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.index_path = os.path.join(self.base_dir, 'index.json')
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.base_dir, exist_ok=True)
+        self._index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self._index = json.load(f)
+
+    @classmethod
+    def from_config(cls, cfg, root_path=None):
+        """Cache configured in the `memo` section, or None when memoization is off."""
+        memo_cfg = (cfg or {}).get('memo', {})
+        if not memo_cfg.get('enabled'):
+            return None
+        base_dir = memo_cfg.get('dir')
+        if base_dir and root_path and not os.path.isabs(base_dir):
+            base_dir = os.path.join(root_path, base_dir)
+        return cls(base_dir, memo_cfg.get('max_mb', DEFAULT_MAX_MB))
+
+    def _path(self, key):
+        return os.path.join(self.base_dir, f"{key}.pkl")
+
+    def _write_index(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.index_path)
+
+    def get(self, key):
+        """(True, value) if `key` is cached, (False, None) otherwise."""
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None or not os.path.exists(self._path(key)):
+                self._index.pop(key, None)
+                self.misses += 1
+                return False, None
+            with open(self._path(key), 'rb') as f:
+                value = pickle.load(f)
+            entry['last_access'] = time.time()
+            entry['hits'] = entry.get('hits', 0) + 1
+            self._write_index()
+            self.hits += 1
+            return True, value
+
+    def put(self, key, value, label=''):
+        with self._lock:
+            tmp_path = self._path(key) + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+            now = time.time()
+            self._index[key] = {'label': label, 'size': os.path.getsize(self._path(key)),
+                                'created': now, 'last_access': now, 'hits': 0}
+            self._evict()
+            self._write_index()
+
+    def _remove(self, key):
+        self._index.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        total = sum(e['size'] for e in self._index.values())
+        for key in sorted(self._index, key=lambda k: self._index[k]['last_access']):
+            if total <= self.max_bytes:
+                break
+            total -= self._index[key]['size']
+            logging.info("Memo: se expulsa %s (%s)", key, self._index[key].get('label'))
+            self._remove(key)
+
+    def purge(self, older_than_days=None):
+        """Remove every entry, or those not used in the last `older_than_days` days; return the count."""
+        with self._lock:
+            limit = None if older_than_days is None else time.time() - older_than_days * 86400
+            keys = [k for k, e in self._index.items() if limit is None or e['last_access'] < limit]
+            for key in keys:
+                self._remove(key)
+            self._write_index()
+            return len(keys)
+
+    def stats(self) -> dict:
+        entries = self._index.values()
+        by_label = {}
+        for e in entries:
+            label = by_label.setdefault(e.get('label') or '-', {'entries': 0, 'bytes': 0, 'hits': 0})
+            label['entries'] += 1
+            label['bytes'] += e['size']
+            label['hits'] += e.get('hits', 0)
+        return {'dir': self.base_dir, 'entries': len(self._index), 'bytes': sum(e['size'] for e in entries),
+                'max_bytes': self.max_bytes, 'by_label': by_label,
+                'session_hits': self.hits, 'session_misses': self.misses}
+
+    def call(self, key, func, *args, label='', **kwargs):
+        """Cached `func(*args, **kwargs)` under `key`."""
+        hit, value = self.get(key)
+        if hit:
+            logging.info("Memo: %s sin cambios, se reutiliza el resultado", label or func.__name__)
+            return value
+        value = func(*args, **kwargs)
+        self.put(key, value, label=label or func.__name__)
+        return value
+
+
+def _arg_digest(value):
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)) or hasattr(value, 'to_wide'):
+        return frame_digest(value)
+    if hasattr(value, 'confirmed'):
+        return registry_state(value)
+    return value
+
+
+def memoize(func, cache, cfg=None):
+    """Wrap a processing function so results are cached under `stage_key` of its arguments.
+
+    With `cache` None the function is returned unchanged. A cached call skips
+    side effects of `func` (e.g. registry confirmations of `detect_counter_resets`).
+    """
+    if cache is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        inputs = [[_arg_digest(a) for a in args], {k: _arg_digest(v) for k, v in kwargs.items()}]
+        key = stage_key(func.__name__, inputs, cfg)
+        return cache.call(key, func, *args, label=func.__name__, **kwargs)
+
+    return wrapper
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Caché de memoización de etapas")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('stats', help="Entradas, tamaño y aciertos por etapa")
+    purge = sub.add_parser('purge', help="Vaciar la caché")
+    purge.add_argument('--older-than-days', type=float, default=None)
+    args = parser.parse_args(argv)
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    cfg = {}
+    config_path = os.path.join(root, 'consums_config.json')
+    if os.path.exists(config_path):
+        with open(config_path, 'r', encoding='utf-8') as f:
+            cfg = json.load(f)
+    memo_cfg = cfg.get('memo', {})
+    base_dir = memo_cfg.get('dir')
+    if base_dir and not os.path.isabs(base_dir):
+        base_dir = os.path.join(root, base_dir)
+    cache = MemoCache(base_dir, memo_cfg.get('max_mb', DEFAULT_MAX_MB))
+
+    if args.command == 'stats':
+        print(json.dumps(cache.stats(), indent=2))
+    else:
+        print(f"Entradas eliminadas: {cache.purge(args.older_than_days)}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,190 @@
+"""
+Almacén minutal en rejilla fija con arrays NumPy mapeados en memoria.
+
+Cada tag y campo es un `.npy` de float64 en `<dir>/<tag>/<campo>.npy` donde la
+fila `i` es el minuto `epoch + i`; los huecos son NaN. Campos:
+
+- `total`: total combinado `[Tag]_TOT`,
+- `rect`:  total rectificado `_rect_0`,
+- `cons`:  consumo minutal `_rect_0_cons`,
+- `anom`:  anomalía distribuida `_rect_0_anom`.
+
+Buscar un instante es aritmética de enteros (`row_of`), no hay alineación con
+`reindex` ni `concat`, y los arrays se abren con `np.load(mmap_mode='r')`, de
+modo que varios procesos comparten las páginas sin copiarlas. Las funciones de
+`compute_consumption` aceptan directamente los tramos mapeados:
+
+    grid = MinuteGrid('procesado/Data/minute_grid')
+    totals = grid.view('PBD07_FT001_TOT', 'total', '2025-03-01', '2025-03-08')
+    rect = rect_0_fill(totals)
+
+La rejilla crece por bloques de `grow_rows` minutos. Las marcas de tiempo
+anteriores a `epoch` o que no caen en un minuto exacto no se guardan y se
+cuentan en el resultado de `write`.
+"""
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+FIELDS = {'total': '', 'rect': '_rect_0', 'cons': '_rect_0_cons', 'anom': '_rect_0_anom'}
+DEFAULT_GRID_PATH = os.path.join('procesado', 'Data', 'minute_grid')
+DEFAULT_GROW_ROWS = 30 * 1440
+MINUTE_NS = 60 * 10 ** 9
+
+
+def _ns(values):
+    return pd.DatetimeIndex(values).as_unit('ns').asi8
+
+
+class MinuteGrid:
+    """One memory-mapped float64 array per tag and field on a fixed one-minute grid."""
+
+    def __init__(self, base_dir=None, epoch=None, grow_rows=DEFAULT_GROW_ROWS):
+        self.base_dir = base_dir or os.path.join(os.path.dirname(os.path.dirname(__file__)), DEFAULT_GRID_PATH)
+        self.meta_path = os.path.join(self.base_dir, 'meta.json')
+        self.grow_rows = max(1, int(grow_rows))
+        self.capacity = 0
+        self.rows = 0
+        self.tags = []
+        self.epoch = None
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            self.epoch = pd.Timestamp(meta['epoch'])
+            self.capacity, self.rows, self.tags = meta['capacity'], meta['rows'], meta['tags']
+        elif epoch is not None:
+            self.epoch = pd.Timestamp(epoch).floor('min')
+
+    def _save_meta(self):
+        os.makedirs(self.base_dir, exist_ok=True)
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'epoch': str(self.epoch), 'capacity': self.capacity, 'rows': self.rows, 'tags': self.tags},
+                      f, indent=2)
+        os.replace(tmp_path, self.meta_path)
+
+    def _path(self, tag, field):
+        return os.path.join(self.base_dir, tag, f"{field}.npy")
+
+    def row_of(self, timestamps):
+        """Grid row of each timestamp (floor to the minute); may be negative or past `rows`."""
+        return (_ns(pd.to_datetime(np.atleast_1d(timestamps))) - _ns([self.epoch])[0]) // MINUTE_NS
+
+    def timestamps(self, start_row=0, end_row=None):
+        end_row = self.rows if end_row is None else end_row
+        return pd.date_range(self.epoch + pd.Timedelta(minutes=int(start_row)), periods=max(0, end_row - start_row),
+                             freq='min', name='timeStamp')
+
+    def _create(self, tag, field, capacity):
+        path = self._path(tag, field)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        arr = np.lib.format.open_memmap(path + '.tmp', mode='w+', dtype=np.float64, shape=(capacity,))
+        arr[:] = np.nan
+        return arr
+
+    def _grow(self, needed_rows):
+        capacity = -(-int(needed_rows) // self.grow_rows) * self.grow_rows
+        for tag in self.tags:
+            for field in FIELDS:
+                path = self._path(tag, field)
+                if not os.path.exists(path):
+                    continue
+                grown = self._create(tag, field, capacity)
+                old = np.load(path, mmap_mode='r')
+                grown[:len(old)] = old
+                grown.flush()
+                del grown, old
+                os.replace(path + '.tmp', path)
+        self.capacity = capacity
+
+    def _open(self, tag, field, mode='r+'):
+        path = self._path(tag, field)
+        if not os.path.exists(path):
+            arr = self._create(tag, field, self.capacity)
+            arr.flush()
+            del arr
+            os.replace(path + '.tmp', path)
+        return np.load(path, mmap_mode=mode)
+
+    def write(self, frame: pd.DataFrame):
+        """Scatter the minute columns of `frame` (chain output or `_TOT` totals) into the grid.
+
+        Returns counts of written rows and of rows skipped for being before
+        `epoch` or off the minute grid.
+        """
+        if frame is None or frame.empty:
+            return {'rows': 0, 'before_epoch': 0, 'off_grid': 0}
+        ns = _ns(frame.index)
+        if self.epoch is None:
+            self.epoch = pd.Timestamp(ns.min()).floor('D')
+        offset = ns - _ns([self.epoch])[0]
+        before = offset < 0
+        off_grid = ~before & (offset % MINUTE_NS != 0)
+        keep = ~before & ~off_grid
+        rows = offset[keep] // MINUTE_NS
+        if before.any() or off_grid.any():
+            logging.warning("Rejilla minutal: %d filas anteriores a %s y %d fuera de minuto exacto no se guardan",
+                            int(before.sum()), self.epoch, int(off_grid.sum()))
+
+        tags = [c for c in frame.columns if c.endswith('_TOT')]
+        if len(rows):
+            needed = int(rows.max()) + 1
+            if needed > self.capacity:
+                self._grow(needed)
+            self.rows = max(self.rows, needed)
+        for tag in tags:
+            if tag not in self.tags:
+                self.tags.append(tag)
+            for field, suffix in FIELDS.items():
+                col = f"{tag}{suffix}"
+                if col not in frame.columns:
+                    continue
+                arr = self._open(tag, field)
+                arr[rows] = pd.to_numeric(frame[col], errors='coerce').to_numpy(dtype=float)[keep]
+                arr.flush()
+                del arr
+        self._save_meta()
+        return {'rows': int(keep.sum()), 'before_epoch': int(before.sum()), 'off_grid': int(off_grid.sum())}
+
+    def _bounds(self, start, end):
+        a = 0 if start is None else int(np.clip(self.row_of(start)[0], 0, self.rows))
+        b = self.rows if end is None else int(np.clip(self.row_of(end)[0], 0, self.rows))
+        return a, max(a, b)
+
+    def view(self, tag, field, start=None, end=None, mode='r'):
+        """Memory-mapped slice of `tag`/`field` for minutes in [start, end) (no copy)."""
+        if field not in FIELDS:
+            raise ValueError(f"Campo no soportado: {field}")
+        a, b = self._bounds(start, end)
+        path = self._path(tag, field)
+        if not os.path.exists(path):
+            return np.full(b - a, np.nan)
+        return np.load(path, mmap_mode=mode)[a:b]
+
+    def block(self, tags, field, start=None, end=None) -> np.ndarray:
+        """(minutes x tags) array of `field` in [start, end), the layout of the array kernels."""
+        a, b = self._bounds(start, end)
+        out = np.empty((b - a, len(tags)), dtype=np.float64)
+        for j, tag in enumerate(tags):
+            out[:, j] = self.view(tag, field, start, end)
+        return out
+
+    def frame(self, tags, field, start=None, end=None) -> pd.DataFrame:
+        """`block` as a DataFrame indexed by `timeStamp`."""
+        a, b = self._bounds(start, end)
+        return pd.DataFrame(self.block(tags, field, start, end), index=self.timestamps(a, b), columns=list(tags))
+
+
+def grid_from_config(cfg, root_path):
+    """`MinuteGrid` configured in `storage.minute_grid`, or None when disabled."""
+    grid_cfg = (cfg or {}).get('storage', {}).get('minute_grid', {})
+    if not grid_cfg.get('enabled'):
+        return None
+    base_dir = grid_cfg.get('path') or DEFAULT_GRID_PATH
+    if not os.path.isabs(base_dir):
+        base_dir = os.path.join(root_path, base_dir)
+    epoch = grid_cfg.get('epoch') or (cfg or {}).get('period', {}).get('start')
+    return MinuteGrid(base_dir, epoch=epoch, grow_rows=grid_cfg.get('grow_rows', DEFAULT_GROW_ROWS))
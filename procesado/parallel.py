@@ -0,0 +1,217 @@
+"""
+Ejecución en paralelo (pool de procesos) de la cadena de procesado por tag.
+
+La cadena de cada tag (combinación H/L, rect_0, consumo, anomalías, reinicios
+de contador y agregación horaria) no depende de los demás tags. Los tags se
+reparten en grupos entre los procesos de un `ProcessPoolExecutor`:
+
+- los datos crudos se copian una sola vez a un bloque de memoria compartida
+  (`multiprocessing.shared_memory`) y cada proceso lee sólo sus columnas;
+- cada proceso deja su resultado minutal en otro bloque compartido y devuelve
+  únicamente su nombre, columnas y dtypes (y la agregación horaria, pequeña);
+- los máximos confirmados en el registro de contadores se devuelven y se
+  fusionan en el registro del proceso principal.
+
+El resultado reunido es idéntico al de `compute_minute_chain` +
+`aggregate_to_hourly` en un solo proceso (mismas columnas y orden).
+
+Uso desde línea de comandos (último `all_minutes` de adquisicion/minute_data):
+
+    python procesado/parallel.py [--workers 32]
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(__file__))
+from compute_consumption import compute_minute_chain
+from compute_hourly_consumption import aggregate_to_hourly
+from counter_registry import CounterRegistry
+from storage import export_csv, find_latest, load_frame, save_frame, storage_settings
+
+TAG_SUFFIXES = ('_TOT_H', '_TOT_L', '_TOT')
+
+
+def tag_of(column):
+    """Tag a raw column belongs to (`X_TOT_H`, `X_TOT_L` and `X_TOT` share `X`)."""
+    for suffix in TAG_SUFFIXES:
+        if column.endswith(suffix):
+            return column[:-len(suffix)]
+    return column
+
+
+def shard_columns(columns, n_shards):
+    """Split `columns` into at most `n_shards` lists keeping each tag's columns together.
+
+    Tags are assigned greedily to the shard with fewest columns so shards are balanced.
+    """
+    groups = {}
+    for col in columns:
+        groups.setdefault(tag_of(col), []).append(col)
+    shards = [[] for _ in range(max(1, min(n_shards, len(groups))))]
+    for cols in sorted(groups.values(), key=len, reverse=True):
+        min(shards, key=len).extend(cols)
+    return [s for s in shards if s]
+
+
+def _chain_column_order(columns):
+    """Column order `compute_minute_chain` produces for raw `columns`."""
+    highs = [c for c in columns if c.endswith('_TOT_H') and c[:-6] + '_TOT_L' in columns]
+    paired = set(highs) | {c[:-6] + '_TOT_L' for c in highs}
+    combined = [c for c in columns if c not in paired] + [c[:-6] + '_TOT' for c in highs]
+    rect = [f"{c}_rect_0" for c in combined if c.endswith('_TOT')]
+    return combined + rect + [f"{c}_cons" for c in rect] + [f"{c}_anom" for c in rect]
+
+
+def _to_shared(df):
+    """Copy the numeric values of `df` to a new shared block; return (name, shape) or None."""
+    if not all(pd.api.types.is_numeric_dtype(t) for t in df.dtypes):
+        return None
+    values = df.to_numpy(dtype=float)
+    shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+    try:
+        np.ndarray(values.shape, dtype=float, buffer=shm.buf)[:] = values
+    finally:
+        shm.close()
+    return shm.name, values.shape
+
+
+def _from_shared(name, shape, columns, dtypes, index, positions=None, unlink=False):
+    """Frame with `columns` (at `positions` in the shared block) restored to `dtypes`."""
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        block = np.ndarray(shape, dtype=float, buffer=shm.buf)
+        values = block[:, positions] if positions is not None else block.copy()
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+    return pd.DataFrame(values, index=index, columns=columns).astype(dict(zip(columns, dtypes)))
+
+
+def _run_shard(task):
+    """Worker: run the chain on one shard read from shared memory."""
+    frame = _from_shared(task['shm'], task['shape'], task['columns'], task['dtypes'], task['index'],
+                         positions=task['positions'])
+    entries = task['registry']
+    registry = CounterRegistry(None, copy.deepcopy(entries)) if entries is not None else None
+
+    minutes = compute_minute_chain(frame, anomaly_rule=task['anomaly_rule'], thresholds=task['thresholds'],
+                                   registry=registry)
+    hourly = aggregate_to_hourly(minutes) if task['hourly'] else None
+    confirmed = {}
+    if registry is not None:
+        confirmed = {k: v for k, v in registry.entries.items() if entries.get(k) != v}
+
+    shared = _to_shared(minutes)
+    if shared is None:
+        return {'frame': minutes, 'hourly': hourly, 'confirmed': confirmed}
+    return {'shm': shared[0], 'shape': shared[1], 'columns': list(minutes.columns),
+            'dtypes': list(minutes.dtypes), 'hourly': hourly, 'confirmed': confirmed}
+
+
+def parallel_minute_chain(df, workers=None, anomaly_rule='pair_run', thresholds=None, registry=None, hourly=True):
+    """Run `compute_minute_chain` (and `aggregate_to_hourly`) with tags sharded over processes.
+
+    Returns (minutes, hourly); hourly is None when `hourly` is False. With one
+    worker or one tag everything runs in the calling process. Maxima confirmed
+    by the workers are merged into `registry`; the caller saves it.
+    """
+    df = df.to_wide() if hasattr(df, 'to_wide') else df
+    workers = workers or os.cpu_count() or 1
+    shards = shard_columns(list(df.columns), workers)
+    if len(shards) <= 1:
+        minutes = compute_minute_chain(df, anomaly_rule=anomaly_rule, thresholds=thresholds, registry=registry)
+        return minutes, (aggregate_to_hourly(minutes) if hourly else None)
+
+    raw = df.apply(pd.to_numeric, errors='coerce')
+    position = {c: k for k, c in enumerate(raw.columns)}
+    shm_name, shape = _to_shared(raw)
+    entries = registry.entries if registry is not None else None
+    tasks = [{'shm': shm_name, 'shape': shape, 'columns': cols, 'positions': [position[c] for c in cols],
+              'dtypes': [raw[c].dtype for c in cols], 'index': df.index, 'anomaly_rule': anomaly_rule,
+              'thresholds': thresholds, 'registry': entries, 'hourly': hourly} for cols in shards]
+
+    parts = []
+    try:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            for result in pool.map(_run_shard, tasks):
+                if 'shm' in result:
+                    result['frame'] = _from_shared(result['shm'], result['shape'], result['columns'],
+                                                   result['dtypes'], df.index, unlink=True)
+                parts.append(result)
+    finally:
+        stale = shared_memory.SharedMemory(name=shm_name)
+        stale.close()
+        stale.unlink()
+
+    if registry is not None:
+        for result in parts:
+            registry.merge(result['confirmed'])
+
+    minutes = pd.concat([r['frame'] for r in parts], axis=1)
+    order = [c for c in _chain_column_order(list(df.columns)) if c in minutes.columns]
+    minutes = minutes[order + [c for c in minutes.columns if c not in order]]
+    if not hourly:
+        return minutes, None
+
+    hourly_df = pd.concat([r['hourly'] for r in parts], axis=1)
+    tag_order = [c[:-len('_cons')].replace('_rect_0', '') for c in minutes.columns if c.endswith('_cons')]
+    hourly_cols = [f"{t}{s}" for t in tag_order
+                   for s in ('_hourly_cons', '_hourly_cons_corrected', '_hourly_has_corrections')]
+    return minutes, hourly_df[[c for c in hourly_cols if c in hourly_df.columns]]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cadena de procesado por tag en paralelo")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    cfg = {}
+    config_path = os.path.join(root, 'consums_config.json')
+    if os.path.exists(config_path):
+        with open(config_path, 'r', encoding='utf-8') as f:
+            cfg = json.load(f)
+    compute_cfg = cfg.get('postprocess', {}).get('compute', {})
+
+    src = find_latest(os.path.join(root, 'adquisicion', 'minute_data'), 'all_minutes')
+    if src is None:
+        print('No combined all_minutes dataset found in adquisicion/minute_data')
+        return 2
+    print(f'Loading combined dataset: {src}')
+    df = load_frame(src)
+
+    registry_path = compute_cfg.get('counter_registry')
+    if registry_path and not os.path.isabs(registry_path):
+        registry_path = os.path.join(root, registry_path)
+    registry = CounterRegistry.load(registry_path)
+    minutes, hourly = parallel_minute_chain(
+        df, workers=args.workers or compute_cfg.get('workers'),
+        anomaly_rule=compute_cfg.get('anomaly_rule', 'pair_run'),
+        thresholds=compute_cfg.get('reset_thresholds'),
+        registry=registry)
+    registry.save()
+
+    from datetime import datetime
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    out_dir = os.path.join(root, 'procesado', 'Data')
+    fmt, compression, to_csv = storage_settings(cfg)
+    for frame, stem in ((minutes, f'consumption_minutes_with_anom_{timestamp}'),
+                        (hourly, f'consumption_hourly_{timestamp}')):
+        out_stem = os.path.join(out_dir, stem)
+        print(f'Saved: {save_frame(frame, out_stem, fmt, compression)}')
+        if to_csv:
+            export_csv(frame, out_stem + '.csv')
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,266 @@
+"""
+Carga de consumos en el datalake PostgreSQL (tarea `push_to_pg_datalake`).
+
+Los frames anchos del procesado se pasan a formato largo (una fila por tag e
+instante) y se cargan por lotes:
+
+1. `COPY ... FROM STDIN` a una tabla temporal de staging de la sesión,
+2. `INSERT ... SELECT ... ON CONFLICT (tag, ts) DO UPDATE` sobre la tabla final.
+
+La carga es idempotente: volver a cargar un periodo sustituye las filas en lugar
+de duplicarlas. Los lotes agrupan tags completos hasta `batch_rows` filas y se
+reparten entre las conexiones de un pool. Por defecto se usa la conexión de
+`pgDataLake` (CAT_Conexions), con sus credenciales y ajustes, y los lotes se
+cargan en serie por esa conexión. Con `raw_pool: true` en la tarea se abre un
+pool psycopg2 de `pool_size` conexiones con las credenciales de la sección `db`.
+
+Tablas (esquema `schema` de la tarea, `consums` por defecto):
+
+- `consumo_minutal` (tag, ts, total, cons, anom): total rectificado, consumo y anomalía por minuto.
+- `consumo_horario` (tag, ts, cons, cons_corrected, has_corrections).
+
+Uso (carga el último minutal de `procesado/Data` y el almacén horario o el último horario):
+
+    python procesado/pg_datalake.py [--minutes FICHERO] [--hourly FICHERO]
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from hourly_store import store_from_config
+from storage import find_latest, load_frame
+
+DEFAULT_SCHEMA = 'consums'
+DEFAULT_BATCH_ROWS = 500_000
+DEFAULT_POOL_SIZE = 4
+
+# Tabla destino y (columna SQL, tipo, sufijo de la columna ancha) por tipo de frame.
+# El tag es el nombre sin sufijo (`X_TOT`), igual en la tabla minutal y la horaria.
+TABLES = {
+    'minutes': ('consumo_minutal', (
+        ('total', 'double precision', '_rect_0'),
+        ('cons', 'double precision', '_rect_0_cons'),
+        ('anom', 'double precision', '_rect_0_anom'),
+    )),
+    'hourly': ('consumo_horario', (
+        ('cons', 'double precision', '_hourly_cons'),
+        ('cons_corrected', 'double precision', '_hourly_cons_corrected'),
+        ('has_corrections', 'boolean', '_hourly_has_corrections'),
+    )),
+}
+
+
+def frame_tags(frame: pd.DataFrame, kind):
+    """Tags present in a wide `kind` frame, in column order."""
+    key_suffix = TABLES[kind][1][0][2]
+    return [c[:-len(key_suffix)] for c in frame.columns if c.endswith(key_suffix)]
+
+
+def to_long(frame: pd.DataFrame, kind, tags=None) -> pd.DataFrame:
+    """Long (tag, ts, fields...) rows of `tags`; rows where every field is missing are dropped."""
+    _, fields = TABLES[kind]
+    tags = frame_tags(frame, kind) if tags is None else list(tags)
+    n = len(frame)
+    data = {
+        'tag': np.repeat(np.asarray(tags, dtype=object), n),
+        'ts': np.tile(frame.index.to_numpy(), len(tags)),
+    }
+    present = np.zeros(n * len(tags), dtype=bool)
+    for name, sql_type, suffix in fields:
+        cols = [f"{t}{suffix}" for t in tags]
+        if sql_type == 'boolean':
+            block = frame.reindex(columns=cols).astype('boolean')
+            values = block.to_numpy(dtype=object, na_value=None).ravel(order='F')
+            present |= pd.notna(values)
+        else:
+            block = frame.reindex(columns=cols).apply(pd.to_numeric, errors='coerce')
+            values = block.to_numpy(dtype=float).ravel(order='F')
+            present |= ~np.isnan(values)
+        data[name] = values
+    return pd.DataFrame(data)[present]
+
+
+def batches(frame: pd.DataFrame, kind, batch_rows=DEFAULT_BATCH_ROWS):
+    """Lists of whole tags with up to `batch_rows` rows each (at least one tag per batch)."""
+    per_batch = max(1, int(batch_rows) // max(1, len(frame)))
+    tags = frame_tags(frame, kind)
+    return [tags[i:i + per_batch] for i in range(0, len(tags), per_batch)]
+
+
+def _copy_buffer(rows: pd.DataFrame):
+    buf = io.StringIO()
+    rows.to_csv(buf, sep='\t', header=False, index=False, na_rep='\\N', date_format='%Y-%m-%d %H:%M:%S')
+    buf.seek(0)
+    return buf
+
+
+def create_table_sql(kind, schema=DEFAULT_SCHEMA):
+    table, fields = TABLES[kind]
+    columns = ",\n    ".join(f"{name} {sql_type}" for name, sql_type, _ in fields)
+    return (f"CREATE SCHEMA IF NOT EXISTS {schema};\n"
+            f"CREATE TABLE IF NOT EXISTS {schema}.{table} (\n"
+            f"    tag text NOT NULL,\n    ts timestamp NOT NULL,\n    {columns},\n"
+            f"    PRIMARY KEY (tag, ts)\n)")
+
+
+def upsert_sql(kind, schema=DEFAULT_SCHEMA):
+    """Set-based upsert from the staging table; repeated (tag, ts) rows are collapsed so no row is updated twice."""
+    table, fields = TABLES[kind]
+    names = ['tag', 'ts'] + [name for name, _, _ in fields]
+    updates = ", ".join(f"{name} = EXCLUDED.{name}" for name, _, _ in fields)
+    return (f"INSERT INTO {schema}.{table} ({', '.join(names)})\n"
+            f"SELECT DISTINCT ON (tag, ts) {', '.join(names)} FROM stg_{table} ORDER BY tag, ts\n"
+            f"ON CONFLICT (tag, ts) DO UPDATE SET {updates}")
+
+
+def load_batch(conn, rows: pd.DataFrame, kind, schema=DEFAULT_SCHEMA):
+    """COPY `rows` into the session staging table and upsert them in one transaction."""
+    table, fields = TABLES[kind]
+    names = ['tag', 'ts'] + [name for name, _, _ in fields]
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS stg_{table} "
+                        f"(LIKE {schema}.{table} INCLUDING DEFAULTS)")
+            cur.execute(f"TRUNCATE stg_{table}")
+            cur.copy_expert(f"COPY stg_{table} ({', '.join(names)}) FROM STDIN", _copy_buffer(rows))
+            cur.execute(upsert_sql(kind, schema))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(rows)
+
+
+class _SingleConnectionPool:
+    """Pool interface over the single connection of a `pgDataLake` object."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def getconn(self):
+        return self._conn
+
+    def putconn(self, conn):
+        pass
+
+    def closeall(self):
+        pass
+
+
+def _pgdatalake_connection():
+    from conexions import pgDataLake
+
+    pg = pgDataLake()
+    for attr in ('conn', 'connection'):
+        conn = getattr(pg, attr, None)
+        if conn is not None:
+            return conn
+    engine = getattr(pg, 'engine', None)
+    if engine is not None:
+        return engine.raw_connection()
+    raise RuntimeError("pgDataLake no expone una conexión DB-API; usa `raw_pool` con la sección `db`")
+
+
+def connection_pool(cfg, size=DEFAULT_POOL_SIZE, raw_pool=False):
+    """(pool, size): the `pgDataLake` connection, or with `raw_pool` a psycopg2 pool from `cfg['db']`."""
+    if not raw_pool:
+        return _SingleConnectionPool(_pgdatalake_connection()), 1
+    db = (cfg or {}).get('db')
+    if not db:
+        raise ValueError("push_to_pg_datalake.raw_pool necesita la sección `db` en la configuración")
+    from psycopg2.pool import ThreadedConnectionPool
+
+    size = max(1, int(size))
+    pool = ThreadedConnectionPool(1, size, host=db.get('host'), port=db.get('port'), dbname=db.get('database'),
+                                  user=db.get('user'), password=db.get('password'))
+    return pool, size
+
+
+def push_frames(frames, pool, workers=1, schema=DEFAULT_SCHEMA, batch_rows=DEFAULT_BATCH_ROWS,
+                create_tables=True):
+    """Upsert `{kind: wide frame}` into the datalake; return the rows loaded per kind."""
+    frames = {kind: f for kind, f in frames.items() if f is not None and not f.empty}
+    if create_tables and frames:
+        conn = pool.getconn()
+        try:
+            with conn.cursor() as cur:
+                for kind in frames:
+                    cur.execute(create_table_sql(kind, schema))
+            conn.commit()
+        finally:
+            pool.putconn(conn)
+
+    def run(job):
+        kind, tags = job
+        rows = to_long(frames[kind], kind, tags)
+        conn = pool.getconn()
+        try:
+            return kind, load_batch(conn, rows, kind, schema)
+        finally:
+            pool.putconn(conn)
+
+    jobs = [(kind, tags) for kind, frame in frames.items() for tags in batches(frame, kind, batch_rows)]
+    if workers == 1:
+        results = [run(job) for job in jobs]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(run, jobs))
+    loaded = {kind: 0 for kind in frames}
+    for kind, n in results:
+        loaded[kind] += n
+    for kind, n in loaded.items():
+        logging.info("Datalake: %d filas cargadas en %s.%s", n, schema, TABLES[kind][0])
+    return loaded
+
+
+def push_to_pg_datalake(cfg, minutes=None, hourly=None):
+    """Load the minute and hourly frames with the settings of the `push_to_pg_datalake` task."""
+    task = next((t for t in cfg.get('tasks', []) if t.get('name') == 'push_to_pg_datalake'), {})
+    pool, size = connection_pool(cfg, task.get('pool_size', DEFAULT_POOL_SIZE), task.get('raw_pool', False))
+    try:
+        return push_frames({'minutes': minutes, 'hourly': hourly}, pool, workers=size,
+                           schema=task.get('schema', DEFAULT_SCHEMA),
+                           batch_rows=task.get('batch_rows', DEFAULT_BATCH_ROWS),
+                           create_tables=task.get('create_tables', True))
+    finally:
+        pool.closeall()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Carga de consumos en el datalake PostgreSQL")
+    parser.add_argument('--minutes', help="Fichero minutal (por defecto, el último consumption_minutes_with_anom)")
+    parser.add_argument('--hourly', help="Fichero horario (por defecto, el último consumption_hourly)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.path.join(root, "CAT_Conexions", "src"))
+    with open(os.path.join(root, 'consums_config.json'), 'r', encoding='utf-8') as f:
+        cfg = json.load(f)
+    data_dir = os.path.join(root, 'procesado', 'Data')
+    minutes_path = args.minutes or find_latest(data_dir, 'consumption_minutes_with_anom_')
+    hourly = load_frame(args.hourly) if args.hourly else None
+    if hourly is None:
+        store = store_from_config(cfg, root)
+        if store is not None and store.frame is not None:
+            hourly = store.frame
+        else:
+            # Ficheros con fecha (`consumption_hourly_<YYYYmmdd>_...`), no el almacén incremental
+            hourly_path = find_latest(data_dir, 'consumption_hourly_2')
+            hourly = load_frame(hourly_path) if hourly_path else None
+    if minutes_path is None and hourly is None:
+        logging.error("No hay ficheros de consumo en %s", data_dir)
+        return 1
+    push_to_pg_datalake(cfg, minutes=load_frame(minutes_path) if minutes_path else None, hourly=hourly)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,352 @@
+"""
+Motor de pipeline en memoria dirigido por la lista `tasks` de `consums_config.json`.
+
+Sustituye el encadenado de `run_compute_for_minutes.py`, `run_compute_consumption.py`
+y `run_hourly_aggregation.py`, en el que cada script buscaba el fichero más
+reciente del paso anterior y lo volvía a leer. Aquí las etapas se pasan los
+datos en memoria:
+
+    fetch -> combine -> rect -> cons -> anomalies -> resets -> hourly -> rollup -> save -> push
+
+Cada tarea habilitada aporta sus etapas (`TASK_STAGES`, o la clave `stages` de
+la propia tarea) y se ejecutan en el orden canónico de `STAGE_ORDER`. Sin
+`fetch` se parte del último `all_minutes` guardado. La persistencia intermedia
+es opcional: `pipeline.persist` lista las etapas tras las que guardar el frame
+en el formato de `storage`; `save` guarda siempre las salidas finales. Con
+`memo.enabled` las etapas de cálculo se memoizan por contenido (`memo.py`).
+
+Si están todas las etapas de la cadena minutal (combine a resets) y
+`postprocess.compute.workers` da más de un proceso (0 = todos los núcleos), la
+cadena se ejecuta como una sola etapa `chain` repartiendo los tags entre
+procesos (`parallel.parallel_minute_chain`), con el mismo resultado. Con
+`memo.enabled`, o si `pipeline.persist` incluye alguna etapa de la cadena, ésta
+sigue etapa a etapa.
+
+Uso:
+
+    python procesado/pipeline.py [--stages combine,rect,cons,anomalies,resets,hourly,save]
+"""
+import argparse
+import copy
+import json
+import logging
+import os
+import sys
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(__file__))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from compute_consumption import (
+    append_minute_consumption,
+    apply_rect_0,
+    attach_anomalies,
+    combine_tot_high_low,
+    detect_counter_resets,
+)
+from compute_hourly_consumption import aggregate_to_hourly
+from counter_registry import CounterRegistry
+from hourly_store import store_from_config, update_hourly_store
+from instrumentation import configure_logging, report_from_config
+from memo import MemoCache, frame_digest, stage_key
+from minute_grid import grid_from_config
+from parallel import parallel_minute_chain
+from query_store import query_store_from_config
+from rollups import rollups_from_config
+from storage import export_csv, find_latest, load_frame, save_frame, storage_settings
+
+STAGE_ORDER = ('fetch', 'combine', 'rect', 'cons', 'anomalies', 'resets', 'hourly', 'rollup', 'save', 'push')
+
+# Etapas puras sobre el frame minutal que pueden memoizarse (`memo.enabled`)
+MEMO_STAGES = ('combine', 'rect', 'cons', 'anomalies', 'resets', 'hourly')
+
+# Cadena minutal que `chain` ejecuta de una vez en paralelo (`postprocess.compute.workers`)
+CHAIN_STAGES = ('combine', 'rect', 'cons', 'anomalies', 'resets')
+
+TASK_STAGES = {
+    'fetch_api_data': ['fetch'],
+    'compute_consumption': ['combine', 'rect', 'cons', 'anomalies', 'resets', 'hourly', 'rollup'],
+    'save_to_csv': ['save'],
+    'push_to_pg_datalake': ['push'],
+}
+
+# Prefijo y carpeta de cada frame persistido, compatibles con los scripts por pasos
+PERSIST_TARGETS = {
+    'fetch': (os.path.join('adquisicion', 'minute_data'), 'all_minutes_'),
+    'resets': (os.path.join('procesado', 'Data'), 'consumption_minutes_with_anom_'),
+    'hourly': (os.path.join('procesado', 'Data'), 'consumption_hourly_'),
+}
+
+
+class PipelineContext:
+    """State passed between stages: config, minute and hourly frames and run metadata."""
+
+    def __init__(self, cfg, root=ROOT):
+        self.cfg = cfg
+        self.root = root
+        self.timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        self.minutes = None
+        self.hourly = None
+        self.missing = []
+        self.outputs = {}
+        self.hourly_in_store = False
+        self.hourly_touched = None  # horas recalculadas en el almacén horario
+        self.compute_cfg = cfg.get('postprocess', {}).get('compute', {})
+        self.workers = int(self.compute_cfg.get('workers') or os.cpu_count() or 1)
+        self.memo = MemoCache.from_config(cfg, root)
+        self.report = report_from_config(cfg)
+        self.minutes_key = None  # clave de contenido del frame minutal actual (memo)
+        self._registry = None
+
+    def task(self, name):
+        return next((t for t in self.cfg.get('tasks', []) if t.get('name') == name), {})
+
+    @property
+    def registry(self):
+        if self._registry is None:
+            path = self.compute_cfg.get('counter_registry')
+            if path and not os.path.isabs(path):
+                path = os.path.join(self.root, path)
+            self._registry = CounterRegistry.load(path)
+        return self._registry
+
+    def require_minutes(self):
+        """Minute frame of the run; without a fetch stage, the latest saved `all_minutes`."""
+        if self.minutes is None:
+            directory, prefix = PERSIST_TARGETS['fetch']
+            src = find_latest(os.path.join(self.root, directory), prefix.rstrip('_'))
+            if src is None:
+                raise RuntimeError(f"No hay datos minutales: ni etapa fetch ni fichero all_minutes en {directory}")
+            logging.info("Pipeline: sin etapa fetch, se parte de %s", src)
+            self.minutes = load_frame(src)
+        elif hasattr(self.minutes, 'to_wide'):
+            self.minutes = self.minutes.to_wide()
+        return self.minutes
+
+
+def _stage_fetch(ctx):
+    from adquisicion.download_minute_data import download_minute_data
+
+    # El motor no necesita los CSV intermedios de la descarga salvo que la tarea los pida
+    cfg = copy.deepcopy(ctx.cfg)
+    for task in cfg.get('tasks', []):
+        if task.get('name') == 'fetch_api_data':
+            task.setdefault('write_csv', False)
+    minutes, ctx.missing = download_minute_data(cfg, report=ctx.report)
+    if minutes is None or minutes.empty:
+        raise RuntimeError("No se han descargado datos minutales")
+    ctx.minutes = minutes
+
+
+def _stage_combine(ctx):
+    ctx.minutes = combine_tot_high_low(ctx.require_minutes())
+
+
+def _stage_rect(ctx):
+    ctx.minutes = apply_rect_0(ctx.require_minutes())
+
+
+def _stage_cons(ctx):
+    ctx.minutes = append_minute_consumption(ctx.require_minutes())
+
+
+def _stage_anomalies(ctx):
+    ctx.minutes = attach_anomalies(ctx.require_minutes(), rule=ctx.compute_cfg.get('anomaly_rule', 'pair_run'))
+
+
+def _stage_resets(ctx):
+    ctx.minutes = detect_counter_resets(ctx.require_minutes(), thresholds=ctx.compute_cfg.get('reset_thresholds'),
+                                        registry=ctx.registry)
+    ctx.registry.save()
+
+
+def _stage_chain(ctx):
+    ctx.minutes, _ = parallel_minute_chain(ctx.require_minutes(), workers=ctx.workers,
+                                           anomaly_rule=ctx.compute_cfg.get('anomaly_rule', 'pair_run'),
+                                           thresholds=ctx.compute_cfg.get('reset_thresholds'),
+                                           registry=ctx.registry, hourly=False)
+    ctx.registry.save()
+
+
+def _stage_hourly(ctx):
+    store = store_from_config(ctx.cfg, ctx.root)
+    if store is None:
+        ctx.hourly = aggregate_to_hourly(ctx.require_minutes())
+        return
+    ctx.hourly_touched = update_hourly_store(ctx.require_minutes(), store,
+                                             requery_hours=ctx.compute_cfg.get('force_minute_requery_hours', []))
+    ctx.outputs['hourly'] = store.save()
+    ctx.hourly = store.frame
+    ctx.hourly_in_store = True
+
+
+def _stage_rollup(ctx):
+    store = rollups_from_config(ctx.cfg, ctx.root)
+    if store is None:
+        logging.info("Pipeline: agregados diarios/mensuales desactivados (postprocess.rollups)")
+        return
+    if ctx.hourly is None:
+        raise RuntimeError("La etapa rollup necesita la etapa hourly")
+    store.update(ctx.hourly, touched_hours=ctx.hourly_touched)
+    store.save()
+    ctx.outputs['rollups'] = store.path_stem
+
+
+def _save(ctx, frame, stage, to_csv, label=None):
+    directory, prefix = PERSIST_TARGETS.get(stage, (os.path.join('procesado', 'Data'), f'pipeline_{stage}_'))
+    fmt, compression, _ = storage_settings(ctx.cfg)
+    stem = os.path.join(ctx.root, directory, f"{prefix}{ctx.timestamp}")
+    path = save_frame(frame, stem, fmt, compression)
+    if to_csv:
+        export_csv(frame, stem + '.csv')
+    ctx.outputs[label or stage] = path
+    logging.info("Pipeline: %s guardado en %s", label or stage, path)
+    return path
+
+
+def _stage_save(ctx):
+    _, _, export = storage_settings(ctx.cfg)
+    to_csv = export or bool(ctx.task('save_to_csv').get('enabled'))
+    if ctx.minutes is not None:
+        _save(ctx, ctx.require_minutes(), 'resets', to_csv, label='minutes')
+    if ctx.hourly is not None and not ctx.hourly_in_store:
+        _save(ctx, ctx.hourly, 'hourly', to_csv, label='hourly')
+    query_store = query_store_from_config(ctx.cfg, ctx.root)
+    if query_store is not None:
+        hourly = ctx.hourly
+        if hourly is not None and ctx.hourly_touched is not None:
+            hourly = hourly[hourly.index.isin(ctx.hourly_touched)]
+        if ctx.minutes is not None:
+            query_store.write(ctx.require_minutes(), 'minutes')
+        query_store.write(hourly, 'hourly')
+        ctx.outputs['query'] = query_store.base_dir
+    grid = grid_from_config(ctx.cfg, ctx.root)
+    if grid is not None and ctx.minutes is not None:
+        grid.write(ctx.require_minutes())
+        ctx.outputs['minute_grid'] = grid.base_dir
+
+
+def _stage_push(ctx):
+    from pg_datalake import push_to_pg_datalake
+
+    hourly = ctx.hourly
+    if hourly is not None and ctx.hourly_touched is not None:
+        # Con almacén incremental sólo se cargan las horas recalculadas
+        hourly = hourly[hourly.index.isin(ctx.hourly_touched)]
+    ctx.outputs['datalake'] = push_to_pg_datalake(
+        ctx.cfg, minutes=ctx.require_minutes() if ctx.minutes is not None else None, hourly=hourly)
+
+
+STAGES = {
+    'fetch': _stage_fetch,
+    'combine': _stage_combine,
+    'rect': _stage_rect,
+    'cons': _stage_cons,
+    'anomalies': _stage_anomalies,
+    'resets': _stage_resets,
+    'chain': _stage_chain,
+    'hourly': _stage_hourly,
+    'rollup': _stage_rollup,
+    'save': _stage_save,
+    'push': _stage_push,
+}
+
+
+def _run_memoized(ctx, stage):
+    """Run `stage` or reuse its result cached under (stage, input key, config slice)."""
+    minutes = ctx.require_minutes()
+    if ctx.minutes_key is None:
+        ctx.minutes_key = frame_digest(minutes)
+    key = stage_key(stage, ctx.minutes_key, ctx.cfg, ctx.registry if stage == 'resets' else None)
+
+    hit, value = ctx.memo.get(key)
+    if hit:
+        logging.info("Pipeline: etapa %s sin cambios, se reutiliza el resultado", stage)
+    else:
+        STAGES[stage](ctx)
+        value = ctx.hourly if stage == 'hourly' else ctx.minutes
+        ctx.memo.put(key, value, label=stage)
+    if stage == 'hourly':
+        ctx.hourly = value
+    else:
+        ctx.minutes = value
+        ctx.minutes_key = key
+
+
+def stages_from_config(cfg):
+    """Stages of the enabled tasks in `STAGE_ORDER`; `save` is always included."""
+    selected = {'save'}
+    for task in cfg.get('tasks', []):
+        if not task.get('enabled'):
+            continue
+        stages = task.get('stages', TASK_STAGES.get(task.get('name')))
+        if stages is None:
+            logging.info("Pipeline: la tarea %s no tiene etapas en el motor", task.get('name'))
+            continue
+        selected.update(stages)
+    unknown = selected - set(STAGE_ORDER)
+    if unknown:
+        raise ValueError(f"Etapas desconocidas en la configuración: {sorted(unknown)}")
+    return [s for s in STAGE_ORDER if s in selected]
+
+
+def run_pipeline(cfg, stages=None, root=ROOT):
+    """Run `stages` (default: from the config tasks) in memory; return the `PipelineContext`."""
+    stages = stages or stages_from_config(cfg)
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        raise ValueError(f"Etapas desconocidas: {unknown}")
+    persist = set(cfg.get('pipeline', {}).get('persist', []))
+    ctx = PipelineContext(cfg, root)
+    # Sólo en paralelo si ninguna etapa intermedia de la cadena se memoiza o se guarda
+    if (ctx.workers > 1 and ctx.memo is None and all(s in stages for s in CHAIN_STAGES)
+            and not persist & set(CHAIN_STAGES)):
+        first = stages.index(CHAIN_STAGES[0])
+        stages = [s for s in stages if s not in CHAIN_STAGES]
+        stages.insert(first, 'chain')
+        logging.info("Pipeline: cadena minutal en paralelo con %d procesos", ctx.workers)
+    for stage in stages:
+        logging.info("Pipeline: etapa %s", stage)
+        memoizable = stage in MEMO_STAGES and not (stage == 'hourly' and store_from_config(cfg, root) is not None)
+        with ctx.report.stage(stage) as record:
+            if ctx.memo is not None and memoizable:
+                _run_memoized(ctx, stage)
+            else:
+                STAGES[stage](ctx)
+                if stage in MEMO_STAGES or stage in ('fetch', 'chain'):
+                    ctx.minutes_key = None
+            if ctx.minutes is not None:
+                record['rows'] = len(ctx.minutes)
+        if stage in persist and stage != 'save':
+            frame = ctx.hourly if stage == 'hourly' else ctx.require_minutes()
+            _save(ctx, frame, stage, to_csv=False, label=f"{stage} (intermedio)")
+
+    if cfg.get('instrumentation', {}).get('report', True):
+        ctx.outputs['report'] = ctx.report.write(os.path.join(root, 'procesado', 'Data'),
+                                                 f"run_report_{ctx.timestamp}")
+    return ctx
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pipeline de consumos en memoria")
+    parser.add_argument("--stages", help="Etapas separadas por comas (por defecto, las de las tareas habilitadas)")
+    args = parser.parse_args(argv)
+
+    with open(os.path.join(ROOT, 'consums_config.json'), 'r', encoding='utf-8') as f:
+        cfg = json.load(f)
+    configure_logging(cfg.get('instrumentation', {}).get('verbose', False))
+    stages = [s.strip() for s in args.stages.split(',')] if args.stages else None
+    try:
+        ctx = run_pipeline(cfg, stages)
+    except RuntimeError as e:
+        logging.error("%s", e)
+        return 1
+    for stage, path in ctx.outputs.items():
+        print(f"{stage}: {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,177 @@
+"""
+Capa de consulta por rango temporal sobre los consumos guardados.
+
+Los consumos minutales y horarios se guardan en formato largo (mismas columnas
+que las tablas del datalake, ver `pg_datalake.TABLES`) en un Parquet por tag,
+ordenado por tiempo y partido en grupos de filas de `row_group_rows`:
+
+    <dir>/minutes/<tag>.parquet, <dir>/hourly/<tag>.parquet, <dir>/<kind>/index.json
+
+`index.json` guarda, por tag, el primer y el último instante de cada grupo de
+filas. Una consulta abre sólo los ficheros de los tags pedidos y lee sólo los
+grupos de filas que se solapan con el rango, de modo que buscar una semana en
+un histórico de varios años no lee el resto.
+
+    get_consumption(['PBD07_FT001_TOT'], '2025-03-01', '2025-03-08', resolution='hour')
+
+Resoluciones: `minute` (tabla minutal), `hour` (horaria) y `day`/`month`
+(agregadas al vuelo desde la horaria). Requiere `pyarrow`.
+"""
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from pg_datalake import TABLES, frame_tags, to_long
+
+DEFAULT_QUERY_PATH = os.path.join('procesado', 'Data', 'query')
+DEFAULT_ROW_GROUP_ROWS = 10080  # una semana de minutos
+RESOLUTIONS = {'minute': 'minutes', 'hour': 'hourly', 'day': 'hourly', 'month': 'hourly'}
+
+
+def _ns(values):
+    return pd.DatetimeIndex(values).as_unit('ns').asi8
+
+
+class QueryStore:
+    """Per-tag, time-sorted Parquet files with a row-group time index."""
+
+    def __init__(self, base_dir=None, row_group_rows=DEFAULT_ROW_GROUP_ROWS, compression='zstd'):
+        self.base_dir = base_dir or os.path.join(os.path.dirname(os.path.dirname(__file__)), DEFAULT_QUERY_PATH)
+        self.row_group_rows = max(1, int(row_group_rows))
+        self.compression = compression
+        self._indexes = {}
+
+    def _tag_path(self, kind, tag):
+        return os.path.join(self.base_dir, kind, f"{tag}.parquet")
+
+    def _index_path(self, kind):
+        return os.path.join(self.base_dir, kind, 'index.json')
+
+    def index(self, kind):
+        """{tag: [[first_ns, last_ns, rows], ...]} with one entry per row group."""
+        if kind not in self._indexes:
+            path = self._index_path(kind)
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    self._indexes[kind] = json.load(f)
+            else:
+                self._indexes[kind] = {}
+        return self._indexes[kind]
+
+    def _write_index(self, kind):
+        path = self._index_path(kind)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.index(kind), f)
+        os.replace(tmp_path, path)
+
+    def _read_tag(self, kind, tag, groups=None, columns=None):
+        import pyarrow.parquet as pq
+
+        path = self._tag_path(kind, tag)
+        if not os.path.exists(path):
+            return None
+        pf = pq.ParquetFile(path)
+        table = pf.read(columns=columns) if groups is None else pf.read_row_groups(groups, columns=columns)
+        return table.to_pandas()
+
+    def write(self, frame: pd.DataFrame, kind):
+        """Upsert the rows of a wide `kind` frame ('minutes' or 'hourly'); only its tags are rewritten."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if frame is None or frame.empty:
+            return 0
+        os.makedirs(os.path.join(self.base_dir, kind), exist_ok=True)
+        index = self.index(kind)
+        written = 0
+        for tag in frame_tags(frame, kind):
+            rows = to_long(frame, kind, [tag]).drop(columns='tag')
+            rows['ts'] = pd.DatetimeIndex(rows['ts']).as_unit('ns')
+            old = self._read_tag(kind, tag)
+            if old is not None and not old.empty:
+                old = old[~old['ts'].isin(rows['ts'])]
+                rows = pd.concat([old, rows], ignore_index=True)
+            rows = rows.sort_values('ts', kind='stable').reset_index(drop=True)
+            path = self._tag_path(kind, tag)
+            pq.write_table(pa.Table.from_pandas(rows, preserve_index=False), path + '.tmp',
+                           row_group_size=self.row_group_rows, compression=self.compression)
+            os.replace(path + '.tmp', path)
+            ts = _ns(rows['ts'])
+            index[tag] = [[int(ts[i]), int(ts[min(i + self.row_group_rows, len(ts)) - 1]),
+                           int(min(self.row_group_rows, len(ts) - i))]
+                          for i in range(0, len(ts), self.row_group_rows)]
+            written += len(rows)
+        self._write_index(kind)
+        logging.info("Consulta: %s actualizado (%d tags)", kind, len(frame_tags(frame, kind)))
+        return written
+
+    def read(self, kind, tags, start=None, end=None, columns=None) -> pd.DataFrame:
+        """Long rows (tag, ts, fields) of `tags` with ts in [start, end), reading only the overlapping row groups."""
+        index = self.index(kind)
+        lo = _ns([pd.Timestamp(start)])[0] if start is not None else None
+        hi = _ns([pd.Timestamp(end)])[0] if end is not None else None
+        fields = [name for name, _, _ in TABLES[kind][1]]
+        columns = ['ts'] + [c for c in (columns or fields) if c != 'ts']
+        parts = []
+        for tag in ([tags] if isinstance(tags, str) else tags):
+            groups = [i for i, (first, last, _) in enumerate(index.get(tag, []))
+                      if (hi is None or first < hi) and (lo is None or last >= lo)]
+            if not groups:
+                continue
+            rows = self._read_tag(kind, tag, groups, columns)
+            ts = _ns(rows['ts'])
+            a = 0 if lo is None else np.searchsorted(ts, lo, side='left')
+            b = len(ts) if hi is None else np.searchsorted(ts, hi, side='left')
+            rows = rows.iloc[a:b]
+            rows.insert(0, 'tag', tag)
+            parts.append(rows)
+        if not parts:
+            return pd.DataFrame(columns=['tag'] + columns)
+        return pd.concat(parts, ignore_index=True)
+
+    def get_consumption(self, tags, start=None, end=None, resolution='hour', field=None):
+        """Consumption of `tags` in [start, end) at `resolution` ('minute', 'hour', 'day', 'month').
+
+        Returns long rows (tag, ts, fields); with `field` (e.g. 'cons_corrected')
+        a ts x tag frame of that field.
+        """
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"Resolución no soportada: {resolution}")
+        rows = self.read(RESOLUTIONS[resolution], tags, start, end)
+        if resolution in ('day', 'month') and not rows.empty:
+            ts = pd.DatetimeIndex(rows['ts'])
+            period = ts.floor('D') if resolution == 'day' else ts.to_period('M').to_timestamp()
+            rows = rows.assign(ts=period, corrections=rows['has_corrections'].astype(float), hours=1.0)
+            rows = (rows.groupby(['tag', 'ts'], sort=True)[['cons', 'cons_corrected', 'corrections', 'hours']]
+                    .sum().reset_index())
+        if field is None:
+            return rows
+        wide = rows.pivot(index='ts', columns='tag', values=field)
+        wide.columns.name = None
+        return wide.reindex(columns=[t for t in ([tags] if isinstance(tags, str) else tags) if t in wide.columns])
+
+
+def query_store_from_config(cfg, root_path):
+    """`QueryStore` configured in `storage.query_store`, or None when disabled."""
+    query_cfg = (cfg or {}).get('storage', {}).get('query_store', {})
+    if not query_cfg.get('enabled'):
+        return None
+    base_dir = query_cfg.get('path') or DEFAULT_QUERY_PATH
+    if not os.path.isabs(base_dir):
+        base_dir = os.path.join(root_path, base_dir)
+    compression = (cfg or {}).get('storage', {}).get('compression', 'zstd')
+    return QueryStore(base_dir, query_cfg.get('row_group_rows', DEFAULT_ROW_GROUP_ROWS), compression)
+
+
+def get_consumption(tags, start=None, end=None, resolution='hour', field=None, cfg=None, root_path=None):
+    """`QueryStore.get_consumption` on the store of `consums_config.json`."""
+    root_path = root_path or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if cfg is None:
+        with open(os.path.join(root_path, 'consums_config.json'), 'r', encoding='utf-8') as f:
+            cfg = json.load(f)
+    store = query_store_from_config(cfg, root_path) or QueryStore(os.path.join(root_path, DEFAULT_QUERY_PATH))
+    return store.get_consumption(tags, start, end, resolution, field)
@@ -0,0 +1,280 @@
+"""
+Agregados materializados diarios y mensuales por medidor y por emplazamiento.
+
+A partir de la tabla horaria de `aggregate_to_hourly` (o del almacén horario) se
+mantienen cuatro tablas largas, una fila por (clave, periodo):
+
+- `day_meter`   hora -> día, por tag,
+- `month_meter` día -> mes, por tag,
+- `day_site` y `month_site`: los anteriores sumados por emplazamiento
+  (los 5 primeros caracteres del tag, p. ej. `PBD07`).
+
+Cada fila lleva el consumo directo (`cons`), el corregido (`cons_corrected`),
+el número de horas con correcciones (`corrections`) y de horas agregadas
+(`hours`). La actualización es incremental: sólo se recalculan los días de las
+horas tocadas, los meses que los contienen y sus emplazamientos.
+
+Las consultas (`RollupStore.query` y `RollupStore.total`) se responden desde
+estas tablas sin leer minutos ni horas:
+
+    python procesado/rollups.py build
+    python procesado/rollups.py query --keys PBD07 --start 2025-01-01 --end 2025-04-01 --level month --scope site
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(__file__))
+from storage import (
+    DEFAULT_COMPRESSION,
+    FORMAT_EXTENSIONS,
+    find_latest,
+    load_frame,
+    resolve_format,
+    save_frame,
+    storage_settings,
+)
+
+DEFAULT_ROLLUP_PATH = os.path.join('procesado', 'Data', 'consumption_rollups')
+FIELDS = ('cons', 'cons_corrected', 'corrections', 'hours')
+LEVELS = ('day', 'month')
+SCOPES = ('meter', 'site')
+SITE_CHARS = 5
+
+
+def site_of(tags):
+    """Site of each tag: its first 5 characters."""
+    return pd.Index(tags).str.slice(0, SITE_CHARS)
+
+
+def _empty():
+    index = pd.MultiIndex.from_arrays([pd.Index([], dtype=object), pd.DatetimeIndex([])], names=['key', 'period'])
+    return pd.DataFrame({f: pd.Series(dtype=float) for f in FIELDS}, index=index)
+
+
+def daily_from_hourly(hourly: pd.DataFrame) -> pd.DataFrame:
+    """Day x tag rollup of an hourly frame; index (key, period), columns `FIELDS`."""
+    cons_cols = [c for c in hourly.columns if c.endswith('_hourly_cons')]
+    if not cons_cols or hourly.empty:
+        return _empty()
+    tags = [c[:-len('_hourly_cons')] for c in cons_cols]
+    day = pd.DatetimeIndex(hourly.index).floor('D')
+
+    def per_day(cols, how):
+        block = hourly.reindex(columns=cols)
+        block.columns = tags
+        grouped = block.groupby(day)
+        return grouped.sum() if how == 'sum' else grouped.count()
+
+    flags = hourly.reindex(columns=[f"{t}_hourly_has_corrections" for t in tags]).astype('boolean')
+    flags = flags.fillna(False).astype(float)
+    flags.columns = tags
+    parts = {
+        'cons': per_day(cons_cols, 'sum'),
+        'cons_corrected': per_day([f"{t}_hourly_cons_corrected" for t in tags], 'sum'),
+        'corrections': flags.groupby(day).sum(),
+        'hours': per_day(cons_cols, 'count').astype(float),
+    }
+    long = pd.DataFrame({name: frame.stack() for name, frame in parts.items()})
+    long.index = long.index.set_names(['period', 'key'])
+    return long.swaplevel().sort_index()[list(FIELDS)]
+
+
+def roll_up(meter_rows: pd.DataFrame, level=None, scope=None) -> pd.DataFrame:
+    """Sum `meter_rows` (index key, period) by month (`level='month'`) and/or by site (`scope='site'`)."""
+    if meter_rows.empty:
+        return _empty()
+    keys = meter_rows.index.get_level_values('key')
+    periods = pd.DatetimeIndex(meter_rows.index.get_level_values('period'))
+    if level == 'month':
+        periods = periods.to_period('M').to_timestamp()
+    if scope == 'site':
+        keys = site_of(keys)
+    grouped = meter_rows.groupby([pd.Index(keys, name='key'), pd.Index(periods, name='period')]).sum()
+    return grouped.sort_index()[list(FIELDS)]
+
+
+def _replace(frame, new, drop):
+    """`frame` without the rows where `drop` is True, plus `new`, sorted."""
+    kept = frame[~drop] if frame is not None and not frame.empty else None
+    parts = [p for p in (kept, new) if p is not None and not p.empty]
+    return pd.concat(parts).sort_index() if parts else _empty()
+
+
+class RollupStore:
+    """Materialized day/month x meter/site rollups with incremental update and range queries."""
+
+    def __init__(self, path_stem=None, fmt=None, compression=DEFAULT_COMPRESSION):
+        self.path_stem = path_stem or os.path.join(os.path.dirname(os.path.dirname(__file__)), DEFAULT_ROLLUP_PATH)
+        self.fmt = resolve_format(fmt)
+        self.compression = compression
+        self.tables = {(level, scope): _empty() for level in LEVELS for scope in SCOPES}
+        self._load()
+
+    def _path(self, level, scope):
+        return f"{self.path_stem}_{level}_{scope}{FORMAT_EXTENSIONS[self.fmt]}"
+
+    def _load(self):
+        for level, scope in self.tables:
+            path = self._path(level, scope)
+            if os.path.exists(path):
+                flat = load_frame(path)
+                flat['period'] = pd.to_datetime(flat['period'])
+                self.tables[(level, scope)] = flat.set_index(['key', 'period']).sort_index()[list(FIELDS)]
+
+    def save(self):
+        paths = []
+        for (level, scope), frame in self.tables.items():
+            stem = self._path(level, scope)[:-len(FORMAT_EXTENSIONS[self.fmt])]
+            paths.append(save_frame(frame.reset_index(), stem, self.fmt, self.compression))
+        return paths
+
+    def update(self, hourly: pd.DataFrame, touched_hours=None):
+        """Recompute the days of `touched_hours` (default: every hour of `hourly`) and what depends on them.
+
+        `hourly` must hold every hour of the touched days (the hourly store does).
+        """
+        if hourly is None or hourly.empty:
+            return 0
+        hours = pd.DatetimeIndex(hourly.index if touched_hours is None else touched_hours)
+        days = hours.floor('D').unique()
+        if len(days) == 0:
+            return 0
+        rows = pd.DatetimeIndex(hourly.index).floor('D').isin(days)
+        new_days = daily_from_hourly(hourly[rows])
+        tags = [c[:-len('_hourly_cons')] for c in hourly.columns if c.endswith('_hourly_cons')]
+
+        def meter_drop(frame, periods):
+            return (frame.index.get_level_values('key').isin(tags)
+                    & frame.index.get_level_values('period').isin(periods))
+
+        day_meter = self.tables[('day', 'meter')]
+        day_meter = _replace(day_meter, new_days, meter_drop(day_meter, days))
+        self.tables[('day', 'meter')] = day_meter
+
+        months = days.to_period('M').to_timestamp().unique()
+        day_months = pd.DatetimeIndex(day_meter.index.get_level_values('period')).to_period('M').to_timestamp()
+        in_months = day_months.isin(months)
+        affected = day_meter[in_months & day_meter.index.get_level_values('key').isin(tags)]
+        month_meter = self.tables[('month', 'meter')]
+        self.tables[('month', 'meter')] = _replace(month_meter, roll_up(affected, level='month'),
+                                                   meter_drop(month_meter, months))
+
+        # Emplazamientos: se recalculan los periodos afectados con todos los medidores del emplazamiento
+        sites = site_of(tags).unique()
+        for level, periods in (('day', days), ('month', months)):
+            meters = self.tables[(level, 'meter')]
+            mask = (site_of(meters.index.get_level_values('key')).isin(sites)
+                    & meters.index.get_level_values('period').isin(periods))
+            site_table = self.tables[(level, 'site')]
+            drop = (site_table.index.get_level_values('key').isin(sites)
+                    & site_table.index.get_level_values('period').isin(periods))
+            self.tables[(level, 'site')] = _replace(site_table, roll_up(meters[mask], scope='site'), drop)
+        logging.info("Agregados: %d días y %d meses recalculados para %d tags", len(days), len(months), len(tags))
+        return len(days)
+
+    def query(self, keys=None, start=None, end=None, level='day', scope='meter'):
+        """Rows of `keys` (tags or sites; default all) with period in [start, end)."""
+        if level not in LEVELS or scope not in SCOPES:
+            raise ValueError(f"Nivel o ámbito no soportado: {level}/{scope}")
+        table = self.tables[(level, scope)]
+        mask = np.ones(len(table), dtype=bool)
+        periods = table.index.get_level_values('period')
+        if keys is not None:
+            mask &= table.index.get_level_values('key').isin(list(keys))
+        if start is not None:
+            mask &= periods >= pd.Timestamp(start)
+        if end is not None:
+            mask &= periods < pd.Timestamp(end)
+        return table[mask]
+
+    def total(self, keys=None, start=None, end=None, scope='meter'):
+        """Totals per key over [start, end): whole months from `month`, the partial edges from `day`.
+
+        Bounds are taken at day precision.
+        """
+        days = self.tables[('day', scope)].index.get_level_values('period')
+        if len(days) == 0:
+            return pd.DataFrame(columns=list(FIELDS))
+        start = pd.Timestamp(start).floor('D') if start is not None else days.min()
+        end = pd.Timestamp(end).ceil('D') if end is not None else days.max() + pd.Timedelta(days=1)
+        first_month = start if start == start.to_period('M').to_timestamp() \
+            else (start.to_period('M') + 1).to_timestamp()
+        last_month = end.to_period('M').to_timestamp()
+        if first_month >= last_month:
+            parts = [self.query(keys, start, end, 'day', scope)]
+        else:
+            parts = [self.query(keys, start, first_month, 'day', scope),
+                     self.query(keys, first_month, last_month, 'month', scope),
+                     self.query(keys, last_month, end, 'day', scope)]
+        rows = pd.concat([p for p in parts if not p.empty] or [_empty()])
+        return rows.groupby(level='key').sum()[list(FIELDS)]
+
+
+def rollups_from_config(cfg, root_path):
+    """`RollupStore` configured in `postprocess.rollups`, or None when disabled."""
+    rollup_cfg = (cfg or {}).get('postprocess', {}).get('rollups', {})
+    if not rollup_cfg.get('enabled'):
+        return None
+    stem = rollup_cfg.get('path') or DEFAULT_ROLLUP_PATH
+    if not os.path.isabs(stem):
+        stem = os.path.join(root_path, stem)
+    fmt, compression, _ = storage_settings(cfg)
+    return RollupStore(stem, fmt, compression)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Agregados diarios y mensuales por medidor y emplazamiento")
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build', help="Recalcular los agregados desde la tabla horaria")
+    build.add_argument('--hourly', help="Fichero horario (por defecto, el almacén horario o el último horario)")
+    query = sub.add_parser('query', help="Consultar los agregados")
+    query.add_argument('--keys', nargs='+')
+    query.add_argument('--start')
+    query.add_argument('--end')
+    query.add_argument('--level', choices=LEVELS, default='day')
+    query.add_argument('--scope', choices=SCOPES, default='meter')
+    query.add_argument('--total', action='store_true', help="Total del rango por clave")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with open(os.path.join(root, 'consums_config.json'), 'r', encoding='utf-8') as f:
+        cfg = json.load(f)
+    store = rollups_from_config(cfg, root) or RollupStore(os.path.join(root, DEFAULT_ROLLUP_PATH),
+                                                          *storage_settings(cfg)[:2])
+
+    if args.command == 'build':
+        from hourly_store import store_from_config
+
+        hourly = load_frame(args.hourly) if args.hourly else None
+        if hourly is None:
+            hourly_store = store_from_config(cfg, root)
+            if hourly_store is not None and hourly_store.frame is not None:
+                hourly = hourly_store.frame
+            else:
+                path = find_latest(os.path.join(root, 'procesado', 'Data'), 'consumption_hourly_2')
+                hourly = load_frame(path) if path else None
+        if hourly is None:
+            logging.error("No hay datos horarios")
+            return 1
+        store.update(hourly)
+        for path in store.save():
+            print(path)
+        return 0
+
+    if args.total:
+        result = store.total(args.keys, args.start, args.end, args.scope)
+    else:
+        result = store.query(args.keys, args.start, args.end, args.level, args.scope)
+    print(result.to_string())
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
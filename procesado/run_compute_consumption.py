@@ -1,7 +1,6 @@
 import os
 import sys
-import glob
-import pandas as pd
+import json
 
 # Add current directory and parent to Python path
 current_dir = os.path.dirname(__file__)
@@ -10,63 +9,65 @@ sys.path.insert(0, current_dir)
 sys.path.insert(0, parent_dir)
 
 from compute_consumption import append_minute_consumption, attach_anomalies_to_df, detect_counter_resets
+from counter_registry import CounterRegistry
+from memo import MemoCache, memoize
+from storage import export_csv, find_latest, load_frame, save_frame, storage_settings
 
 
 def find_latest_all_minutes(path_root: str):
-    pattern = os.path.join(path_root, 'adquisicion', 'minute_data', 'all_minutes*.csv')
-    files = glob.glob(pattern)
-    if not files:
-        # fallback to plain all_minutes.csv
-        fallback = os.path.join(path_root, 'adquisicion', 'minute_data', 'all_minutes.csv')
-        return fallback if os.path.exists(fallback) else None
-    # return latest by modification time
-    return max(files, key=os.path.getmtime)
+    # latest combined dataset (typed formats first, legacy/exported CSV otherwise)
+    return find_latest(os.path.join(path_root, 'adquisicion', 'minute_data'), 'all_minutes')
+
+
+def load_config(path_root: str):
+    config_path = os.path.join(path_root, 'consums_config.json')
+    if not os.path.exists(config_path):
+        return {}
+    with open(config_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
 
 
 def main():
     root = os.path.dirname(os.path.dirname(__file__))
     src = find_latest_all_minutes(root)
     if src is None:
-        print('No combined all_minutes CSV found in adquisicion/minute_data')
+        print('No combined all_minutes dataset found in adquisicion/minute_data')
         return 2
 
-    print(f'Loading combined CSV: {src}')
-    # Try to detect CSV format first
-    try:
-        df = pd.read_csv(src, sep=';', decimal=',')
-        print('Loaded CSV with European format (sep=";", decimal=",")')
-    except Exception as e:
-        print(f'European format failed: {e}, trying auto-detection...')
-        df = pd.read_csv(src, sep=None, engine='python')
-        print('Loaded CSV with auto-detected format')
+    print(f'Loading combined dataset: {src}')
+    df = load_frame(src)
     
-    # try to parse index if there is a timestamp column
-    if 'timestamp' in df.columns:
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        df = df.set_index('timestamp')
-    elif df.index.name in ('timestamp', 'timeStamp'):
-        df.index = pd.to_datetime(df.index)
-    
-    print(f'Loaded DataFrame with columns: {list(df.columns)}')
+    print(f'Loaded DataFrame: {df.shape[0]} rows x {df.shape[1]} columns')
+
+    # Con memo.enabled cada paso reutiliza su resultado si la entrada y la configuración no cambian
+    cfg = load_config(root)
+    cache = MemoCache.from_config(cfg, root)
 
     # Step 1: Calculate consumption
-    result = append_minute_consumption(df)
+    result = memoize(append_minute_consumption, cache, cfg)(df)
     
     # Step 2: Detect regular anomalies (negative compensations)
     anom_cols = [c for c in result.columns if c.endswith('_anom')]
     if anom_cols:
         has_values = any(result[col].notna().sum() > 0 for col in anom_cols)
         if has_values:
-            print(f'Found existing anomaly columns with data: {anom_cols}')
+            print(f'Found {len(anom_cols)} existing anomaly columns with data')
         else:
-            print(f'Generating regular anomalies: {anom_cols}')
-            result = attach_anomalies_to_df(result)
+            print(f'Generating regular anomalies for {len(anom_cols)} columns')
+            result = memoize(attach_anomalies_to_df, cache, cfg)(result)
     else:
         print('Generating anomaly columns...')
-        result = attach_anomalies_to_df(result)
+        result = memoize(attach_anomalies_to_df, cache, cfg)(result)
     
     # Step 3: Detect and mark counter resets (this happens AFTER regular anomalies)
-    result = detect_counter_resets(result)
+    compute_cfg = cfg.get('postprocess', {}).get('compute', {})
+    registry_path = compute_cfg.get('counter_registry')
+    if registry_path and not os.path.isabs(registry_path):
+        registry_path = os.path.join(root, registry_path)
+    registry = CounterRegistry.load(registry_path)
+    result = memoize(detect_counter_resets, cache, cfg)(
+        result, thresholds=compute_cfg.get('reset_thresholds'), registry=registry)
+    registry.save()
     
     # Count final anomalies
     total_anomalies = sum(result[col].notna().sum() for col in anom_cols)
@@ -76,10 +77,14 @@ def main():
     os.makedirs(out_dir, exist_ok=True)
     from datetime import datetime
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    out_path = os.path.join(out_dir, f'consumption_minutes_with_anom_{timestamp}.csv')
-    result.to_csv(out_path, index=True, sep=';', decimal=',')
+    out_stem = os.path.join(out_dir, f'consumption_minutes_with_anom_{timestamp}')
+    fmt, compression, to_csv = storage_settings(cfg)
+    out_path = save_frame(result, out_stem, fmt, compression)
     print(f'Saved minute consumption to: {out_path}')
-    print(f'Final DataFrame columns: {list(result.columns)}')
+    if to_csv:
+        export_csv(result, out_stem + '.csv')
+        print(f'Exported minute consumption to: {out_stem}.csv')
+    print(f'Final DataFrame: {result.shape[0]} rows x {result.shape[1]} columns')
     return 0
 
 
@@ -0,0 +1,139 @@
+"""
+Capa de almacenamiento para los ficheros intermedios del pipeline.
+
+Los datos entre etapas (minutales combinados, consumos con anomalías y
+agregación horaria) se guardan por defecto en un formato columnar tipado y
+comprimido (Parquet) que conserva los dtypes (totales enteros, anomalías float,
+indicadores bool e índice datetime) sin volver a parsear texto. El CSV europeo
+(sep=';', decimal=',') queda sólo como formato de exportación y de lectura de
+ficheros antiguos.
+
+Parquet y Feather requieren `pyarrow`; si no está instalado se usa un pickle
+comprimido, que también conserva los dtypes.
+"""
+import glob
+import logging
+import os
+
+import pandas as pd
+
+FORMAT_EXTENSIONS = {
+    'parquet': '.parquet',
+    'feather': '.feather',
+    'pickle': '.pkl.gz',
+    'csv': '.csv',
+}
+DEFAULT_FORMAT = 'parquet'
+DEFAULT_COMPRESSION = 'zstd'
+INDEX_NAMES = ('timeStamp', 'timestamp')
+
+
+def _has_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def storage_settings(cfg=None):
+    """Return (format, compression, export_csv) from the `storage` section of the config."""
+    storage_cfg = (cfg or {}).get('storage', {})
+    fmt = storage_cfg.get('format', DEFAULT_FORMAT)
+    if fmt not in FORMAT_EXTENSIONS:
+        raise ValueError(f"Formato de almacenamiento no soportado: {fmt}")
+    return fmt, storage_cfg.get('compression', DEFAULT_COMPRESSION), bool(storage_cfg.get('export_csv', False))
+
+
+def resolve_format(fmt=None):
+    fmt = fmt or DEFAULT_FORMAT
+    if fmt in ('parquet', 'feather') and not _has_pyarrow():
+        logging.warning("pyarrow no está instalado: se usa pickle comprimido en lugar de %s", fmt)
+        return 'pickle'
+    return fmt
+
+
+def save_frame(df: pd.DataFrame, path_stem, fmt=None, compression=DEFAULT_COMPRESSION):
+    """Save `df` as `<path_stem><ext>` in the given format and return the path."""
+    fmt = resolve_format(fmt)
+    path = path_stem + FORMAT_EXTENSIONS[fmt]
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    if fmt == 'parquet':
+        df.to_parquet(path, compression=compression, index=True)
+    elif fmt == 'feather':
+        # Feather no guarda índices: se guarda como columna y se restaura al leer
+        df.reset_index().to_feather(path, compression=compression)
+    elif fmt == 'pickle':
+        df.to_pickle(path, compression='gzip')
+    else:
+        export_csv(df, path)
+    return path
+
+
+def export_csv(df: pd.DataFrame, path):
+    """Export `df` as European CSV (sep=';', decimal=',')."""
+    df.to_csv(path, sep=';', decimal=',', index=True)
+    return path
+
+
+def _format_of(path):
+    for fmt, ext in FORMAT_EXTENSIONS.items():
+        if path.endswith(ext):
+            return fmt
+    raise ValueError(f"Extensión de fichero no reconocida: {path}")
+
+
+def _set_time_index(df):
+    for cand in INDEX_NAMES:
+        if cand in df.columns:
+            df[cand] = pd.to_datetime(df[cand])
+            return df.set_index(cand)
+    return df
+
+
+def read_csv_any(path):
+    """Read a legacy CSV, European (sep=';', decimal=',') or standard, by sniffing its header."""
+    with open(path, 'r', encoding='utf-8') as f:
+        header = f.readline()
+    if ';' in header:
+        df = pd.read_csv(path, sep=';', decimal=',')
+    elif ',' in header:
+        df = pd.read_csv(path)
+    else:
+        df = pd.read_csv(path, sep=None, engine='python')
+    return _set_time_index(df)
+
+
+def load_frame(path) -> pd.DataFrame:
+    """Load a frame written by `save_frame` (or a legacy CSV) with its dtypes and index."""
+    fmt = _format_of(path)
+    if fmt == 'parquet':
+        return pd.read_parquet(path)
+    if fmt == 'feather':
+        df = pd.read_feather(path)
+        df = df.set_index(df.columns[0])
+        if df.index.name == 'index':
+            df.index.name = None
+        return df
+    if fmt == 'pickle':
+        return pd.read_pickle(path, compression='gzip')
+    return read_csv_any(path)
+
+
+def find_latest(directory, prefix):
+    """Most recently written file `<prefix>*` in `directory`, preferring typed formats on a tie.
+
+    A CSV with the same stem as a typed file is the export copy written next to
+    it and is skipped; any other CSV (legacy outputs, or `all_minutes` written by
+    `download_minute_data.py` on its own) competes by modification time.
+    """
+    candidates = []
+    for ext in FORMAT_EXTENSIONS.values():
+        candidates.extend(glob.glob(os.path.join(directory, f"{prefix}*{ext}")))
+    typed_stems = {p[:-len(FORMAT_EXTENSIONS[_format_of(p)])] for p in candidates if _format_of(p) != 'csv'}
+    candidates = [p for p in candidates
+                  if _format_of(p) != 'csv' or p[:-len(FORMAT_EXTENSIONS['csv'])] not in typed_stems]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda p: (os.path.getmtime(p), _format_of(p) != 'csv'))
@@ -0,0 +1,313 @@
+"""
+Procesado por bloques temporales (streaming) para periodos que no caben en memoria.
+
+Los bloques de totales crudos (pares H/L o columnas `*_TOT`) se procesan en
+orden con la misma cadena que el modo en memoria (`compute_minute_chain` +
+`aggregate_to_hourly`). Como la cadena es independiente por tag, cada tag se
+corta por su cuenta y entre bloques sólo se arrastra su estado de frontera:
+
+- la última lectura emitida (fila de contexto que siembra el ffill de rect_0),
+- las filas todavía abiertas: la última minuta sin siguiente, una racha de
+  ceros abierta o un consumo negativo pendiente de su positivo,
+- la hora parcial en curso.
+
+Un tag se emite hasta la última frontera de hora `b` en la que su lectura
+`b - 1` es válida y no hay par negativo+positivo en `(b - 1, b)`. Así ninguna
+distribución de anomalías ni regla rect_0 posterior puede modificar filas ya
+emitidas y la salida es idéntica a la ejecución en memoria. Los tags que se
+cortan en la misma frontera (y que comparten la última fila emitida) se
+procesan juntos; cada segmento lleva sólo sus columnas y `concat_segments`
+los vuelve a unir.
+
+Un tramo de ceros/NaN sigue abierto aunque el tag no haya tenido todavía ninguna
+lectura válida: la anomalía de su primera lectura válida puede repartirse hacia
+atrás sobre ese tramo. Un tag sin datos o parado a cero retiene sólo sus propias
+filas; mientras sus bloques no traen lecturas no se recalcula. Un tag que
+aparece por primera vez en un bloque posterior empieza en ese bloque.
+
+Uso desde línea de comandos (lee la caché minutal de `adquisicion`):
+
+    python procesado/streaming.py [--chunk-days 7]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(__file__))
+from compute_consumption import compute_minute_chain, rect_0_invalid
+from compute_hourly_consumption import aggregate_to_hourly
+from storage import save_frame, storage_settings
+
+
+def iter_frame_chunks(df: pd.DataFrame, rows: int):
+    """Yield consecutive row slices of an in-memory frame."""
+    for start in range(0, len(df), rows):
+        yield df.iloc[start:start + rows]
+
+
+def iter_cache_chunks(cache, tags, start_ts, end_ts, chunk_days=7):
+    """Yield wide raw frames of `chunk_days` days read tag by tag from a `MinuteCache`."""
+    step = int(chunk_days * 86400)
+    for c_start in range(int(start_ts), int(end_ts) + 1, step):
+        c_end = min(c_start + step - 1, int(end_ts))
+        frames = [cache.load(tag, c_start, c_end) for tag in tags]
+        frames = [f for f in frames if f is not None]
+        if frames:
+            yield pd.concat(frames, axis=1).sort_index()
+
+
+def _tag_key(column):
+    """Tag of a raw column: `X` for `X_TOT`, `X_TOT_H` and `X_TOT_L`; other columns are their own key."""
+    for suffix in ('_TOT_H', '_TOT_L', '_TOT'):
+        if column.endswith(suffix):
+            return column[:-len(suffix)]
+    return column
+
+
+def _key_columns(columns, key):
+    """Columns of `columns` that belong to `key` (raw or chain outputs)."""
+    return [c for c in columns if c == key or c.startswith(key + '_TOT')]
+
+
+def _validity(minutes):
+    """(tot_cols, valid) for the combined `*_TOT` readings of `minutes`."""
+    tot_cols = [c for c in minutes.columns if c.endswith('_TOT')]
+    totals = minutes[tot_cols].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+    valid = ~rect_0_invalid(totals) & ~np.isnan(totals)
+    return tot_cols, valid
+
+
+def _safe_boundaries(minutes, offset, keys):
+    """{key: largest emit boundary `b` (row position in `minutes`) or None if no row is safe yet for that tag}.
+
+    Rows before `offset` are context already emitted.
+    """
+    n = len(minutes)
+    last = n - 3  # cons[b] must be final: needs the total at b + 2
+    hours = minutes.index.floor('h')
+    hour_start = np.zeros(n, dtype=bool)
+    hour_start[1:] = hours[1:] != hours[:-1]
+    b = np.arange(offset + 1, max(last + 1, offset + 1))
+    b = b[hour_start[b]]
+    if len(b) == 0:
+        return dict.fromkeys(keys)
+
+    tot_cols, valid = _validity(minutes)
+    cons = minutes[[f"{c}_rect_0_cons" for c in tot_cols]].to_numpy(dtype=float)
+    pair = np.zeros_like(valid)
+    pair[:-1] = (cons[:-1] < 0) & (cons[1:] > 0)
+
+    # Row b - 1 must leave nothing open for the tag: a valid reading (seeds
+    # rect_0 and stops zero-run walks) and no negative+positive pair starting
+    # there. A zero/NaN prefix before a tag's first valid reading stays open too
+    closed = (valid & ~pair)[b - 1]
+    found = closed[::-1].argmax(axis=0)
+    per_tag = {_tag_key(c): (int(b[len(b) - 1 - found[j]]) if closed[:, j].any() else None)
+               for j, c in enumerate(tot_cols)}
+    # Columns without totals pass through the chain unchanged and never hold a boundary
+    return {k: per_tag.get(k, int(b[-1])) for k in keys}
+
+
+def _fill_hour_gap(hourly, last_hour):
+    """Prepend the empty hours between the previous segment and `hourly`."""
+    if last_hour is None or hourly.empty:
+        return hourly
+    expected = pd.date_range(last_hour + pd.Timedelta(hours=1), hourly.index[-1], freq='h', name=hourly.index.name)
+    if len(expected) == len(hourly):
+        return hourly
+    filled = hourly.reindex(expected)
+    for col in filled.columns:
+        if col.endswith('_has_corrections'):
+            filled[col] = filled[col].astype(object).fillna(False).astype(bool)
+        else:
+            filled[col] = filled[col].fillna(0.0)
+    return filled
+
+
+def _has_readings(frame):
+    """True if any raw value of `frame` is a non-zero reading (a zero/NaN run cannot close otherwise)."""
+    values = frame.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+    return bool(np.any(np.nan_to_num(values) != 0))
+
+
+def stream_minute_chain(chunks, anomaly_rule='pair_run', thresholds=None, registry=None, max_carry_rows=None):
+    """Process raw total chunks in time order; yield (minute_segment, hourly_segment).
+
+    Each tag is cut on its own: a segment covers the rows up to the tags'
+    boundary and only the columns of the tags that could be cut there, so a tag
+    without data or stuck at zero is held back alone while the others are
+    emitted. `concat_segments` over the yielded segments gives exactly
+    `compute_minute_chain` and `aggregate_to_hourly` over the whole period.
+    With a `registry`, maxima confirmed in early segments are already used by
+    later ones; the caller saves it once the stream is consumed.
+    """
+    columns = []
+    # Tags with the same last emitted row share a group: keys, context (last
+    # emitted raw row, seeds rect_0 and zero-run walks) and raw rows not emitted yet
+    groups = []
+
+    def process(group, final):
+        keys, context, carry = group['keys'], group['context'], group['carry']
+        buf = pd.concat(carry) if len(carry) > 1 else carry[0]
+        frame = buf if context is None else pd.concat([context, buf])
+        offset = 0 if context is None else 1
+        minutes = compute_minute_chain(frame, anomaly_rule=anomaly_rule, thresholds=thresholds, registry=registry)
+        if final:
+            boundaries = dict.fromkeys(keys, len(frame))
+        else:
+            boundaries = _safe_boundaries(minutes, offset, keys)
+        last_hour = None if context is None else context.index[0].floor('h')
+
+        held = [k for k in keys if boundaries[k] is None]
+        remaining = []
+        if held:
+            held_cols = [c for k in held for c in _key_columns(frame.columns, k)]
+            remaining.append({'keys': held, 'context': None if context is None else context[held_cols],
+                              'carry': [buf[held_cols]]})
+        segments = []
+        for boundary in sorted({b for b in boundaries.values() if b is not None}):
+            cut = [k for k in keys if boundaries[k] == boundary]
+            raw_cols = [c for k in cut for c in _key_columns(frame.columns, k)]
+            segment = minutes.iloc[offset:boundary][[c for k in cut for c in _key_columns(minutes.columns, k)]]
+            hourly = _fill_hour_gap(aggregate_to_hourly(segment), last_hour)
+            segments.append((segment, hourly))
+            if boundary < len(frame):
+                remaining.append({'keys': cut, 'context': frame.iloc[boundary - 1:boundary][raw_cols],
+                                  'carry': [frame.iloc[boundary:][raw_cols]]})
+        return segments, remaining
+
+    def merge(pending):
+        """Join groups with the same last emitted row and first pending row (their raw rows line up)."""
+        merged = {}
+        for group in pending:
+            key = (None if group['context'] is None else group['context'].index[0], group['carry'][0].index[0])
+            if key not in merged:
+                merged[key] = group
+                continue
+            into = merged[key]
+            into['keys'] = into['keys'] + group['keys']
+            if group['context'] is not None:
+                into['context'] = pd.concat([into['context'], group['context']], axis=1)
+            into['carry'] = [pd.concat([pd.concat(into['carry']), pd.concat(group['carry'])], axis=1)]
+        return list(merged.values())
+
+    for chunk in chunks:
+        new_cols = [c for c in chunk.columns if c not in columns]
+        columns.extend(new_cols)
+        chunk = chunk.reindex(columns=columns)
+        new_keys = list(dict.fromkeys(_tag_key(c) for c in new_cols))
+
+        pending = []
+        for group in groups:
+            cols = [c for k in group['keys'] for c in _key_columns(columns, k)]
+            group['carry'].append(chunk[cols])
+            if group['context'] is not None:
+                group['context'] = group['context'].reindex(columns=cols)
+            # A group whose recent rows hold only zeros/NaN cannot close yet: keep appending
+            recent = pd.concat([group['carry'][-2].iloc[-3:], chunk[cols]]) if len(group['carry']) > 1 else chunk[cols]
+            if not _has_readings(recent):
+                pending.append(group)
+                continue
+            segments, remaining = process(group, final=False)
+            yield from segments
+            pending.extend(remaining)
+        if new_keys:
+            cols = [c for k in new_keys for c in _key_columns(columns, k)]
+            segments, remaining = process({'keys': new_keys, 'context': None, 'carry': [chunk[cols]]}, final=False)
+            yield from segments
+            pending.extend(remaining)
+        groups = merge(pending)
+
+        if max_carry_rows:
+            for group in groups:
+                rows = sum(len(c) for c in group['carry'])
+                if rows > max_carry_rows:
+                    logging.warning("Streaming: %d filas arrastradas sin frontera segura para %d tags "
+                                    "(racha de ceros abierta)", rows, len(group['keys']))
+
+    for group in groups:
+        if sum(len(c) for c in group['carry']):
+            segments, _ = process(group, final=True)
+            yield from segments
+
+
+def _join_columns(frames):
+    """Join frames holding different columns over (possibly) different rows, keeping each column's dtype."""
+    pieces = {}
+    for frame in frames:
+        for col in frame.columns:
+            pieces.setdefault(col, []).append(frame[col])
+    if not pieces:
+        return pd.DataFrame()
+    return pd.concat([pd.concat(p) for p in pieces.values()], axis=1).sort_index()
+
+
+def concat_segments(segments):
+    """(minutes, hourly) frames reassembled from the segments yielded by `stream_minute_chain`."""
+    segments = list(segments)
+    return _join_columns([m for m, _ in segments]), _join_columns([h for _, h in segments])
+
+
+def run_streaming(chunks, out_dir, stem, cfg=None, anomaly_rule='pair_run', thresholds=None, registry=None):
+    """Stream `chunks` through the chain writing minute parts and one hourly file.
+
+    Minute segments go to `<out_dir>/<stem>_minutes/part-NNNNN.<ext>`; hourly
+    segments are small and are gathered into `<out_dir>/<stem>_hourly.<ext>`.
+    Returns (minute_parts_dir, hourly_path).
+    """
+    fmt, compression, _ = storage_settings(cfg)
+    parts_dir = os.path.join(out_dir, f"{stem}_minutes")
+    os.makedirs(parts_dir, exist_ok=True)
+
+    hourly_parts = []
+    for k, (segment, hourly) in enumerate(stream_minute_chain(
+            chunks, anomaly_rule=anomaly_rule, thresholds=thresholds, registry=registry)):
+        save_frame(segment, os.path.join(parts_dir, f"part-{k:05d}"), fmt, compression)
+        hourly_parts.append(hourly)
+        logging.info("Streaming: segmento %d hasta %s (%d filas)", k, segment.index[-1], len(segment))
+
+    hourly_path = None
+    if hourly_parts:
+        hourly_path = save_frame(_join_columns(hourly_parts), os.path.join(out_dir, f"{stem}_hourly"), fmt, compression)
+    return parts_dir, hourly_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Procesado por bloques de la caché minutal")
+    parser.add_argument("--chunk-days", type=float, default=7)
+    args = parser.parse_args(argv)
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, root)
+    from adquisicion.minute_cache import MinuteCache, parse_local_ts
+    from datetime import datetime
+
+    with open(os.path.join(root, 'consums_config.json'), 'r', encoding='utf-8') as f:
+        cfg = json.load(f)
+    compute_cfg = cfg.get('postprocess', {}).get('compute', {})
+    fetch_task = next((t for t in cfg.get('tasks', []) if t.get('name') == 'fetch_api_data'), {})
+
+    cache = MinuteCache(fetch_task.get('cache_dir'))
+    tags = [t for t in cache.tags() if not fetch_task.get('filter') or fetch_task['filter'] in t]
+    period = cfg.get('period', {})
+    chunks = iter_cache_chunks(cache, tags, parse_local_ts(period['start']), parse_local_ts(period['end']),
+                               args.chunk_days)
+
+    stem = f"consumption_stream_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    parts_dir, hourly_path = run_streaming(
+        chunks, os.path.join(root, 'procesado', 'Data'), stem, cfg,
+        anomaly_rule=compute_cfg.get('anomaly_rule', 'pair_run'),
+        thresholds=compute_cfg.get('reset_thresholds'))
+    print(f"Minutales: {parts_dir}")
+    print(f"Horario: {hourly_path}")
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+    raise SystemExit(main())
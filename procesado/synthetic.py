@@ -0,0 +1,93 @@
+"""
+Generador sintético y reproducible de totalizadores minutales en pares H/L de 16 bits.
+
+Produce el mismo formato que la descarga (`<tag>_TOT_H` / `<tag>_TOT_L`,
+índice minutal `timeStamp`) con las incidencias que trata el procesado:
+
+- rachas de ceros (el medidor reporta 0 durante varios minutos),
+- pares de compensación negativo/positivo (una lectura baja seguida de la normal),
+- reinicios de contador: el totalizador da la vuelta al llegar a su máximo
+  (una potencia de 10, entre 10^7 y 10^9),
+- huecos (minutos sin lectura) y picos aislados.
+
+Con la misma semilla se obtienen exactamente los mismos datos, de modo que los
+benchmarks (`benchmarks/run_benchmarks.py`) son comparables entre commits.
+"""
+import numpy as np
+import pandas as pd
+
+TAG_PREFIXES = ('PBD07', 'EMD02', 'PBD11', 'EMD05')
+
+
+def synthetic_tags(n):
+    """`n` tag names shaped like the real ones (5-character site prefix + meter)."""
+    return [f"{TAG_PREFIXES[k % len(TAG_PREFIXES)]}_FT{k:03d}" for k in range(n)]
+
+
+def _runs(rng, n, count, min_len, max_len):
+    """Start and length of `count` random runs inside [1, n - 2)."""
+    starts = rng.integers(1, max(2, n - max_len - 2), count)
+    lengths = rng.integers(min_len, max_len + 1, count)
+    return starts, lengths
+
+
+def synthetic_totals(tags=10, days=7, start='2025-01-01 00:00:00', seed=0, zero_runs=2, compensations=4,
+                     resets=1, gaps=2, spikes=1):
+    """Raw minute totals for `tags` meters over `days` days as H/L pairs.
+
+    Event counts are per tag and per 30 days; `resets` sets the consumption rate so
+    the counter wraps that many times at its power-of-ten maximum. Returns (frame, events) where
+    `events` maps each tag to the minute positions of the injected events.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(days * 1440)
+    index = pd.date_range(start, periods=n, freq='min', name='timeStamp')
+    names = synthetic_tags(tags) if isinstance(tags, int) else list(tags)
+    scale = max(days / 30, 1 / 30)
+
+    def count(per_month):
+        return int(rng.poisson(per_month * scale))
+
+    columns = {}
+    events = {}
+    for tag in names:
+        # Consumo por minuto con ciclo diario y ruido
+        counter_max = int(10 ** rng.integers(7, 10))
+        start_total = int(rng.integers(0, counter_max // 2))
+        wraps = count(resets)
+        # Con reinicios, el consumo se ajusta para que el contador dé `wraps` vueltas en counter_max
+        rate = ((wraps + 0.5) * counter_max - start_total) / n if wraps else rng.uniform(5, 200)
+        daily = 1 + 0.5 * np.sin(np.arange(n) * 2 * np.pi / 1440 + rng.uniform(0, 2 * np.pi))
+        cons = rng.poisson(rate * daily)
+        unwrapped = start_total + np.cumsum(cons, dtype=np.int64)
+        totals = unwrapped % counter_max
+        tag_events = {'resets': [], 'zero_runs': [], 'compensations': [], 'gaps': [], 'spikes': []}
+        tag_events['resets'] = (np.flatnonzero(np.diff(unwrapped // counter_max)) + 1).tolist()
+
+        starts, lengths = _runs(rng, n, count(zero_runs), 3, 180)
+        for s, length in zip(starts, lengths):
+            totals[s:s + length] = 0
+            tag_events['zero_runs'].append((int(s), int(length)))
+
+        for pos in rng.integers(1, n - 2, count(compensations)):
+            if totals[pos] > 0 and totals[pos + 1] > 0:
+                totals[pos] = max(totals[pos - 1] - int(rng.integers(1, 500)), 1)
+                tag_events['compensations'].append(int(pos))
+
+        for pos in rng.integers(1, n - 1, count(spikes)):
+            totals[pos] = min(totals[pos] + int(rng.integers(10 ** 6, 10 ** 7)), 2 ** 32 - 1)
+            tag_events['spikes'].append(int(pos))
+
+        high = (totals >> 16).astype(float)
+        low = (totals & 0xFFFF).astype(float)
+        starts, lengths = _runs(rng, n, count(gaps), 1, 60)
+        for s, length in zip(starts, lengths):
+            high[s:s + length] = np.nan
+            low[s:s + length] = np.nan
+            tag_events['gaps'].append((int(s), int(length)))
+
+        columns[f"{tag}_TOT_H"] = high
+        columns[f"{tag}_TOT_L"] = low
+        events[tag] = tag_events
+
+    return pd.DataFrame(columns, index=index), events
@@ -0,0 +1,134 @@
+"""
+Representación compacta en formato largo (tag, timestamp, valor) de los datos minutales.
+
+El combinado ancho (`pd.concat(axis=1)`) es una matriz float64 con NaN allí
+donde los tags no comparten timestamps. `LongTagFrame` guarda sólo las lecturas
+existentes: el tag como código categórico, el timestamp como desplazamiento
+int32 en minutos desde `epoch` y el valor como uint32 (los totales de 16 y 32
+bits caben sin pérdida).
+
+Es un formato de almacenamiento y de paso entre la descarga y el procesado, no
+de cálculo: quien entrega los datos al procesado los pivota con `to_wide()`
+(el pipeline, `parallel` y `run_compute_for_minutes.py`), y las funciones de
+`compute_consumption` trabajan sólo sobre el formato ancho.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+
+INDEX_NAME = 'timeStamp'
+
+
+def _compact_values(values):
+    """uint32 if every value is a non-negative integer that fits, float64 otherwise."""
+    values = np.asarray(values, dtype=float)
+    if values.size == 0 or (np.all(values >= 0) and np.all(values <= np.iinfo(np.uint32).max)
+                            and np.all(np.mod(values, 1) == 0)):
+        return values.astype(np.uint32)
+    return values
+
+
+class LongTagFrame:
+    """Minute readings of many tags as (tag, minute offset, value) rows.
+
+    Attributes
+    ----------
+    tag : pd.Categorical
+        Tag of each row (codes are int8/int16 for the usual tag counts).
+    minute : np.ndarray[int32]
+        Minutes since `epoch`.
+    value : np.ndarray[uint32] (float64 if the readings are not integral)
+    epoch : pd.Timestamp
+    """
+
+    def __init__(self, tag, minute, value, epoch):
+        self.tag = pd.Categorical(tag)
+        self.minute = np.asarray(minute, dtype=np.int32)
+        self.value = np.asarray(value)
+        self.epoch = pd.Timestamp(epoch)
+
+    @classmethod
+    def from_frames(cls, frames, epoch=None):
+        """Build from one-column frames (or Series) named by tag, indexed by timestamp."""
+        series = []
+        for frame in frames:
+            s = frame.iloc[:, 0] if isinstance(frame, pd.DataFrame) else frame
+            s = s.dropna()
+            series.append(s)
+        series = [s for s in series if len(s)]
+        names = [str(s.name) for s in series]
+        if not series:
+            return cls(pd.Categorical([], categories=names), [], np.array([], dtype=np.uint32),
+                       epoch or pd.Timestamp(0))
+
+        index = [pd.DatetimeIndex(s.index) for s in series]
+        if epoch is None:
+            epoch = min(ix.min() for ix in index).floor('min')
+        epoch = pd.Timestamp(epoch)
+
+        # Nanosegundos con independencia de la resolución del índice (pandas >= 2 admite 's'/'ms'/'us')
+        stamps = np.concatenate([ix.to_numpy(dtype='datetime64[ns]').view(np.int64) for ix in index])
+        step = pd.Timedelta(minutes=1).value
+        offsets = stamps - epoch.value
+        off_grid = int(np.count_nonzero(offsets % step))
+        if off_grid:
+            logging.warning("LongTagFrame: %d lecturas fuera de minuto exacto se asignan a su minuto", off_grid)
+
+        codes = np.repeat(np.arange(len(series)), [len(s) for s in series])
+        tag = pd.Categorical.from_codes(codes, categories=names)
+        values = _compact_values(np.concatenate([s.to_numpy(dtype=float) for s in series]))
+        return cls(tag, offsets // step, values, epoch)
+
+    @classmethod
+    def from_wide(cls, df: pd.DataFrame, epoch=None):
+        """Build from a wide timestamp-indexed frame (NaN cells are padding and are dropped)."""
+        return cls.from_frames([df[[c]] for c in df.columns], epoch=epoch)
+
+    def __len__(self):
+        return len(self.minute)
+
+    @property
+    def empty(self):
+        return len(self) == 0
+
+    @property
+    def tags(self):
+        return list(self.tag.categories)
+
+    @property
+    def timestamps(self):
+        return self.epoch + pd.to_timedelta(self.minute.astype(np.int64), unit='min')
+
+    def memory_usage(self):
+        """Bytes used by the tag codes, offsets and values."""
+        return int(self.tag.codes.nbytes + self.minute.nbytes + self.value.nbytes)
+
+    def select(self, tags):
+        """Rows of the given tags only."""
+        mask = np.isin(self.tag, list(tags))
+        tag = self.tag[mask].remove_unused_categories()
+        return LongTagFrame(tag, self.minute[mask], self.value[mask], self.epoch)
+
+    def head(self, n=5):
+        return self.to_long().head(n)
+
+    def to_long(self) -> pd.DataFrame:
+        """Decoded (tag, timeStamp, value) rows."""
+        return pd.DataFrame({'tag': self.tag, INDEX_NAME: self.timestamps, 'value': self.value})
+
+    def to_wide(self, tags=None) -> pd.DataFrame:
+        """Pivot to the wide float64 frame `pd.concat(frames, axis=1)` would build.
+
+        The index is the sorted union of minutes; if a (tag, minute) pair is
+        repeated the last reading wins.
+        """
+        src = self if tags is None else self.select(tags)
+        names = src.tags
+        minutes, rows = np.unique(src.minute, return_inverse=True)
+        wide = np.full((len(minutes), len(names)), np.nan)
+        wide[rows, src.tag.codes] = src.value
+        index = pd.DatetimeIndex(src.epoch + pd.to_timedelta(minutes.astype(np.int64), unit='min'),
+                                 name=INDEX_NAME)
+        return pd.DataFrame(wide, index=index, columns=names)
+
@@ -0,0 +1,180 @@
+"""
+Regresión de las reglas vectorizadas: `negative_run`, `pair_run` y `detect_counter_resets`
+deben dar exactamente lo mismo que los bucles originales (minuto a minuto) sobre datos sintéticos.
+"""
+import contextlib
+import io
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'procesado'))
+
+from compute_consumption import (
+    append_minute_consumption,
+    apply_rect_0,
+    attach_anomalies_to_df,
+    combine_tot_high_low,
+    detect_counter_resets,
+    determine_counter_max,
+    distribute_negative_compensations,
+)
+from synthetic import synthetic_totals
+
+
+def _reference_negative_run(cons, totals_raw):
+    """Original while-loop of `distribute_negative_compensations` for one column."""
+    n = len(cons)
+    anom = np.zeros(n, dtype=float)
+    i = 0
+    while i < n - 1:
+        cur, nxt = cons[i], cons[i + 1]
+        if cur < 0 and nxt > 0:
+            net = cur + nxt
+            if net > 0:
+                j = i
+                while j >= 0 and (totals_raw[j] == 0 or np.isnan(totals_raw[j])):
+                    j -= 1
+                start, end = j + 1, i
+                if end - start + 1 > 0:
+                    anom[start:end + 1] += net / (end - start + 1)
+            i += 2
+        else:
+            i += 1
+    return anom
+
+
+def _reference_pair_run(cons, totals_raw):
+    """Original while-loop of `attach_anomalies_to_df` for one column."""
+    n = len(cons)
+    anom = np.zeros(n, dtype=float)
+    i = 0
+    while i < n - 1:
+        cur, nxt = cons[i], cons[i + 1]
+        if cur < 0 and nxt > 0:
+            net = cur + nxt
+            if net > 0:
+                j = i - 1
+                while j >= 0 and totals_raw[j] == 0:
+                    j -= 1
+                start, end = j + 1, i + 1
+                count = end - start + 1
+                if count > 2:
+                    per = net / count
+                    for k in range(start, end + 1):
+                        anom[k] += per
+                else:
+                    anom[i] += net / 2
+                    anom[i + 1] += net / 2
+            i += 2
+        else:
+            i += 1
+    return anom
+
+
+def _reference_resets(df, total_columns):
+    """Original per-reset loop of `detect_counter_resets` (threshold -1,000,000)."""
+    result = df.copy()
+    for col in total_columns:
+        totals = df[col].astype(float)
+        consumption = totals.shift(-1) - totals
+        anom_col = f"{col}_anom"
+        if anom_col not in result.columns:
+            continue
+        for reset_idx in consumption[consumption < -1000000].index:
+            reset_pos = totals.index.get_loc(reset_idx)
+            if reset_pos < len(totals) - 1:
+                prev_value = totals.iloc[reset_pos]
+                curr_value = totals.iloc[reset_pos + 1]
+                counter_max = determine_counter_max(prev_value)
+                result.loc[reset_idx, anom_col] = (counter_max - prev_value) + curr_value
+    return result
+
+
+def _total_columns(df):
+    rect_cols = [c for c in df.columns if c.endswith('_rect_0')]
+    return rect_cols or [c for c in df.columns if c.endswith('_TOT')]
+
+
+def _raw(df, col, raw_suffix=''):
+    """Column each original loop walked for zero runs (`negative_run` looked for `<tag>_TOT_TOT`)."""
+    raw_col = col.replace('_rect_0', raw_suffix) if col.endswith('_rect_0') else col
+    return pd.to_numeric(df[raw_col if raw_col in df.columns else col], errors='coerce').to_numpy(dtype=float)
+
+
+def _minutes(seed, rect):
+    """Synthetic minute frame with `_cons` columns, with or without the rect_0 step.
+
+    The first reading after each zero run is set just below the last one before
+    it, so `negative_run` (which only fires at the end of a zero run) has work.
+    """
+    raw, events = synthetic_totals(tags=6, days=3, seed=seed, zero_runs=60, compensations=300, resets=20,
+                                   gaps=20, spikes=10)
+    with contextlib.redirect_stdout(io.StringIO()):
+        df = combine_tot_high_low(raw)
+        for tag, tag_events in events.items():
+            totals = df[f"{tag}_TOT"].to_numpy(copy=True)
+            for start, length in tag_events['zero_runs']:
+                end = start + length
+                if end < len(totals) and totals[start - 1] > 10 and totals[end] > 0:
+                    totals[end] = totals[start - 1] - 7
+            df[f"{tag}_TOT"] = totals
+        if rect:
+            df = apply_rect_0(df)
+        return append_minute_consumption(df)
+
+
+@pytest.mark.parametrize('rect', [True, False])
+@pytest.mark.parametrize('seed', range(4))
+def test_negative_run_matches_loop(seed, rect):
+    df = _minutes(seed, rect)
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = distribute_negative_compensations(df)
+    for col in _total_columns(df):
+        anom = _reference_negative_run(df[f"{col}_cons"].astype(float).to_numpy(), _raw(df, col, '_TOT'))
+        expected = pd.Series(anom, index=df.index, name=f"{col}_anom").replace(0.0, np.nan)
+        pd.testing.assert_series_equal(result[f"{col}_anom"], expected, check_exact=True)
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_negative_run_over_raw_zero_runs_matches_loop(seed):
+    # rect_0 consumption checked against the raw totals, so the zero-run walk has work
+    df = _minutes(seed, rect=True)
+    columns = [c for c in df.columns if c.endswith('_TOT')]
+    for col in columns:
+        df[f"{col}_cons"] = df[f"{col}_rect_0_cons"]
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = distribute_negative_compensations(df, total_columns=columns)
+    assert result.notna().any().any()
+    for col in columns:
+        anom = _reference_negative_run(df[f"{col}_cons"].astype(float).to_numpy(), _raw(df, col))
+        expected = pd.Series(anom, index=df.index, name=f"{col}_anom").replace(0.0, np.nan)
+        pd.testing.assert_series_equal(result[f"{col}_anom"], expected, check_exact=True)
+
+
+@pytest.mark.parametrize('rect', [True, False])
+@pytest.mark.parametrize('seed', range(4))
+def test_pair_run_matches_loop(seed, rect):
+    df = _minutes(seed, rect)
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = attach_anomalies_to_df(df.copy())
+    assert any(result[f"{c}_anom"].notna().any() for c in _total_columns(df))
+    for col in _total_columns(df):
+        cons = pd.to_numeric(df[f"{col}_cons"], errors='coerce').fillna(0).to_numpy()
+        anom = _reference_pair_run(cons, _raw(df, col))
+        expected = pd.Series(anom, index=df.index, name=f"{col}_anom").replace(0.0, np.nan)
+        pd.testing.assert_series_equal(result[f"{col}_anom"], expected, check_exact=True)
+
+
+@pytest.mark.parametrize('rect', [True, False])
+@pytest.mark.parametrize('seed', range(4))
+def test_counter_resets_match_loop(seed, rect):
+    with contextlib.redirect_stdout(io.StringIO()):
+        df = attach_anomalies_to_df(_minutes(seed, rect))
+        result = detect_counter_resets(df)
+    expected = _reference_resets(df, _total_columns(df))
+    assert not result.equals(df)
+    pd.testing.assert_frame_equal(result, expected, check_exact=True)
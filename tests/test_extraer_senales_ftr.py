@@ -0,0 +1,85 @@
+"""
+Catálogo de señales FTR contra una copia en SQLite en memoria: regla de selección,
+caché con TTL y consulta de versión.
+"""
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'adquisicion'))
+
+from extraer_senales_ftr import catalog_version, resolve_from_catalog, resolve_signals
+
+CATALOG = [
+    'PBD07_FTR001TOT_L', 'PBD07_FTR001TOT_H', 'PBD07_FTR002TOT',
+    'PBD08_FTR001TOT', 'PBD08_FTR002TOTX', 'PBD08_LS_FTR1TOT',
+    'EMD02_FTR003TOT_H', 'EMD02_FTR_P_1TOT_L', 'ETD01_FTR001TOT',
+]
+CFG = {'tasks': [{'name': 'fetch_api_data', 'filter': 'PBD07'}], 'catalog': {'ttl_hours': 1}}
+
+
+class _NoDatabase:
+    def get_data(self, query):
+        raise AssertionError("catalog queried while the cache is valid")
+
+
+@pytest.fixture
+def catalog():
+    conn = sqlite3.connect(':memory:')
+    conn.execute("ATTACH ':memory:' AS ga_landing")
+    conn.execute("CREATE TABLE ga_landing.ite_sql4_cfg_tags (tag TEXT, descripcion TEXT)")
+    # Filas repetidas como en el catálogo real (una por atributo)
+    conn.executemany("INSERT INTO ga_landing.ite_sql4_cfg_tags VALUES (?, ?)", [(t, 'x') for t in CATALOG] * 2)
+    queries = []
+    conn.set_trace_callback(queries.append)
+    yield conn, queries
+    conn.close()
+
+
+def test_selection_rule(catalog):
+    conn, _ = catalog
+    # TOT_L/H primero; un TOT sólo si su prefijo de 5 caracteres no tiene L/H
+    assert resolve_from_catalog(conn) == ['EMD02_FTR003TOT_H', 'PBD07_FTR001TOT_H', 'PBD07_FTR001TOT_L',
+                                          'PBD08_FTR001TOT']
+    assert resolve_from_catalog(conn, 'PBD07') == ['PBD07_FTR001TOT_H', 'PBD07_FTR001TOT_L']
+    assert resolve_from_catalog(conn, 'PBD08') == ['PBD08_FTR001TOT']
+
+
+def test_version_probe_is_one_aggregate_scan(catalog):
+    conn, queries = catalog
+    catalog_version(conn, 'PBD07')
+    probe = [q for q in queries if q.lstrip().upper().startswith('SELECT')]
+    assert len(probe) == 1
+    assert 'DISTINCT' not in probe[0] and 'ORDER BY' not in probe[0] and 'group_concat' not in probe[0]
+
+
+def test_cache_ttl_and_version(catalog, tmp_path):
+    conn, queries = catalog
+    path = str(tmp_path / 'catalog.json')
+    tags = resolve_signals(CFG, conn, path, now=0)
+    assert tags == ['PBD07_FTR001TOT_H', 'PBD07_FTR001TOT_L']
+
+    # Dentro del TTL no se toca la base de datos
+    assert resolve_signals(CFG, _NoDatabase(), path, now=100) == tags
+
+    # TTL caducado y catálogo sin cambios: sólo la consulta de versión
+    queries.clear()
+    assert resolve_signals(CFG, conn, path, now=7200) == tags
+    assert len([q for q in queries if 'count(*)' in q]) == 1
+    assert not [q for q in queries if 'WITH candidatos' in q]
+
+    # Renombrar un tag que no es ni el primero ni el último (mismo recuento) cambia la versión
+    version = catalog_version(conn, 'PBD07')
+    conn.execute("UPDATE ga_landing.ite_sql4_cfg_tags SET tag = 'PBD07_FTR001XTOT_L' "
+                 "WHERE tag = 'PBD07_FTR001TOT_L'")
+    assert catalog_version(conn, 'PBD07') != version
+    queries.clear()
+    tags = resolve_signals(CFG, conn, path, now=7200 * 3)
+    assert tags == ['PBD07_FTR001TOT_H', 'PBD07_FTR001XTOT_L']
+    assert [q for q in queries if 'WITH candidatos' in q]
+
+    # Un tag nuevo también
+    conn.execute("INSERT INTO ga_landing.ite_sql4_cfg_tags VALUES ('PBD07_FTR005TOT_L', 'x')")
+    assert 'PBD07_FTR005TOT_L' in resolve_signals(CFG, conn, path, now=7200 * 5)
@@ -0,0 +1,53 @@
+"""
+Regresión del almacén horario incremental: horas anteriores a la marca de agua.
+"""
+import contextlib
+import io
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'procesado'))
+
+from compute_consumption import compute_minute_chain
+from compute_hourly_consumption import aggregate_to_hourly
+from hourly_store import HourlyStore, update_hourly_store
+
+
+def _minutes(hours=100):
+    idx = pd.date_range('2025-01-01', periods=hours * 60, freq='min', name='timeStamp')
+    rng = np.random.default_rng(0)
+    totals = pd.DataFrame({'A_TOT': 1000 + np.cumsum(rng.integers(0, 40, len(idx))).astype(float),
+                           'B_TOT': 50 + np.cumsum(rng.integers(0, 5, len(idx))).astype(float)}, index=idx)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return compute_minute_chain(totals)
+
+
+def test_backfilled_earlier_range_is_aggregated(tmp_path):
+    minutes = _minutes()
+    store = HourlyStore(str(tmp_path / 'hourly'), fmt='pickle')
+    update_hourly_store(minutes.iloc[len(minutes) // 2:], store)
+    store.save()
+
+    store = HourlyStore(str(tmp_path / 'hourly'), fmt='pickle')
+    update_hourly_store(minutes, store)
+    expected = aggregate_to_hourly(minutes)
+    assert len(store.frame) == 100
+    pd.testing.assert_frame_equal(store.frame[expected.columns], expected, check_freq=False)
+
+
+def test_changed_minutes_before_high_water_mark_are_reaggregated(tmp_path):
+    minutes = _minutes()
+    store = HourlyStore(str(tmp_path / 'hourly'), fmt='pickle')
+    update_hourly_store(minutes, store)
+    store.save()
+
+    corrected = minutes.copy()
+    corrected.iloc[600:660, corrected.columns.get_loc('A_TOT_rect_0_cons')] += 1
+    store = HourlyStore(str(tmp_path / 'hourly'), fmt='pickle')
+    touched = update_hourly_store(corrected, store)
+    assert pd.Timestamp('2025-01-01 10:00') in touched and len(touched) < 10
+    expected = aggregate_to_hourly(corrected)
+    pd.testing.assert_frame_equal(store.frame[expected.columns], expected, check_freq=False)
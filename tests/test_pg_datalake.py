@@ -0,0 +1,63 @@
+"""
+Carga en PostgreSQL (COPY -> staging -> INSERT ... ON CONFLICT) contra una base local.
+
+Se omite si no hay psycopg2 o no se puede conectar a `CONSUMS_TEST_PG_DSN`
+(por defecto `host=localhost dbname=postgres user=postgres`).
+"""
+import os
+import sys
+import uuid
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'procesado'))
+
+from pg_datalake import push_frames
+
+psycopg2 = pytest.importorskip('psycopg2')
+from psycopg2.pool import ThreadedConnectionPool  # noqa: E402
+
+DSN = os.environ.get('CONSUMS_TEST_PG_DSN', 'host=localhost dbname=postgres user=postgres')
+
+
+@pytest.fixture
+def pool():
+    try:
+        pool = ThreadedConnectionPool(1, 2, DSN)
+    except psycopg2.OperationalError as exc:
+        pytest.skip(f"Sin PostgreSQL local: {exc}")
+    schema = f"consums_test_{uuid.uuid4().hex[:8]}"
+    yield pool, schema
+    conn = pool.getconn()
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    conn.commit()
+    pool.putconn(conn)
+    pool.closeall()
+
+
+def _minutes(offset=0.0):
+    idx = pd.date_range('2025-01-01', periods=120, freq='min', name='timeStamp')
+    frame = {}
+    for tag in ('A_TOT', 'B_TOT', 'C_TOT'):
+        frame[f"{tag}_rect_0"] = np.arange(120, dtype=float) + offset
+        frame[f"{tag}_rect_0_cons"] = np.ones(120)
+        frame[f"{tag}_rect_0_anom"] = np.nan
+    return pd.DataFrame(frame, index=idx)
+
+
+def test_push_is_idempotent_upsert(pool):
+    pool, schema = pool
+    loaded = push_frames({'minutes': _minutes()}, pool, workers=2, schema=schema, batch_rows=150)
+    assert loaded == {'minutes': 360}
+    push_frames({'minutes': _minutes(offset=1000)}, pool, workers=2, schema=schema, batch_rows=150)
+
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT count(*), min(total), max(total) FROM {schema}.consumo_minutal")
+            assert cur.fetchone() == (360, 1000.0, 1119.0)
+    finally:
+        pool.putconn(conn)
@@ -0,0 +1,65 @@
+"""
+Regresión del modo streaming: la salida por bloques debe ser idéntica a la ejecución en memoria.
+"""
+import contextlib
+import io
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'procesado'))
+
+from compute_consumption import compute_minute_chain
+from compute_hourly_consumption import aggregate_to_hourly
+from streaming import concat_segments, iter_frame_chunks, stream_minute_chain
+
+
+def _leading_zero_run_frame(n=3000, first_valid=1500):
+    """Tag A starts late (leading zeros, as combine_hl_arrays leaves NaN H/L) with 1000, 990, 1100..."""
+    idx = pd.date_range('2025-01-01', periods=n, freq='min', name='timeStamp')
+    a = np.zeros(n)
+    a[first_valid] = 1000
+    a[first_valid + 1] = 990
+    a[first_valid + 2:] = 1100 + np.arange(n - first_valid - 2)
+    b = np.arange(n, dtype=float) + 5
+    return pd.DataFrame({'A_TOT': a, 'B_TOT': b}, index=idx)
+
+
+def _stream(df, rows, rule):
+    """(segments, one-shot minutes, one-shot hourly) for `df` streamed in chunks of `rows`."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        minutes = compute_minute_chain(df, anomaly_rule=rule)
+        hourly = aggregate_to_hourly(minutes)
+        segments = list(stream_minute_chain(iter_frame_chunks(df, rows), anomaly_rule=rule))
+    return segments, minutes, hourly
+
+
+def _assert_matches(segments, minutes, hourly):
+    streamed_minutes, streamed_hourly = concat_segments(segments)
+    pd.testing.assert_frame_equal(streamed_minutes, minutes, check_freq=False, check_like=True)
+    pd.testing.assert_frame_equal(streamed_hourly, hourly, check_freq=False, check_like=True)
+
+
+def test_stream_matches_in_memory_with_leading_zero_run():
+    df = _leading_zero_run_frame()
+    for rule in ('pair_run', 'negative_run'):
+        _assert_matches(*_stream(df, 400, rule))
+
+
+def test_dead_tag_does_not_hold_back_the_others():
+    n = 20000
+    idx = pd.date_range('2025-01-01', periods=n, freq='min', name='timeStamp')
+    rng = np.random.default_rng(0)
+    live = 1000 + np.cumsum(rng.integers(0, 50, n)).astype(float)
+    live[5000:5030] = 0  # closed zero run
+    df = pd.DataFrame({'A_TOT': live, 'B_TOT': 7 + np.arange(n, dtype=float), 'DEAD_TOT': np.nan}, index=idx)
+    for rule in ('pair_run', 'negative_run'):
+        segments, minutes, hourly = _stream(df, 1440, rule)
+        _assert_matches(segments, minutes, hourly)
+
+        live_ends = [m.index[-1] for m, _ in segments if 'A_TOT' in m.columns]
+        assert len(live_ends) > 5 and live_ends[0] < idx[2 * 1440]
+        dead = [m for m, _ in segments if 'DEAD_TOT' in m.columns]
+        assert len(dead) == 1 and len(dead[0]) == n and 'A_TOT' not in dead[0].columns